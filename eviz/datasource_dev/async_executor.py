@@ -0,0 +1,147 @@
+"""
+The purpose of this file is to run the blocking h5py/pyhdf work of a Datasource from asyncio code (e.g. the
+iViz server) without blocking the event loop.
+
+    • All blocking reads run in one bounded thread pool shared by the process
+    • Each file has its own concurrency limit (default: one read at a time per file)
+    • Readers lock their file handles themselves (see handle_pool.py), so any reader work can run here
+    • A cancelled read stops being awaited immediately; since a running thread can't be interrupted, the
+      file's slot is only given back once the thread finishes its current read
+"""
+
+import os
+import weakref
+import asyncio
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = min(8, (os.cpu_count() or 1) + 4)
+PER_FILE_LIMIT = 1
+
+_executor = None
+_executor_lock = threading.Lock()
+_limiters = weakref.WeakKeyDictionary()   # event loop -> FileLimiter
+_limiters_lock = threading.Lock()
+
+
+class FileLimiter:
+    """
+    Hands out per-file asyncio semaphores on one event loop and forgets them once a file is idle.
+    """
+
+    def __init__(self, limit):
+        """
+        Creates a limiter with no files
+        :param limit: the maximum number of concurrent reads per file
+        """
+        self.limit = limit
+        self.semaphores = {}   # path -> [semaphore, number of users]
+
+    async def acquire(self, path):
+        """
+        Waits for a read slot of a file
+        :param path: a full path String
+        """
+        entry = self.semaphores.setdefault(path, [asyncio.Semaphore(self.limit), 0])
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:   # Cancelled while waiting
+            self.forget(path)
+            raise
+
+    def release(self, path):
+        """
+        Gives back a read slot of a file
+        :param path: a full path String
+        """
+        self.semaphores[path][0].release()
+        self.forget(path)
+
+    def forget(self, path):
+        """
+        Drops one user of a file's semaphore and removes the semaphore once nobody uses it
+        :param path: a full path String
+        """
+        entry = self.semaphores[path]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.semaphores[path]
+
+
+def configure(max_workers = None, per_file_limit = None):
+    """
+    Changes the size of the shared thread pool and/or the per-file concurrency limit
+    (an existing pool is shut down after its queued work finishes)
+    :param max_workers: the maximum number of reader threads or 'None' to keep the current value
+    :param per_file_limit: the maximum number of concurrent reads per file or 'None' to keep the current value
+    """
+    global MAX_WORKERS, PER_FILE_LIMIT, _executor
+
+    with _executor_lock:
+        if max_workers is not None:
+            MAX_WORKERS = max_workers
+            if _executor is not None:
+                _executor.shutdown(wait = False)
+                _executor = None
+        if per_file_limit is not None:
+            PER_FILE_LIMIT = per_file_limit
+            with _limiters_lock:   # Files that are already being read keep their semaphore until idle
+                for limiter in _limiters.values():
+                    limiter.limit = per_file_limit
+
+
+def get_executor():
+    """
+    Returns the shared thread pool, creating it on first use
+    :return: a ThreadPoolExecutor object
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers = MAX_WORKERS, thread_name_prefix = 'eviz-read')
+        return _executor
+
+
+def get_limiter():
+    """
+    Returns the per-file limiter of the running event loop (each live loop, e.g. one per thread, has its own)
+    :return: a FileLimiter object
+    """
+    loop = asyncio.get_running_loop()
+    with _limiters_lock:
+        if loop not in _limiters:
+            for closed in [other for other in _limiters if other.is_closed()]:   # Not yet garbage collected
+                del _limiters[closed]
+            _limiters[loop] = FileLimiter(PER_FILE_LIMIT)
+        return _limiters[loop]
+
+
+async def run_blocking(path, func, *args, **kwargs):
+    """
+    Runs a blocking read of a file in the shared thread pool within the file's concurrency limit
+    :param path: the full path String of the file being read
+    :param func: a callable doing the blocking work
+    :return: the function's result
+    """
+    loop = asyncio.get_running_loop()
+    limiter = get_limiter()
+
+    await limiter.acquire(path)
+    try:
+        future = get_executor().submit(functools.partial(func, *args, **kwargs))
+    except BaseException:
+        limiter.release(path)
+        raise
+
+    def release_slot(_):   # Gives the slot back when the thread is done (or cancelled before it starts)
+        try:
+            loop.call_soon_threadsafe(limiter.release, path)
+        except RuntimeError:   # The event loop is already closed
+            pass
+
+    future.add_done_callback(release_slot)
+
+    return await asyncio.wrap_future(future)
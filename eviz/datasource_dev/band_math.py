@@ -0,0 +1,151 @@
+"""
+The purpose of this file is to evaluate band-math expressions (spectral indices) over Landsat surface
+reflectance tile by tile, with fill/scale/offset decoding and the cfmask cloud mask fused into the same pass
+(see LandsatReader.compute).
+
+    • Each tile of raw integer bands is turned into the result with one numexpr expression:
+          where(<masked cfmask class>, nan, <expression with each band replaced by
+                where(band == fill, nan, band * scale + offset)>)
+      so no restored float64 band, and no full-size temporary, is ever made
+    • Without numexpr, tiles are decoded into float32 buffers and evaluated with NumPy (temporaries stay
+      tile-sized)
+    • Expressions use SDS names (sr_band1, ...), band aliases (blue, green, red, nir, swir1, swir2, mapped by
+      the sensor in the filename) and the functions in FUNCTIONS
+
+Built-in indices (INDICES): NDVI, NBR, NDWI (McFeeters), EVI
+
+cfmask classes: 0 clear, 1 water, 2 cloud shadow, 3 snow, 4 cloud, 255 fill
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import re
+
+import numpy as np
+
+import filename_meta
+
+try:
+    import numexpr
+except ImportError:   # Falls back to tiled NumPy evaluation
+    numexpr = None
+
+INDICES = {'ndvi': '(nir - red) / (nir + red)',
+           'nbr': '(nir - swir2) / (nir + swir2)',
+           'ndwi': '(green - nir) / (green + nir)',
+           'evi': '2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)'}
+
+# Band aliases -> SDS names: TM/ETM+ (Landsat 4-7) and OLI (Landsat 8)
+BANDS = {'TM': {'blue': 'sr_band1', 'green': 'sr_band2', 'red': 'sr_band3', 'nir': 'sr_band4',
+                'swir1': 'sr_band5', 'swir2': 'sr_band7'},
+         'OLI': {'blue': 'sr_band2', 'green': 'sr_band3', 'red': 'sr_band4', 'nir': 'sr_band5',
+                 'swir1': 'sr_band6', 'swir2': 'sr_band7'}}
+
+# Functions allowed in expressions (supported by numexpr; NumPy equivalents for the fallback)
+FUNCTIONS = {'where': np.where, 'sqrt': np.sqrt, 'abs': np.abs, 'log': np.log, 'log10': np.log10, 'exp': np.exp,
+             'arctan2': np.arctan2}
+
+CLOUD_CLASSES = (2, 4)   # cfmask cloud shadow & cloud
+
+NAME = re.compile(r'(?<![\w.])[A-Za-z_]\w*')
+
+
+# II. HELPER FUNCTIONS - - - - - - -
+def get_bands(filename):
+    """
+    Returns the band aliases of a Landsat file's sensor
+    :param filename: a filename or path String
+    :return: a Python dictionary of alias String keys and SDS name String values
+    """
+    meta = filename_meta.parse_landsat(filename)
+    return BANDS['OLI'] if meta is not None and meta['sensor'] in ('C', 'O') else BANDS['TM']
+
+
+def expand(expression, filename):
+    """
+    Expands a built-in index name and band aliases into an expression of SDS names
+    :param expression: an index name (e.g. 'NDVI') or an expression String
+    :param filename: the Landsat filename (for the sensor's band aliases)
+    :return: a tuple of the expanded expression String and a result name String
+    """
+    name = expression.strip().lower()
+    if name in INDICES:
+        expression = INDICES[name]
+    else:
+        name = 'expression'
+
+    bands = get_bands(filename)
+    return NAME.sub(lambda match: bands.get(match.group(), match.group()), expression), name
+
+
+def get_names(expression):
+    """
+    Returns the variable names of an expression (names that aren't functions)
+    :param expression: an expression String
+    :return: a Python list of name Strings in order of appearance
+    """
+    return list(dict.fromkeys(name for name in NAME.findall(expression) if name not in FUNCTIONS))
+
+
+def fuse(expression, restore, mask_var = None, mask_values = ()):
+    """
+    Returns the numexpr expression of one fused pass over raw bands
+    :param expression: an expression String of SDS names
+    :param restore: a Python dictionary of SDS name keys and (fill, scale, offset) values
+    :param mask_var: the name String of the mask variable or 'None'
+    :param mask_values: the raw mask values that make a pixel NaN
+    :return: an expression String (NaN is the local 'nan_')
+    """
+    def decode(match):
+        name = match.group()
+        if name not in restore:
+            return name
+        fill, scale, offset = restore[name]
+        value = f'({name} * {float(scale)!r} + {float(offset)!r})'
+        return value if fill is None else f'where({name} == {fill!r}, nan_, {value})'
+
+    fused = NAME.sub(decode, expression)
+    if mask_var is not None and mask_values:
+        masked = ' | '.join(f'({mask_var} == {value!r})' for value in mask_values)
+        fused = f'where({masked}, nan_, {fused})'
+    return fused
+
+
+# III. TOP-LEVEL FUNCTIONS - - - - - - -
+def make_evaluator(expression, restore, mask_var = None, mask_values = ()):
+    """
+    Returns a function evaluating an expression over one tile of raw bands
+    :param expression: an expression String of SDS names
+    :param restore: a Python dictionary of SDS name keys and (fill, scale, offset) values
+    :param mask_var: the name String of the mask variable or 'None'
+    :param mask_values: the raw mask values that make a pixel NaN
+    :return: a function (raw tiles dictionary, output tile array) -> None
+    """
+    if numexpr is not None:
+        fused = fuse(expression, restore, mask_var, mask_values)
+
+        def evaluate(raw, out):
+            local = dict(raw, nan_ = np.float32(np.nan))
+            numexpr.evaluate(fused, local_dict = local, out = out, casting = 'same_kind')
+
+        return evaluate
+
+    code = compile(expression, '<band math>', 'eval')
+
+    def evaluate(raw, out):
+        tiles = {}
+        for name, (fill, scale, offset) in restore.items():
+            tile = raw[name].astype(out.dtype)
+            if fill is not None:
+                np.putmask(tile, raw[name] == fill, np.nan)
+            if scale != 1:
+                tile *= scale
+            if offset != 0:
+                tile += offset
+            tiles[name] = tile
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            out[...] = eval(code, {'__builtins__': {}}, dict(FUNCTIONS, **tiles))
+        if mask_var is not None and mask_values:
+            np.putmask(out, np.isin(raw[mask_var], mask_values), np.nan)
+
+    return evaluate
@@ -0,0 +1,356 @@
+"""
+The purpose of this file is to benchmark the Datasource, OMIReader and LandsatReader classes on synthetic
+sample files (see synthetic_samples.py) so that performance numbers can be reproduced offline.
+
+Measurements:
+    • classify -> Datasource source-type classification time per filename (get_stype)
+    • open     -> file open + close latency of the reader's file identifier (get_fid), unpooled and pooled
+    • restore  -> per-variable restore_data throughput in MB/s of restored output
+    • rss      -> peak resident memory of a full Datasource(filename, var) read in a fresh process
+    • cache    -> repeated random sub-region reads of an OMI field under different h5py access settings
+    • decode   -> full reads of a compressed OMI field through h5py (ds[()]) and through chunk_decoder with
+                  1..N threads
+
+Usage:
+    python benchmark_readers.py [--workdir DIR] [--omi-shape NLAT NLON] [--landsat-shape NROWS NCOLS]
+                                [--bands N] [--compression {gzip,none}] [--repeat N] [--json FILE]
+
+The harness itself runs as a test on small files: python -m pytest -q test_benchmark_readers.py
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import tempfile
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from datasource import Datasource
+from omi_reader import OMIReader
+import omi_reader
+from landsat_reader import LandsatReader
+import synthetic_samples
+import chunk_decoder
+
+
+# II. HELPER FUNCTIONS - - - - - - -
+def bare(cls, filename, pooled = True, access = None):
+    """
+    Returns a reader object that has not read its file yet, so single stages can be timed on their own
+    :param cls: the Datasource, OMIReader or LandsatReader class
+    :param filename: a full path String
+    :param pooled: whether a reader uses the shared handle pool
+    :param access: a Python dictionary of h5py file-access settings for OMIReader or 'None'
+    :return: an object of the given class
+    """
+    obj = cls.__new__(cls)
+    if cls is OMIReader:
+        obj.set_defaults(filename, pooled = pooled, access = access)
+    elif cls is LandsatReader:
+        obj.set_defaults(filename, pooled = pooled)
+    else:
+        obj.fn = filename
+        obj.log = logging.getLogger(cls.__module__)
+    return obj
+
+
+def timeit(func, repeat):
+    """
+    Times a function call several times
+    :param func: a callable with no arguments
+    :param repeat: the number of calls
+    :return: a Python list of times in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times):
+    """
+    Summarizes a list of timings
+    :param times: a Python list of times in seconds
+    :return: a Python dictionary of the best and median times in seconds
+    """
+    return {'best_s': min(times), 'median_s': statistics.median(times)}
+
+
+def read_rss(field):
+    """
+    Returns a resident memory figure of the current process
+    :param field: 'VmRSS' (current) or 'VmHWM' (peak) from /proc/self/status
+    :return: the size in bytes
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    scale = 1024 if sys.platform != 'darwin' else 1   # ru_maxrss is KB on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def peak_rss_worker(filename, var):
+    """
+    Reads a file through a Datasource in the current (fresh) process and reports its memory use
+    :param filename: a full path String
+    :param var: a data variable String or 'None'
+    :return: a Python dictionary of baseline and peak resident memory in MB
+    """
+    logging.disable(logging.INFO)
+
+    try:   # Resets the peak (VmHWM) so import-time memory isn't counted (Linux only)
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+    before = read_rss('VmRSS')
+    Datasource(filename, var)
+    after = read_rss('VmHWM')
+
+    return {'baseline_mb': before / 1e6, 'peak_mb': after / 1e6, 'delta_mb': (after - before) / 1e6}
+
+
+# III. BENCHMARKS - - - - - - -
+def bench_classify(filenames, repeat):
+    """
+    Times Datasource source-type classification
+    :param filenames: a Python list of filename Strings
+    :param repeat: the number of passes over the filenames
+    :return: a Python dictionary of results
+    """
+    objs = [bare(Datasource, fn) for fn in filenames]
+    times = timeit(lambda: [obj.get_stype() for obj in objs], repeat)
+
+    result = summarize(times)
+    result['per_file_us'] = result['best_s'] / len(filenames) * 1e6
+    return result
+
+
+def bench_open(cls, filename, repeat, pooled = False):
+    """
+    Times opening and closing a file through a reader's file identifier
+    :param cls: OMIReader or LandsatReader
+    :param filename: a full path String
+    :param repeat: the number of opens
+    :param pooled: whether to go through the shared handle pool (reopens are then pool hits)
+    :return: a Python dictionary of results
+    """
+    reader = bare(cls, filename, pooled)
+
+    def open_close():
+        reader.close_fid(reader.get_fid())
+
+    return summarize(timeit(open_close, repeat))
+
+
+def bench_restore(cls, filename, repeat):
+    """
+    Times restore_data for every variable in a file
+    :param cls: OMIReader or LandsatReader
+    :param filename: a full path String
+    :param repeat: the number of restores per variable
+    :return: a Python dictionary of variable name keys and result dictionary values
+    """
+    reader = bare(cls, filename, pooled = False)
+    fid = reader.get_fid()
+
+    if cls is OMIReader:
+        datasets = reader.get_data_group(fid)
+    else:
+        datasets = {name: fid.select(name) for name in fid.datasets().keys()}
+
+    results = {}
+    for name, ds in datasets.items():
+        nbytes = reader.restore_data(ds).nbytes
+        result = summarize(timeit(lambda: reader.restore_data(ds), repeat))
+        result['mb'] = nbytes / 1e6
+        result['mb_per_s'] = nbytes / 1e6 / result['best_s']
+        results[name] = result
+
+    reader.close_fid(fid)
+    return results
+
+
+def bench_chunk_cache(filename, repeat, region = (540, 1080), window = 64, reads = 200, seed = 0):
+    """
+    Times repeated random sub-region reads of one OMI field (like panning around a map) under the h5py
+    default chunk cache, OMIReader's ACCESS_DEFAULTS and the in-memory 'core' driver
+    :param filename: a full path String of an OMI file
+    :param repeat: the number of timed passes
+    :param region: a tuple of (rows, columns) the windows are drawn from
+    :param window: the window side length
+    :param reads: the number of window reads per pass
+    :param seed: a random seed for the window positions
+    :return: a Python dictionary of setting name keys and result dictionary values
+    """
+    import numpy as np
+
+    settings = {'h5py default (1 MB cache)': {'rdcc_nbytes': 1024 * 1024, 'rdcc_nslots': 521},
+                'ACCESS_DEFAULTS': {},
+                'ACCESS_DEFAULTS + core': {'driver': 'core'}}
+
+    results = {}
+    for name, access in settings.items():
+        # HDF5 reuses an already open file (and its settings), so nothing may keep the file open here
+        omi_reader.POOL.close(filename)
+
+        reader = bare(OMIReader, filename, pooled = False, access = access)
+        fid = reader.get_fid()
+        ds = list(reader.get_data_group(fid).values())[0]
+
+        rows = min(region[0], ds.shape[0]) - window
+        cols = min(region[1], ds.shape[1]) - window
+        rng = np.random.default_rng(seed)
+        corners = list(zip(rng.integers(0, rows, reads), rng.integers(0, cols, reads)))
+
+        def read_windows():
+            for row, col in corners:
+                ds[row:row + window, col:col + window]
+
+        read_windows()   # Warms the cache like a user who already viewed the region
+        result = summarize(timeit(read_windows, repeat))
+        result['ms_per_read'] = result['best_s'] / reads * 1e3
+        results[name] = result
+
+        reader.close_fid(fid)
+
+    return results
+
+
+def bench_decode(filename, repeat, threads = None):
+    """
+    Times full reads of the largest OMI field through h5py and through parallel chunk decoding
+    :param filename: a full path String of an OMI file
+    :param repeat: the number of timed reads
+    :param threads: a Python list of thread counts or 'None' for powers of two up to the number of CPUs
+    :return: a Python dictionary of method name keys and result dictionary values
+    """
+    import numpy as np
+
+    if threads is None:
+        cpus = os.cpu_count() or 1
+        threads = sorted({min(2 ** i, cpus) for i in range(cpus.bit_length() + 1)})
+
+    # Without a chunk cache every ds[()] decodes again, like a first read (read_direct_chunk bypasses the cache)
+    omi_reader.POOL.close(filename)
+    reader = bare(OMIReader, filename, pooled = False, access = {'rdcc_nbytes': 0})
+    fid = reader.get_fid()
+    ds = max(reader.get_data_group(fid).values(), key = lambda d: d.size)
+
+    results = {'ds[()]': summarize(timeit(lambda: ds[()], repeat))}
+    if chunk_decoder.supports(ds):
+        out = np.empty(ds.shape, dtype = ds.dtype)
+        for n in threads:
+            results[f'chunk_decoder x{n}'] = summarize(timeit(lambda: chunk_decoder.decode_into(ds, out, None, n),
+                                                              repeat))
+
+    for result in results.values():
+        result['mb_per_s'] = ds.nbytes / 1e6 / result['best_s']
+
+    reader.close_fid(fid)
+    return results
+
+
+def bench_rss(filename, var = None):
+    """
+    Measures peak resident memory of a Datasource read in a fresh process
+    :param filename: a full path String
+    :param var: a data variable String or 'None'
+    :return: a Python dictionary of results
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers = 1, mp_context = context) as pool:
+        return pool.submit(peak_rss_worker, filename, var).result()
+
+
+def run(workdir, omi_shape = (720, 1440), landsat_shape = (2000, 2000), bands = 6, compression = 'gzip',
+        repeat = 5):
+    """
+    Generates synthetic files and runs every benchmark on them
+    :param workdir: the directory String for synthetic files
+    :param omi_shape: a tuple of (latitudes, longitudes) for the OMI grid
+    :param landsat_shape: a tuple of (rows, columns) for the Landsat scene
+    :param bands: the number of Landsat sr_band datasets
+    :param compression: 'gzip' or 'None'
+    :param repeat: the number of timed repeats
+    :return: a Python dictionary of results
+    """
+    omi_fn = synthetic_samples.make_omi_file(workdir, nlat = omi_shape[0], nlon = omi_shape[1],
+                                             compression = compression)
+    landsat_fn = synthetic_samples.make_landsat_file(workdir, nrows = landsat_shape[0], ncols = landsat_shape[1],
+                                                     nbands = bands, compression = compression is not None)
+
+    results = {'config': {'omi_shape': list(omi_shape), 'landsat_shape': list(landsat_shape), 'bands': bands,
+                          'compression': compression, 'repeat': repeat},
+               'classify': bench_classify([omi_fn, landsat_fn] * 500, repeat)}
+
+    for name, cls, fn in (('OMIReader', OMIReader, omi_fn), ('LandsatReader', LandsatReader, landsat_fn)):
+        results[name] = {'file_mb': os.path.getsize(fn) / 1e6,
+                         'open': bench_open(cls, fn, repeat),
+                         'open_pooled': bench_open(cls, fn, repeat, pooled = True),
+                         'restore': bench_restore(cls, fn, repeat),
+                         'rss': bench_rss(fn)}
+
+    results['OMIReader']['cache'] = bench_chunk_cache(omi_fn, repeat)
+    results['OMIReader']['decode'] = bench_decode(omi_fn, repeat)
+    return results
+
+
+def report(results):
+    """
+    Prints benchmark results as a table
+    :param results: a Python dictionary of results from run()
+    """
+    print(f"config: {results['config']}")
+    print(f"classify: {results['classify']['per_file_us']:.2f} us/file")
+
+    for name in ('OMIReader', 'LandsatReader'):
+        res = results[name]
+        print(f"\n{name} ({res['file_mb']:.1f} MB on disk)")
+        print(f"  open:  best {res['open']['best_s'] * 1e3:.2f} ms, median {res['open']['median_s'] * 1e3:.2f} ms")
+        print(f"  open (pooled): best {res['open_pooled']['best_s'] * 1e3:.3f} ms, "
+              f"median {res['open_pooled']['median_s'] * 1e3:.3f} ms")
+        for var, r in res['restore'].items():
+            print(f"  restore {var:<24} {r['mb']:8.1f} MB  {r['best_s'] * 1e3:8.2f} ms  {r['mb_per_s']:8.1f} MB/s")
+        print(f"  peak RSS: {res['rss']['peak_mb']:.1f} MB (+{res['rss']['delta_mb']:.1f} MB for a full read)")
+        for setting, r in res.get('cache', {}).items():
+            print(f"  sub-region reads, {setting:<26} {r['ms_per_read']:8.3f} ms/read")
+        for method, r in res.get('decode', {}).items():
+            print(f"  full read, {method:<20} {r['best_s'] * 1e3:8.2f} ms  {r['mb_per_s']:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the EViz readers on synthetic files')
+    parser.add_argument('--workdir', default = None)
+    parser.add_argument('--omi-shape', type = int, nargs = 2, default = (720, 1440))
+    parser.add_argument('--landsat-shape', type = int, nargs = 2, default = (2000, 2000))
+    parser.add_argument('--bands', type = int, default = 6)
+    parser.add_argument('--compression', choices = ('gzip', 'none'), default = 'gzip')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--json', default = None)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run(args.workdir or tmp, tuple(args.omi_shape), tuple(args.landsat_shape), args.bands,
+                      None if args.compression == 'none' else 'gzip', args.repeat)
+
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent = 2)
@@ -0,0 +1,222 @@
+"""
+The purpose of this file is to hold mostly-fill data (Landsat scenes with large fill corners, OMI grids with
+missing swaths) compactly: the valid (non-NaN) values plus a bitmap of where they are, instead of dense float
+arrays padded with NaN.
+
+    • A CompactArray keeps the packed validity bitmap (1 bit per pixel), the valid values in row-major order
+      and the offset of each row's first value, so any rows can be made dense without expanding the rest
+    • to_dataarray(lazy = True) returns a DataArray that expands only the windows it is indexed with
+    • CompactArrays pickle as their compact arrays (process transfer, caching, serialization) and report their
+      compact size as nbytes (e.g. for prefetcher.DataCache)
+    • Datasource.read_compact builds them from Landsat reads that drop invalid pixels block by block
+      (LandsatReader.read_valid), so the dense array never exists
+
+Usage:
+    scene = Datasource(fn, load = False, mask = ('cloud', 'shadow')).read_compact('sr_band4')
+    scene.density        # fraction of valid pixels
+    data = scene.to_dataarray(lazy = True)[0, 1000:2000, 1000:2000].values
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import math
+
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+
+class CompactArray:
+    """
+    The valid values of an array plus a validity bitmap.
+    """
+
+    # I. Constructor
+    def __init__(self, shape, dtype, bitmap, values, offsets, dims = None, coords = None, attrs = None, name = None):
+        """
+        Constructs a compact array (see from_dense and from_valid)
+        :param shape: a tuple of dimension sizes of the dense array
+        :param dtype: the floating-point dtype of the dense array
+        :param bitmap: a uint8 NumPy array of row-major validity bits (np.packbits)
+        :param values: a NumPy array of the valid values in row-major order
+        :param offsets: an int64 NumPy array of the index of each row's first value in values (plus the total);
+                        rows run over the last dimension
+        :param dims: a tuple of dimension name Strings or 'None'
+        :param coords: a Python dictionary of dimension name keys and NumPy array values or 'None'
+        :param attrs: a Python dictionary of attributes or 'None'
+        :param name: a variable name String or 'None'
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.bitmap = bitmap
+        self.values = values
+        self.offsets = offsets
+        self.dims = dims
+        self.coords = coords if coords is not None else {}
+        self.attrs = attrs if attrs is not None else {}
+        self.name = name
+
+    def __repr__(self):
+        """
+        Returns compact array info
+        :return: a String
+        """
+        return (f'CompactArray({self.name}; {self.shape} {self.dtype}; {self.density:.1%} valid; '
+                f'{self.nbytes} bytes compact, {self.dense_nbytes} dense)')
+
+    @classmethod
+    def from_dense(cls, data, dims = None, coords = None, attrs = None, name = None):
+        """
+        Compacts a dense floating-point array (NaN marks invalid pixels)
+        :param data: a NumPy array or XArray DataArray (whose dims, coords, attrs and name are kept)
+        :return: a CompactArray object
+        """
+        if isinstance(data, xr.DataArray):
+            dims = data.dims
+            coords = {dim: data[dim].values for dim in data.dims if dim in data.coords}
+            attrs = dict(data.attrs)
+            name = data.name
+            data = data.values
+
+        rows = data.reshape(-1, data.shape[-1]) if data.ndim > 1 else data.reshape(1, -1)
+        valid = ~np.isnan(rows)
+        offsets = np.concatenate([[0], np.cumsum(valid.sum(axis = 1))])
+
+        return cls(data.shape, data.dtype, np.packbits(valid), rows[valid], offsets, dims, coords, attrs, name)
+
+    @classmethod
+    def from_valid(cls, indices, values, shape, dims = None, coords = None, attrs = None, name = None):
+        """
+        Builds a compact array from valid pixels alone (e.g. LandsatReader.read_valid), without a dense array
+        :param indices: a sorted integer NumPy array of flat (row-major) indices of the valid pixels
+        :param values: a floating-point NumPy array of their values
+        :param shape: a tuple of dimension sizes of the dense array
+        :return: a CompactArray object
+        """
+        ncols = shape[-1]
+        nrows = math.prod(shape[:-1]) if len(shape) > 1 else 1
+
+        bitmap = np.zeros(math.ceil(nrows * ncols / 8), dtype = 'uint8')
+        np.bitwise_or.at(bitmap, indices >> 3, (128 >> (indices & 7)).astype('uint8'))
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(indices // ncols, minlength = nrows))])
+
+        return cls(shape, values.dtype, bitmap, values, offsets, dims, coords, attrs, name)
+
+    # II. Accessor & Helper Methods
+    @property
+    def nbytes(self):
+        return self.bitmap.nbytes + self.values.nbytes + self.offsets.nbytes
+
+    @property
+    def dense_nbytes(self):
+        return math.prod(self.shape) * self.dtype.itemsize
+
+    @property
+    def density(self):
+        size = math.prod(self.shape)
+        return self.values.size / size if size else 0.0
+
+    def get_rows(self, first, last):
+        """
+        Expands a range of rows (over the last dimension) into a dense array
+        :param first: the first row index
+        :param last: the row index after the last
+        :return: a 2D NumPy array with NaN at invalid pixels
+        """
+        ncols = self.shape[-1]
+        start, nbits = first * ncols, (last - first) * ncols
+        skip = start % 8
+
+        packed = self.bitmap[start // 8:(start + nbits + 7) // 8]
+        valid = np.unpackbits(packed, count = skip + nbits)[skip:].view(bool).reshape(last - first, ncols)
+
+        dense = np.full(valid.shape, np.nan, dtype = self.dtype)
+        dense[valid] = self.values[self.offsets[first]:self.offsets[last]]
+        return dense
+
+    # III. Top-Level Methods
+    def to_numpy(self):
+        """
+        Expands the whole array
+        :return: a dense NumPy array
+        """
+        return self.get_rows(0, len(self.offsets) - 1).reshape(self.shape)
+
+    def to_dataarray(self, lazy = False):
+        """
+        Returns the array as an XArray DataArray
+        :param lazy: whether to expand only the windows it is indexed with (True) or the whole array now
+        :return: an XArray DataArray
+        """
+        data = indexing.LazilyIndexedArray(CompactBackendArray(self)) if lazy else self.to_numpy()
+        dims = self.dims if self.dims is not None else tuple(f'dim_{i}' for i in range(len(self.shape)))
+
+        return xr.DataArray(xr.Variable(dims, data, attrs = dict(self.attrs)), coords = self.coords, name = self.name)
+
+
+class CompactBackendArray(BackendArray):
+    """
+    An XArray backend array expanding the rows of a CompactArray that are indexed.
+    """
+
+    # I. Constructor
+    def __init__(self, array):
+        """
+        Constructs a lazy view of a compact array
+        :param array: a CompactArray object
+        """
+        self.array = array
+        self.shape = array.shape
+        self.dtype = array.dtype
+
+    # II. Accessor & Helper Methods
+    def __getitem__(self, key):
+        """
+        Expands the values of an XArray indexer
+        :param key: an XArray ExplicitIndexer
+        :return: a NumPy array
+        """
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC, self.read_key)
+
+    def read_key(self, key):
+        """
+        Expands the values of a basic key (integers & slices), expanding only the rows spanned by it
+        :param key: a tuple of one integer or slice per dimension
+        :return: a NumPy array
+        """
+        leading = [np.atleast_1d(np.arange(n)[k]) for k, n in zip(key[:-1], self.shape[:-1])]
+        rows = np.ravel_multi_index(np.ix_(*leading), self.shape[:-1]) if leading else np.zeros((), dtype = int)
+
+        if rows.size == 0:
+            dense = np.empty(rows.shape + (self.shape[-1],), dtype = self.dtype)
+        else:
+            first = int(rows.min())
+            dense = self.array.get_rows(first, int(rows.max()) + 1)[rows - first]
+        out = dense[..., key[-1]]
+
+        drop = tuple(axis for axis, k in enumerate(key[:-1]) if not isinstance(k, slice))
+        return out.squeeze(axis = drop) if drop else out
+
+
+# II. TOP-LEVEL FUNCTIONS - - - - - - -
+def compact(data):
+    """
+    Compacts read data
+    :param data: an XArray DataArray or Dataset
+    :return: a CompactArray object, or a Python dictionary of variable name keys and CompactArray values
+    """
+    if isinstance(data, xr.Dataset):
+        return {var: CompactArray.from_dense(data[var]) for var in data.data_vars}
+    return CompactArray.from_dense(data)
+
+
+def expand(compacted, lazy = False):
+    """
+    Expands compacted data (see compact)
+    :param compacted: a CompactArray object or a Python dictionary of them
+    :param lazy: whether to expand only the windows that are indexed
+    :return: an XArray DataArray or Dataset
+    """
+    if isinstance(compacted, dict):
+        return xr.Dataset({var: array.to_dataarray(lazy) for var, array in compacted.items()})
+    return compacted.to_dataarray(lazy)
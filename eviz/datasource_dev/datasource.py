@@ -5,11 +5,59 @@
 
 from landsat_reader import LandsatReader
 from omi_reader import OMIReader
+import landsat_reader
+import omi_reader
+import async_executor
+import lazy_array
+from compact_array import CompactArray
+import render_grid
 
 import re
+import numpy as np
+import xarray as xr
 import logging
 logging.basicConfig(level = logging.INFO)   # filename = ...
 
+# What a Datasource does when the requested data would exceed its memory budget (max_memory):
+#   lazy    -> opens lazy arrays that read windows from the file when indexed (see lazy_array.py)
+#   float32 -> reads float32 instead of float64 if that fits, or raises MemoryError
+#   auto    -> reads float32 if that fits, or opens lazy float32 arrays
+#   raise   -> raises MemoryError
+MEMORY_POLICIES = ('lazy', 'float32', 'auto', 'raise')
+
+SIZE_UNITS = {'': 1, 'b': 1, 'kb': 10 ** 3, 'mb': 10 ** 6, 'gb': 10 ** 9, 'tb': 10 ** 12,
+              'kib': 2 ** 10, 'mib': 2 ** 20, 'gib': 2 ** 30, 'tib': 2 ** 40}
+
+
+def parse_size(size):
+    """
+    Converts a memory size into bytes
+    :param size: a number of bytes, or a String such as '2GB' (10^9 bytes) or '512 MiB' (2^20 bytes)
+    :return: an integer number of bytes
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    match = re.fullmatch(r'\s*([0-9]*\.?[0-9]+)\s*([a-zA-Z]*)\s*', str(size))
+    if match is None or match.group(2).lower() not in SIZE_UNITS:
+        raise ValueError(f"invalid memory size '{size}' (e.g. 2GB, 512MiB, or a number of bytes)")
+
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+def format_size(nbytes):
+    """
+    Returns a readable memory size
+    :param nbytes: a number of bytes
+    :return: a String
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if nbytes < 1000:
+            return f'{nbytes:.0f} {unit}' if unit == 'B' else f'{nbytes:.1f} {unit}'
+        nbytes /= 1000
+    return f'{nbytes:.1f} TB'
+
+
 class Datasource:
     """
     Purposes:
@@ -18,14 +66,39 @@ class Datasource:
 
     """
 
-    def __init__(self, filename, var = None, stype = None):
+    def __init__(self, filename, var = None, stype = None, stats_callback = None, load = True, pooled = True,
+                 access = None, decode_threads = 0, max_memory = None, memory_policy = 'lazy', mask = None,
+                 dtype = None):
         """
         Creates a Datasource object which manages file reading
         :param filename: a filename String
         :param var: a data variable String or 'None'
+        :param stats_callback: a function called with each per-stage reader measurement (see ReaderStats) or 'None'
+        :param load: whether the reader reads its data now (False only classifies the file)
+        :param pooled: whether the reader keeps its file open in the shared handle pool between reads
+        :param access: a Python dictionary of h5py file-access settings for OMI files (see omi_reader.ACCESS_DEFAULTS)
+        :param decode_threads: the number of threads decoding compressed OMI chunks in parallel ('None' for one per
+                               CPU, 0 to let h5py decode them)
+        :param max_memory: the memory budget of the restored data (bytes, or a String such as '2GB') or 'None';
+                           the size is estimated from the file metadata before anything is read
+        :param memory_policy: what to do when the data would exceed max_memory (see MEMORY_POLICIES)
+        :param mask: a quality mask for Landsat files (see landsat_qa.py) applied while reading, or 'None'
+        :param dtype: the floating-point dtype of restored data or 'None' for the reader's default
         """
+        if memory_policy not in MEMORY_POLICIES:
+            raise ValueError(f"memory_policy must be one of {MEMORY_POLICIES}, not '{memory_policy}'")
+
         self.fn = filename
         self.var = var
+        self.stats_callback = stats_callback
+        self.load = load
+        self.pooled = pooled
+        self.access = access
+        self.decode_threads = decode_threads
+        self.max_memory = None if max_memory is None else parse_size(max_memory)
+        self.memory_policy = memory_policy
+        self.mask = mask
+        self.dtype = dtype
 
         self.log = logging.getLogger(__name__)
 
@@ -34,6 +107,9 @@ class Datasource:
         self.reader = self.get_reader()
         # self.data = self.reader.data
 
+        if self.load and self.max_memory is not None and self.reader is not None:
+            self.reader.data = self.read_data()
+
     def __repr__(self):
         """
         Returns object data
@@ -49,6 +125,28 @@ class Datasource:
         """
         return repr(self)
 
+    def __reduce__(self):
+        """
+        Pickles the Datasource as its spec (see datasource_spec.py): the unpickled Datasource opens the file
+        again, and reads it again if this one was loaded, instead of unpickling its arrays
+        :return: a tuple of (callable, arguments)
+        """
+        from datasource_spec import open_spec
+
+        return open_spec, (self.to_spec(), self.load)
+
+    def to_spec(self, window = None):
+        """
+        Returns a picklable description of this Datasource's read (without the stats callback)
+        :param window: a tuple of (row, column) slices or 'None' for the whole grid
+        :return: a DatasourceSpec object
+        """
+        from datasource_spec import DatasourceSpec
+
+        return DatasourceSpec(self.fn, self.var, window, pooled = self.pooled, access = self.access,
+                              decode_threads = self.decode_threads, max_memory = self.max_memory,
+                              memory_policy = self.memory_policy, mask = self.mask, dtype = self.dtype)
+
 
     def is_omi(self):
         """
@@ -128,15 +226,373 @@ class Datasource:
         :return: an OMI or Landsat Reader object or 'None'
         """
         if self.stype == 'OMI':
-            self.log.info(f"INITIALIZING READER ({self.stype})")
-            return OMIReader(self.fn, self.var)
+            self.log.debug('INITIALIZING READER (%s)', self.stype)
+            if self.mask is not None:
+                self.log.warning('QUALITY MASKS ARE ONLY APPLIED TO LANDSAT FILES')
+            return OMIReader(self.fn, self.var, self.stats_callback, self.load and self.max_memory is None,
+                             self.pooled, self.access, self.decode_threads, self.dtype)
         elif self.stype == 'Landsat':
-            self.log.info(f"INITIALIZING READER ({self.stype})")
-            return LandsatReader(self.fn, self.var)
+            self.log.debug('INITIALIZING READER (%s)', self.stype)
+            return LandsatReader(self.fn, self.var, self.stats_callback, self.load and self.max_memory is None,
+                                 self.pooled, self.dtype, self.mask)
         else:
             self.log.info("INITIALIZING READER (UNKNOWN)")
             return None
 
+    @property
+    def stats(self):
+        """
+        Returns the per-stage timing and memory record of the reader
+        :return: a ReaderStats object or 'None'
+        """
+        if self.reader is None:
+            return None
+        return self.reader.stats
+
+    @staticmethod
+    def close_handles(filename = None):
+        """
+        Closes the pooled (idle) file handles of one file, or of every file
+        (HDF5 won't let the same process overwrite a file it still has open)
+        :param filename: a filename String or 'None' for every file
+        """
+        omi_reader.POOL.close(filename)
+        landsat_reader.POOL.close(filename)
+
+    @staticmethod
+    def timeseries(lat, lon, var, store):
+        """
+        Reads the time series of one location from a time-major store (see timeseries_store.py) in one chunk
+        read instead of opening every file of the stack
+        :param lat: a latitude float
+        :param lon: a longitude float
+        :param var: a data variable String
+        :param store: the path String of a TimeSeriesStore
+        :return: an XArray DataArray or 'None'
+        """
+        from timeseries_store import TimeSeriesStore   # Needs zarr
+
+        return TimeSeriesStore(store, mode = 'r').timeseries(lat, lon, var)
+
+    def get_windows(self, shape, tile_shape):
+        """
+        Splits a 2D shape into row-major tiles
+        :param shape: a tuple of (rows, columns)
+        :param tile_shape: a tuple of (rows, columns) per tile
+        :return: a Python list of (row, column) slice tuples
+        """
+        windows = []
+        for row in range(0, shape[0], tile_shape[0]):
+            for col in range(0, shape[1], tile_shape[1]):
+                windows.append((slice(row, min(row + tile_shape[0], shape[0])),
+                                slice(col, min(col + tile_shape[1], shape[1]))))
+        return windows
+
+    def get_vars(self):
+        """
+        Returns the names of the data variables in the file without reading their data
+        :return: a Python list of variable name Strings (empty for unknown files)
+        """
+        if self.reader is None:
+            return []
+        return self.reader.get_vars()
+
+    def get_grid(self, var):
+        """
+        Returns the dimensions, coordinates and attributes of a 2D variable from its metadata and a one-cell read,
+        without reading the rest of the variable
+        :param var: a data variable String
+        :return: a Python dictionary ('dims': tuple of Strings, 'coords': dictionary of NumPy arrays per dimension,
+                 'attrs': dictionary) or 'None'
+        """
+        if self.reader is None:
+            return None
+
+        cell = self.reader.read_window(var, (slice(0, 1), slice(0, 1)))   # One chunk, however the file is chunked
+        if cell is None:
+            return None
+
+        dims = cell.dims
+        coords = dict(zip(dims, self.reader.get_var_coords(var).values()))   # Time, rows, columns
+
+        return {'dims': dims, 'coords': coords, 'attrs': cell.attrs}
+
+    def get_requested_vars(self):
+        """
+        Returns the names of the requested data variables that exist in the file
+        :return: a Python list of variable name Strings
+        """
+        if self.reader is None:
+            return []
+        if self.var is None:
+            return self.reader.get_vars()
+
+        names = [self.var] if isinstance(self.var, str) else list(self.var)
+        existing = self.reader.get_vars()
+        return [name for name in names if name in existing]
+
+    def estimate_nbytes(self, dtype = None):
+        """
+        Estimates the size of the requested data once read and restored, from the file metadata only
+        (shape x output dtype of each variable)
+        :param dtype: the output dtype or 'None' for the reader's
+        :return: an integer number of bytes
+        """
+        nbytes = 0
+        for var in self.get_requested_vars():
+            shape = self.reader.get_shape(var)
+            out = np.dtype(dtype or self.reader.dtype or np.result_type(self.reader.get_dtype(var), 1.0))
+            nbytes += int(np.prod(shape)) * out.itemsize
+
+        return nbytes
+
+    def read_data(self):
+        """
+        Reads the requested data variable(s) within the memory budget (max_memory), following the memory policy
+        :return: an XArray DataArray or Dataset (lazy if the data doesn't fit in the budget)
+        """
+        if self.max_memory is None:
+            return self.reader.read()
+
+        nbytes = self.estimate_nbytes()
+        if nbytes <= self.max_memory:
+            return self.reader.read()
+
+        need = f'{self.fn} needs ~{format_size(nbytes)} (max_memory {format_size(self.max_memory)})'
+        if self.memory_policy == 'raise':
+            raise MemoryError(need)
+
+        if self.memory_policy in ('float32', 'auto'):
+            nbytes32 = self.estimate_nbytes('float32')
+            if nbytes32 <= self.max_memory:
+                self.log.warning(f'{need}: READING FLOAT32 (~{format_size(nbytes32)})')
+                dtype, self.reader.dtype = self.reader.dtype, 'float32'   # For this read only
+                try:
+                    return self.reader.read()
+                finally:
+                    self.reader.dtype = dtype
+            if self.memory_policy == 'float32':
+                raise MemoryError(f'{need}; ~{format_size(nbytes32)} as float32')
+
+        self.log.warning(f'{need}: OPENING LAZY ARRAYS')
+        return self.open_lazy('float32' if self.memory_policy == 'auto' else None)
+
+    def open_lazy(self, dtype = None):
+        """
+        Opens the requested data variable(s) as lazy arrays, read window by window when indexed
+        (see lazy_array.py)
+        :param dtype: the output dtype or 'None' for the reader's
+        :return: an XArray DataArray or Dataset, or 'None'
+        """
+        if getattr(self.reader, 'is_swath', lambda: False)():
+            raise MemoryError(f'{self.fn}: swaths cannot be opened lazily; read them in blocks of scanlines '
+                              '(see OMIReader.read_swath_fields)')
+
+        arrays = {}
+        for var in self.get_requested_vars():
+            grid = self.get_grid(var)
+            out = dtype or self.reader.dtype or np.result_type(self.reader.get_dtype(var), 1.0)
+            arrays[var] = lazy_array.open_lazy(self.reader, var, grid, out)
+
+        if isinstance(self.var, str) or (self.var is not None and len(self.var) == 1):
+            return next(iter(arrays.values()), None)
+        return xr.Dataset(arrays) if arrays else None
+
+    def get_loaded(self):
+        """
+        Returns the data variables read so far
+        :return: a Python dictionary of variable name String keys and XArray DataArray values
+        """
+        data = None if self.reader is None else self.reader.data
+        if isinstance(data, xr.Dataset):
+            return dict(data.data_vars)
+        if isinstance(data, xr.DataArray):
+            return {data.name: data}
+        return {}
+
+    def select(self, var):
+        """
+        Changes the data variable(s) of the Datasource, keeping the open file, its parsed metadata and the
+        variables already read: only newly requested variables are read (within max_memory, if set)
+        :param var: a data variable String, a tuple/list of Strings, or 'None' for every variable
+        :return: the new data (an XArray DataArray or Dataset, as the constructor would give), or 'None'
+        """
+        if self.reader is None:
+            self.log.warning('NO READER FOR FILE')
+            return None
+
+        names = self.reader.get_vars() if var is None else [var] if isinstance(var, str) else list(var)
+        loaded = self.get_loaded()
+        attrs = self.reader.data.attrs if isinstance(self.reader.data, xr.Dataset) else None
+
+        missing = [name for name in dict.fromkeys(names) if name not in loaded]
+        self.var = self.reader.var_input = missing
+        if missing:
+            new = self.read_data()
+            if isinstance(new, xr.Dataset):
+                loaded.update(new.data_vars)
+                attrs = attrs or new.attrs
+            elif new is not None:
+                loaded[new.name] = new
+
+        self.var = self.reader.var_input = var
+        arrays = {name: loaded[name] for name in dict.fromkeys(names) if name in loaded}
+
+        if isinstance(var, str) or (var is not None and len(var) == 1):
+            data = next(iter(arrays.values()), None)
+        elif arrays:
+            data = xr.Dataset(arrays, attrs = attrs if attrs is not None else self.reader.get_attrs())
+        else:
+            data = None
+
+        self.reader.data = data
+        return data
+
+    def add(self, var):
+        """
+        Adds data variable(s) to the Datasource, reading only those (see select)
+        :param var: a data variable String or a tuple/list of Strings
+        :return: the new data (an XArray Dataset if it holds several variables), or 'None'
+        """
+        names = [var] if isinstance(var, str) else list(var)
+        return self.select(list(dict.fromkeys(list(self.get_loaded()) + names)))
+
+    def drop(self, var):
+        """
+        Removes data variable(s) from the Datasource without reading anything
+        :param var: a data variable String or a tuple/list of Strings
+        :return: the new data, or 'None' if no variable is left
+        """
+        names = [var] if isinstance(var, str) else list(var)
+        return self.select([name for name in self.get_loaded() if name not in names])
+
+    def read_into(self, var, out, window = None):
+        """
+        Reads and restores one data variable (or a window of it) into a caller-provided floating-point array,
+        e.g. one slice of a preallocated time stack or an array over a multiprocessing.shared_memory buffer
+        (usage: np.ndarray(shape, 'float32', buffer = shm.buf)) so worker processes hand back no copies
+        :param var: a data variable String
+        :param out: a writeable floating-point NumPy array with the (window) shape of the variable
+        :param window: a tuple of (row, column) slices or 'None' for the whole grid
+        :return: out, or 'None' if the variable doesn't exist
+        """
+        if self.reader is None:
+            self.log.warning('NO READER FOR FILE')
+            return None
+        return self.reader.read_into(var, out, window)
+
+    def render_array(self, var, width, height, bbox = None, agg = 'mean'):
+        """
+        Reads a data variable already aggregated to an output pixel grid for plotting (see render_grid.py); the
+        data is reduced band by band as it is read, or read strided for 'nearest'
+        (usage: ds.render_array('sr_band4', 1600, 1000, agg = 'mean').plot())
+        :param var: a data variable String
+        :param width: the number of output columns (at most the data columns in the bbox)
+        :param height: the number of output rows (at most the data rows in the bbox)
+        :param bbox: a tuple of (west, south, east, north) or 'None' for the whole grid
+        :param agg: 'mean', 'min', 'max', 'mode' (categorical variables) or 'nearest'
+        :return: an XArray DataArray (lat, lon) of float32, or 'None'
+        """
+        if self.reader is None:
+            self.log.warning('NO READER FOR FILE')
+            return None
+        return render_grid.render(self, var, width, height, bbox, agg)
+
+    def read_compact(self, var = None, window = None):
+        """
+        Reads data variable(s) as compact arrays of their valid pixels (see compact_array.py); Landsat variables
+        drop fill (and quality-masked) pixels block by block as they are read, so no dense array is made
+        :param var: a data variable String, a tuple/list of Strings, or 'None' for the requested variables
+        :param window: a tuple of (row, column) slices or 'None' for the whole grid
+        :return: a CompactArray object (one variable), a Python dictionary of them, or 'None'
+        """
+        if self.reader is None:
+            self.log.warning('NO READER FOR FILE')
+            return None
+
+        names = self.get_requested_vars() if var is None else [var] if isinstance(var, str) else list(var)
+        arrays = {}
+        for name in names:
+            if hasattr(self.reader, 'read_valid') and self.reader.get_shape(name) is not None:
+                grid = self.get_grid(name)
+                coords = dict(grid['coords'])
+                if window is not None:
+                    coords.update({dim: coords[dim][win] for dim, win in zip(grid['dims'][1:], window)})
+                shape = tuple(coords[dim].size for dim in grid['dims'])
+
+                indices, values = self.reader.read_valid(name, window)
+                arrays[name] = CompactArray.from_valid(indices, values, shape, grid['dims'], coords,
+                                                       dict(grid['attrs']), name)
+            else:
+                data = self.reader.read_window(name, window)
+                if data is not None:
+                    arrays[name] = CompactArray.from_dense(data)
+
+        if isinstance(var, str) or len(names) == 1:
+            return next(iter(arrays.values()), None)
+        return arrays or None
+
+    # Asyncio API
+    async def run_blocking(self, func, *args):
+        """
+        Runs blocking reader work in the shared thread pool within this file's concurrency limit
+        :param func: a callable
+        :return: the callable's result
+        """
+        return await async_executor.run_blocking(self.fn, func, *args)
+
+    @classmethod
+    async def aopen(cls, filename, var = None, stype = None, stats_callback = None, load = True, pooled = True,
+                    access = None, decode_threads = 0, max_memory = None, memory_policy = 'lazy', mask = None,
+                    dtype = None):
+        """
+        Creates a Datasource object without blocking the event loop
+        (usage: ds = await Datasource.aopen(filename, var = 'ColumnAmountO3'))
+        :param filename: a filename String
+        :param var: a data variable String or 'None'
+        :param stats_callback: a function called with each per-stage reader measurement or 'None'
+        :param load: whether to read the data (False only classifies the file, e.g. before atiles)
+        :param pooled: whether the reader keeps its file open in the shared handle pool between reads
+        :param access: a Python dictionary of h5py file-access settings for OMI files or 'None'
+        :param decode_threads: the number of threads decoding compressed OMI chunks in parallel
+        :param max_memory: the memory budget of the restored data (bytes, or a String such as '2GB') or 'None'
+        :param memory_policy: what to do when the data would exceed max_memory (see MEMORY_POLICIES)
+        :param mask: a quality mask for Landsat files (see landsat_qa.py) or 'None'
+        :param dtype: the floating-point dtype of restored data or 'None' for the reader's default
+        :return: a Datasource object
+        """
+        ds = cls(filename, var, stype, stats_callback, load = False, pooled = pooled, access = access,
+                 decode_threads = decode_threads, max_memory = max_memory, memory_policy = memory_policy,
+                 mask = mask, dtype = dtype)
+        ds.load = load
+
+        if load and ds.reader is not None:
+            ds.reader.data = await ds.run_blocking(ds.read_data)
+
+        return ds
+
+    async def atiles(self, var = None, tile_shape = (512, 512)):
+        """
+        Reads one data variable tile by tile without blocking the event loop
+        (usage: async for tile in ds.atiles('sr_band1'): ...); cancelling the iteration stops further reads
+        :param var: a data variable String or 'None' for the Datasource variable
+        :param tile_shape: a tuple of (rows, columns) per tile
+        :return: an asynchronous generator of XArray DataArrays
+        """
+        if var is None:
+            var = self.var
+        if self.reader is None or not isinstance(var, str):
+            self.log.warning('NO VARIABLE TO TILE')
+            return
+
+        shape = await self.run_blocking(self.reader.get_shape, var)
+        if shape is None:
+            self.log.warning(f"VARIABLE '{var}' DOES NOT EXIST")
+            return
+
+        for window in self.get_windows(shape, tile_shape):
+            yield await self.run_blocking(self.reader.read_window, var, window)
+
 
 if __name__ == "__main__":
     f1_loc = '/Users/deonkouatchou/eviz/eviz_datasource_dev/Samples/OMI/'
@@ -0,0 +1,163 @@
+"""
+The purpose of this file is to define the DatasourceSpec class, a small picklable description of a read
+(file, variables, window, reader options), so reads can be sent to worker processes (concurrent.futures,
+multiprocessing, dask.distributed) as a few hundred bytes and run there; only results come back.
+
+    • A spec holds no file handles or data: it opens its Datasource where it is read
+    • A pickled Datasource is sent as its spec too (see Datasource.__reduce__), so it is opened (and read,
+      if it was loaded) again on the worker instead of shipping its arrays
+    • apply runs a function on the data where it was read, e.g. a reduction whose result is small
+
+Usage:
+    specs = [DatasourceSpec(fn, 'ColumnAmountO3', (slice(0, 360), slice(None))) for fn in files]
+    means = map_specs(specs, np.nanmean)                       # process pool
+    futures = client.map(apply_spec, specs, func = np.nanmean)   # dask.distributed
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import os
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+import xarray as xr
+
+from datasource import Datasource
+
+# Datasource keyword arguments a spec carries (stats callbacks are left out: they seldom pickle)
+OPTIONS = ('pooled', 'access', 'decode_threads', 'max_memory', 'memory_policy', 'mask', 'dtype')
+
+
+class DatasourceSpec:
+    """
+    A picklable description of a Datasource read.
+    """
+
+    # I. Constructor
+    def __init__(self, filename, var = None, window = None, **options):
+        """
+        Constructs a read description
+        :param filename: a full path String
+        :param var: a data variable String, a tuple/list of Strings, or 'None' for every variable
+        :param window: a tuple of (row, column) slices or 'None' for the whole grid
+        :param options: Datasource keyword arguments (see OPTIONS)
+        """
+        unknown = set(options) - set(OPTIONS)
+        if unknown:
+            raise ValueError(f'unknown Datasource options: {sorted(unknown)}')
+        if window is not None and (len(window) != 2 or not all(isinstance(win, slice) for win in window)):
+            raise ValueError('window must be a tuple of (row, column) slices')
+
+        self.filename = filename
+        self.var = tuple(var) if isinstance(var, list) else var
+        self.window = None if window is None else tuple(window)
+        self.options = dict(options)
+
+    def __repr__(self):
+        """
+        Returns spec info
+        :return: a String
+        """
+        window = '' if self.window is None else f', window = {self.window}'
+        return f'DatasourceSpec({self.filename}; {self.var}{window})'
+
+    def __eq__(self, other):
+        return isinstance(other, DatasourceSpec) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    # II. Accessor & Helper Methods
+    def key(self):
+        """
+        Returns a hashable identity of the spec (slices aren't hashable before Python 3.12)
+        :return: a tuple
+        """
+        window = None if self.window is None else tuple((win.start, win.stop, win.step) for win in self.window)
+        return self.filename, self.var, window, tuple(sorted((k, repr(v)) for k, v in self.options.items()))
+
+    def open(self, load = False):
+        """
+        Opens the Datasource of the spec in this process
+        :param load: whether to read the whole variable(s) now
+        :return: a Datasource object
+        """
+        return Datasource(self.filename, self.var, load = load, **self.options)
+
+    # III. Top-Level Methods
+    def read(self):
+        """
+        Reads the data of the spec in this process
+        :return: an XArray DataArray or Dataset, or 'None'
+        """
+        if self.window is None:
+            source = self.open(load = True)
+            return None if source.reader is None else source.reader.data
+
+        source = self.open()
+        if source.reader is None:
+            return None
+
+        arrays = {}
+        for var in source.get_requested_vars():
+            arrays[var] = source.reader.read_window(var, self.window)
+
+        if isinstance(self.var, str) or (self.var is not None and len(self.var) == 1):
+            return next(iter(arrays.values()), None)
+        return xr.Dataset(arrays) if arrays else None
+
+    def apply(self, func, *args, **kwargs):
+        """
+        Reads the data of the spec and returns a function of it, computed in this process
+        :param func: a callable taking the data first
+        :return: the callable's result
+        """
+        return func(self.read(), *args, **kwargs)
+
+
+# II. TOP-LEVEL FUNCTIONS - - - - - - -
+def open_spec(spec, load = False):
+    """
+    Opens the Datasource of a spec (used to unpickle Datasource objects)
+    :param spec: a DatasourceSpec object
+    :param load: whether to read the whole variable(s) now
+    :return: a Datasource object
+    """
+    return spec.open(load)
+
+
+def read_spec(spec):
+    """
+    Reads the data of a spec (a picklable function for executors)
+    :param spec: a DatasourceSpec object
+    :return: an XArray DataArray or Dataset, or 'None'
+    """
+    return spec.read()
+
+
+def apply_spec(spec, func, *args, **kwargs):
+    """
+    Reads the data of a spec and returns a function of it (a picklable function for executors)
+    :param spec: a DatasourceSpec object
+    :param func: a picklable callable taking the data first
+    :return: the callable's result
+    """
+    return spec.apply(func, *args, **kwargs)
+
+
+def map_specs(specs, func = None, workers = None):
+    """
+    Reads many specs in a process pool, returning the data or a function of it
+    :param specs: a Python list of DatasourceSpec objects
+    :param func: a picklable callable taking the data, or 'None' to return the data
+    :param workers: the number of worker processes, 'None' for one per CPU, or 1 to run in this process
+    :return: a Python list of results in spec order
+    """
+    specs = list(specs)
+    task = read_spec if func is None else functools.partial(apply_spec, func = func)
+
+    if workers == 1 or len(specs) <= 1:
+        return [task(spec) for spec in specs]
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        return list(pool.map(task, specs, chunksize = max(1, len(specs) // (4 * workers))))
@@ -0,0 +1,402 @@
+"""
+The purpose of this file is to convert archives of OMI HE5 and Landsat HDF4 files into chunked, compressed
+Zarr stores or NetCDF4 files through Datasource (eviz-convert).
+
+    • Every variable is copied one output chunk at a time (Datasource.read_into), so peak memory depends on the
+      chunk size and not on the file size
+    • Files are converted in parallel by a process pool
+    • Progress is kept in a JSON checkpoint file; rerunning the same command skips converted files and retries
+      failed ones. Outputs are written under a '.partial' name and only renamed once complete, so an
+      interrupted file is never mistaken for a finished one
+
+Output layout (one store/file per input, named after it):
+    time (time)               -> seconds since 1970-01-01
+    lat (lat), lon (lon)      -> reader coordinates
+    <variable> (time, lat, lon) -> restored values (fill values are NaN; scale & offset already applied)
+
+Inputs may be directories (searched recursively for .he5/.hdf files), glob patterns, or catalog text files
+listing one path per line.
+
+Usage:
+    python eviz_convert.py INPUT [INPUT ...] -o OUTDIR [--format {zarr,netcdf}] [--vars VAR [VAR ...]]
+                           [--chunks ROWS COLS] [--dtype {float32,float64}] [--workers N] [--checkpoint FILE]
+
+Zarr output needs the 'zarr' package and NetCDF output the 'netCDF4' package.
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import os
+import glob
+import json
+import time
+import shutil
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from datasource import Datasource
+
+log = logging.getLogger(__name__)
+
+EXTENSIONS = ('.he5', '.hdf')
+
+# Attributes xarray would apply again when decoding already restored values
+CF_DECODING_ATTRS = ('scale_factor', 'add_offset', 'missing_value', 'valid_range', 'valid_min', 'valid_max')
+
+
+# II. WRITERS - - - - - - -
+class ZarrWriter:
+    """
+    Writes variables chunk by chunk into a Zarr store.
+    """
+
+    suffix = '.zarr'
+
+    def __init__(self, path, mode = 'w'):
+        """
+        Creates an empty Zarr store, or opens an existing one
+        :param path: the store path String
+        :param mode: 'w' (create, replacing any existing store), 'a' (read/write, create if missing) or 'r'
+        """
+        import zarr
+
+        self.zarr = zarr
+        self.path = path
+        self.group = zarr.open_group(path, mode = mode)
+        self.arrays = {name: arr for name, arr in self.group.arrays()}
+
+    def create(self, name, dims, shape, chunks, dtype, attrs, fill = None):
+        """
+        Creates a variable
+        :param name: the variable name String
+        :param dims: a tuple of dimension name Strings
+        :param shape: a tuple of dimension sizes
+        :param chunks: a tuple of chunk sizes
+        :param dtype: a NumPy dtype
+        :param attrs: a Python dictionary of JSON-compatible attributes
+        :param fill: the fill value or 'None'
+        """
+        if hasattr(self.group, 'create_array'):   # zarr >= 3
+            arr = self.group.create_array(name, shape = shape, chunks = chunks, dtype = dtype, fill_value = fill,
+                                          dimension_names = dims)
+        else:
+            arr = self.group.create_dataset(name, shape = shape, chunks = chunks, dtype = dtype, fill_value = fill)
+            attrs = dict(attrs, _ARRAY_DIMENSIONS = list(dims))
+        arr.attrs.update(attrs)
+        self.arrays[name] = arr
+
+    def write(self, name, index, values):
+        """
+        Writes values into a region of a variable
+        :param name: the variable name String
+        :param index: a tuple of slices
+        :param values: a NumPy array
+        """
+        self.arrays[name][index] = values
+
+    def close(self):
+        """
+        Consolidates the store metadata so readers open it with one request
+        """
+        self.zarr.consolidate_metadata(self.path)
+
+
+class NetCDFWriter:
+    """
+    Writes variables chunk by chunk into a compressed NetCDF4 file.
+    """
+
+    suffix = '.nc'
+
+    def __init__(self, path, complevel = 4):
+        """
+        Creates an empty NetCDF4 file
+        :param path: the file path String
+        :param complevel: the zlib compression level
+        """
+        import netCDF4
+
+        self.fid = netCDF4.Dataset(path, 'w', format = 'NETCDF4')
+        self.complevel = complevel
+
+    def create(self, name, dims, shape, chunks, dtype, attrs, fill = None):
+        """
+        Creates a variable (and any missing dimensions)
+        :param name: the variable name String
+        :param dims: a tuple of dimension name Strings
+        :param shape: a tuple of dimension sizes
+        :param chunks: a tuple of chunk sizes
+        :param dtype: a NumPy dtype
+        :param attrs: a Python dictionary of attributes
+        :param fill: the fill value or 'None'
+        """
+        for dim, size in zip(dims, shape):
+            if dim not in self.fid.dimensions:
+                self.fid.createDimension(dim, size)
+
+        var = self.fid.createVariable(name, dtype, dims, zlib = True, complevel = self.complevel,
+                                      chunksizes = chunks, fill_value = fill)
+        var.setncatts(attrs)
+
+    def write(self, name, index, values):
+        """
+        Writes values into a region of a variable
+        :param name: the variable name String
+        :param index: a tuple of slices
+        :param values: a NumPy array
+        """
+        self.fid.variables[name][index] = values
+
+    def close(self):
+        """
+        Closes the file
+        """
+        self.fid.close()
+
+
+WRITERS = {'zarr': ZarrWriter, 'netcdf': NetCDFWriter}
+
+
+# III. HELPER FUNCTIONS - - - - - - -
+def find_inputs(sources):
+    """
+    Expands directories, glob patterns and catalog text files into a list of data files
+    :param sources: a Python list of path, pattern, or catalog file Strings
+    :return: a sorted Python list of unique full path Strings
+    """
+    paths = []
+
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                paths += [os.path.join(root, f) for f in files if f.endswith(EXTENSIONS)]
+        elif os.path.isfile(source) and not source.endswith(EXTENSIONS):   # Catalog: one path per line
+            with open(source) as f:
+                paths += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        else:
+            paths += glob.glob(source)
+
+    return sorted(set(os.path.abspath(path) for path in paths))
+
+
+def clean_attrs(attrs):
+    """
+    Converts reader attributes into JSON/NetCDF-compatible values, leaving out reserved ('_') names and
+    renaming attributes that would make xarray restore the already restored data again
+    :param attrs: a Python dictionary of attributes
+    :return: a Python dictionary of attributes
+    """
+    cleaned = {}
+
+    for key, value in attrs.items():
+        if key.startswith('_'):
+            continue
+        if key in CF_DECODING_ATTRS:
+            key = 'source_' + key
+
+        if isinstance(value, (list, tuple, np.ndarray)):
+            value = [v.item() if isinstance(v, np.generic) else v for v in value]
+        elif isinstance(value, np.generic):
+            value = value.item()
+        elif not isinstance(value, (str, int, float)):
+            value = str(value)
+        cleaned[key] = value
+
+    return cleaned
+
+
+def encode_times(times):
+    """
+    Encodes reader time coordinates as seconds since 1970-01-01
+    :param times: a datetime64 NumPy array, or an array of date Strings (e.g. '2011-08-02T20:51:34.000000Z')
+    :return: an int64 NumPy array and a Python dictionary of attributes
+    """
+    times = np.asarray(times)
+    if np.issubdtype(times.dtype, np.datetime64):
+        return times.astype('datetime64[s]').astype('int64'), {'units': 'seconds since 1970-01-01',
+                                                               'calendar': 'standard'}
+    try:
+        seconds = np.array([np.datetime64(str(t).rstrip('Z'), 's') for t in times]).astype('int64')
+    except ValueError:
+        return np.arange(len(times), dtype = 'int64'), {'source_times': [str(t) for t in times]}
+
+    return seconds, {'units': 'seconds since 1970-01-01', 'calendar': 'standard'}
+
+
+def load_checkpoint(path):
+    """
+    Returns the conversion state saved in a checkpoint file
+    :param path: the checkpoint file path String or 'None'
+    :return: a Python dictionary of input path String keys and result dictionary values
+    """
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, state):
+    """
+    Saves the conversion state (atomically, so an interruption can't leave a broken checkpoint)
+    :param path: the checkpoint file path String or 'None'
+    :param state: a Python dictionary of input path String keys and result dictionary values
+    """
+    if path is None:
+        return
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent = 2)
+    os.replace(path + '.tmp', path)
+
+
+def remove(path):
+    """
+    Removes a file or directory if it exists
+    :param path: a path String
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+# IV. CONVERSION - - - - - - -
+def convert_file(filename, outdir, fmt = 'zarr', variables = None, chunks = (512, 512), dtype = 'float32'):
+    """
+    Converts one data file variable by variable, chunk by chunk
+    :param filename: a full path String
+    :param outdir: the output directory String
+    :param fmt: 'zarr' or 'netcdf'
+    :param variables: a Python list of variable name Strings or 'None' for every variable
+    :param chunks: a tuple of (rows, columns) per output chunk
+    :param dtype: the output data type String ('float32' or 'float64')
+    :return: a Python dictionary of the result (status, output, vars, seconds, and error if any)
+    """
+    start = time.perf_counter()
+    source = Datasource(filename, load = False)
+
+    if source.reader is None:
+        return {'status': 'skipped', 'error': 'unknown file type'}
+
+    names = [var for var in source.get_vars() if variables is None or var in variables]
+    if not names:
+        return {'status': 'skipped', 'error': 'no matching variables'}
+
+    cls = WRITERS[fmt]
+    output = os.path.join(outdir, os.path.basename(filename) + cls.suffix)
+    partial = output + '.partial'
+    remove(partial)
+
+    writer = cls(partial)
+    dims_written = {}   # dimension name -> size
+    buffer = np.empty(chunks[0] * chunks[1], dtype = dtype)
+
+    try:
+        for var in names:
+            shape = source.reader.get_shape(var)
+            if len(shape) != 2:
+                log.warning(f"SKIPPING VARIABLE '{var}' WITH SHAPE {shape}")
+                continue
+
+            grid = source.get_grid(var)
+
+            dims = []
+            for dim, values in grid['coords'].items():
+                if dims_written.get(dim, values.size) != values.size:   # Same name, different grid
+                    dim = f'{dim}{values.size}'
+                if dim not in dims_written:
+                    if dim.startswith('time'):
+                        values, attrs = encode_times(values)
+                    else:
+                        attrs = {}
+                    writer.create(dim, (dim,), values.shape, values.shape, values.dtype, attrs)
+                    writer.write(dim, (slice(None),), values)
+                    dims_written[dim] = values.size
+                dims.append(dim)
+
+            out_chunks = (1, min(chunks[0], shape[0]), min(chunks[1], shape[1]))
+            writer.create(var, tuple(dims), (1,) + tuple(shape), out_chunks, np.dtype(dtype),
+                          clean_attrs(grid['attrs']), fill = np.nan)
+
+            for window in source.get_windows(shape, chunks):
+                size = (window[0].stop - window[0].start, window[1].stop - window[1].start)
+                out = buffer[:size[0] * size[1]].reshape(size)   # C-contiguous view of the reused buffer
+                source.read_into(var, out, window)
+                writer.write(var, (slice(0, 1),) + window, out[np.newaxis])
+
+    finally:
+        writer.close()
+        Datasource.close_handles(filename)
+
+    remove(output)
+    os.replace(partial, output)
+
+    return {'status': 'done', 'output': output, 'vars': names, 'seconds': time.perf_counter() - start}
+
+
+def convert_worker(filename, outdir, fmt, variables, chunks, dtype):
+    """
+    Converts one file in a worker process, returning errors instead of raising them
+    :return: a Python dictionary of the result (see convert_file)
+    """
+    logging.disable(logging.INFO)
+    try:
+        return convert_file(filename, outdir, fmt, variables, chunks, dtype)
+    except Exception as e:
+        return {'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+
+
+def convert(sources, outdir, fmt = 'zarr', variables = None, chunks = (512, 512), dtype = 'float32',
+            workers = None, checkpoint = None):
+    """
+    Converts every data file of the given sources across a process pool, resuming from a checkpoint
+    :param sources: a Python list of directory, glob pattern, or catalog file Strings
+    :param outdir: the output directory String
+    :param fmt: 'zarr' or 'netcdf'
+    :param variables: a Python list of variable name Strings or 'None' for every variable
+    :param chunks: a tuple of (rows, columns) per output chunk
+    :param dtype: the output data type String
+    :param workers: the number of worker processes or 'None' for one per CPU
+    :param checkpoint: the checkpoint file path String or 'None'
+    :return: a Python dictionary of input path String keys and result dictionary values
+    """
+    os.makedirs(outdir, exist_ok = True)
+    state = load_checkpoint(checkpoint)
+
+    todo = [fn for fn in find_inputs(sources) if state.get(fn, {}).get('status') not in ('done', 'skipped')]
+    log.info(f'CONVERTING {len(todo)} FILES ({len(state)} IN CHECKPOINT)')
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = {pool.submit(convert_worker, fn, outdir, fmt, variables, tuple(chunks), dtype): fn for fn in todo}
+
+        for future in as_completed(futures):
+            fn = futures[future]
+            state[fn] = future.result()
+            save_checkpoint(checkpoint, state)
+            log.info(f"{state[fn]['status'].upper()}: {fn} {state[fn].get('error', '')}")
+
+    return state
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Convert OMI and Landsat HDF files to Zarr or NetCDF4')
+    parser.add_argument('inputs', nargs = '+', help = 'directories, glob patterns, or catalog files')
+    parser.add_argument('-o', '--outdir', required = True)
+    parser.add_argument('--format', choices = sorted(WRITERS), default = 'zarr')
+    parser.add_argument('--vars', nargs = '+', default = None)
+    parser.add_argument('--chunks', type = int, nargs = 2, default = (512, 512))
+    parser.add_argument('--dtype', choices = ('float32', 'float64'), default = 'float32')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--checkpoint', default = None,
+                        help = "JSON progress file (default: OUTDIR/eviz_convert.json)")
+    args = parser.parse_args()
+
+    results = convert(args.inputs, args.outdir, args.format, args.vars, args.chunks, args.dtype, args.workers,
+                      args.checkpoint or os.path.join(args.outdir, 'eviz_convert.json'))
+
+    counts = {}
+    for result in results.values():
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    print(', '.join(f'{count} {status}' for status, count in sorted(counts.items())))
@@ -0,0 +1,376 @@
+"""
+The purpose of this file is to make PNG browse images (quicklooks) of archives of OMI HE5 and Landsat HDF4 files
+(eviz-quicklook), e.g. nightly for the new files of a catalog.
+
+    • Each image is read already reduced to its pixel grid (render_grid.py): by default one strided read
+      ('nearest'), or band-by-band aggregation ('mean', 'max', ...); whole variables are never read
+    • Color limits are fixed (--limits) or derived from percentiles of each image's values (--percentiles)
+    • Files are rendered in parallel by a process pool; the rows read at once are sized to a memory budget
+      per worker (--max-memory), and workers are replaced after MAX_TASKS_PER_WORKER files
+    • Each PNG records its source file, the source modification time and the render settings (PNG text
+      chunks); rerunning skips images that are current, and images are written under a '.partial' name and
+      only renamed once complete
+    • Missing values (fill, masked) are transparent; north is up
+    • OMI Level 2 swath files are binned onto a global grid (swath_binning.py; cell means, whatever --agg is)
+
+Output layout: OUTDIR/<input filename>.<variable>.png
+
+Inputs may be directories (searched recursively for .he5/.hdf files), glob patterns, or catalog text files
+listing one path per line.
+
+Usage:
+    python eviz_quicklook.py INPUT [INPUT ...] -o OUTDIR [--var VAR] [--size WIDTH HEIGHT]
+                             [--agg {nearest,mean,min,max,mode}] [--limits VMIN VMAX | --percentiles LOW HIGH]
+                             [--cmap NAME] [--workers N] [--max-memory SIZE] [--force]
+
+Colormaps other than the built-in ones (COLORMAPS) need the 'matplotlib' package.
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import os
+import json
+import time
+import zlib
+import struct
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from datasource import Datasource, parse_size
+from eviz_convert import find_inputs, remove
+from omi_reader import OMIReader
+import render_grid
+import swath_binning
+
+log = logging.getLogger(__name__)
+
+# Variable rendered when none is given (else the file's first variable)
+DEFAULT_VARS = {'OMI': 'ColumnAmountO3', 'Landsat': 'sr_band4'}
+
+# Built-in colormaps: evenly spaced RGB anchors, interpolated to 256 colors
+COLORMAPS = {'viridis': ['440154', '482878', '3e4989', '31688e', '26828e', '1f9e89', '35b779', '6ece58', 'b5de2b',
+                         'fde725'],
+             'magma': ['000004', '180f3d', '440f76', '721f81', '9e2f7f', 'cd4071', 'f1605d', 'fd9668', 'feca8d',
+                       'fcfdbf'],
+             'gray': ['000000', 'ffffff']}
+
+# Approximate peak bytes per data pixel of a band being aggregated (float32 data, int64 indices, temporaries)
+BYTES_PER_PIXEL = 32
+
+MAX_TASKS_PER_WORKER = 100
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+# II. PNG - - - - - - -
+def png_chunk(kind, data):
+    """
+    Returns one PNG chunk
+    :param kind: the 4-byte chunk type
+    :param data: the chunk data bytes
+    :return: bytes
+    """
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def write_png(path, rgba, text = None, level = 6):
+    """
+    Writes an 8-bit RGBA image as a PNG file
+    :param path: the output path String
+    :param rgba: a uint8 NumPy array (rows, columns, 4)
+    :param text: a Python dictionary of String keys and values stored as text chunks, or 'None'
+    :param level: the zlib compression level
+    """
+    height, width = rgba.shape[:2]
+    rows = np.empty((height, 1 + width * 4), dtype = 'uint8')
+    rows[:, 0] = 0   # Filter type 'None' on every row
+    rows[:, 1:] = rgba.reshape(height, width * 4)
+
+    chunks = [png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))]
+    for key, value in (text or {}).items():
+        chunks.append(png_chunk(b'tEXt', key.encode('latin-1') + b'\0' + value.encode('latin-1')))
+    chunks.append(png_chunk(b'IDAT', zlib.compress(rows.tobytes(), level)))
+    chunks.append(png_chunk(b'IEND', b''))
+
+    with open(path, 'wb') as f:
+        f.write(PNG_SIGNATURE + b''.join(chunks))
+
+
+def read_png_text(path):
+    """
+    Reads the text chunks of a PNG file (stopping at the image data)
+    :param path: a PNG path String
+    :return: a Python dictionary of String keys and values, or 'None' if the file isn't a readable PNG
+    """
+    text = {}
+    try:
+        with open(path, 'rb') as f:
+            if f.read(8) != PNG_SIGNATURE:
+                return None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return text
+                length, kind = struct.unpack('>I4s', header)
+                if kind in (b'IDAT', b'IEND'):
+                    return text
+                data = f.read(length)
+                f.read(4)   # CRC
+                if kind == b'tEXt':
+                    key, _, value = data.partition(b'\0')
+                    text[key.decode('latin-1')] = value.decode('latin-1')
+    except OSError:
+        return None
+
+
+# III. HELPER FUNCTIONS - - - - - - -
+def get_colormap(name):
+    """
+    Returns a 256-color lookup table
+    :param name: a built-in colormap name (see COLORMAPS) or a matplotlib colormap name
+    :return: a uint8 NumPy array (256, 3)
+    """
+    if name in COLORMAPS:
+        anchors = np.array([[int(color[i:i + 2], 16) for i in (0, 2, 4)] for color in COLORMAPS[name]], dtype = float)
+        positions = np.linspace(0, 1, len(anchors))
+        levels = np.linspace(0, 1, 256)
+        colors = np.stack([np.interp(levels, positions, anchors[:, i]) for i in range(3)], axis = 1)
+        return colors.round().astype('uint8')
+
+    # Needs matplotlib
+    from matplotlib import colormaps
+
+    return (colormaps[name](np.linspace(0, 1, 256))[:, :3] * 255).round().astype('uint8')
+
+
+def get_limits(values, limits = None, percentiles = (2, 98)):
+    """
+    Returns the color limits of an image
+    :param values: a NumPy array (NaN for missing)
+    :param limits: a tuple of fixed (vmin, vmax) or 'None'
+    :param percentiles: a tuple of (low, high) percentiles of the valid values used when limits is 'None'
+    :return: a tuple of (vmin, vmax) floats, or 'None' if there are no valid values
+    """
+    if limits is not None:
+        return float(limits[0]), float(limits[1])
+
+    valid = values[~np.isnan(values)]
+    if valid.size == 0:
+        return None
+    vmin, vmax = np.percentile(valid, percentiles)
+    return float(vmin), float(vmax)
+
+
+def colorize(values, vmin, vmax, colormap):
+    """
+    Maps values to RGBA colors (missing values are transparent)
+    :param values: a 2D NumPy array (NaN for missing)
+    :param vmin: the value of the first color
+    :param vmax: the value of the last color
+    :param colormap: a uint8 NumPy array (256, 3) (see get_colormap)
+    :return: a uint8 NumPy array (rows, columns, 4)
+    """
+    valid = ~np.isnan(values)
+    scale = 255.0 / (vmax - vmin) if vmax > vmin else 0.0
+    index = np.clip((np.where(valid, values, vmin) - vmin) * scale, 0, 255).astype('uint8')
+
+    rgba = np.empty(values.shape + (4,), dtype = 'uint8')
+    rgba[..., :3] = colormap[index]
+    rgba[..., 3] = np.where(valid, 255, 0)
+    return rgba
+
+
+def get_output(filename, var, outdir):
+    """
+    Returns the quicklook path of a variable of a file
+    :return: a path String
+    """
+    return os.path.join(outdir, f'{os.path.basename(filename)}.{var}.png')
+
+
+def is_current(output, filename, settings):
+    """
+    Returns whether a quicklook exists for the current version of its source file and the same settings
+    :param output: the PNG path String
+    :param filename: the source file path String
+    :param settings: a Python dictionary of render settings
+    :return: Boolean
+    """
+    text = read_png_text(output) if os.path.exists(output) else None
+    if not text:
+        return False
+
+    return (text.get('eviz:source_mtime') == repr(os.path.getmtime(filename))
+            and text.get('eviz:settings') == json.dumps(settings, sort_keys = True))
+
+
+def render_swath(filename, var, size, max_memory = None):
+    """
+    Renders an OMI Level 2 swath file by binning its pixels onto a global grid (see swath_binning.py), as
+    swaths have no grid of their own to aggregate
+    :param filename: a full path String
+    :param var: a data variable String
+    :param size: a tuple of the maximum (width, height) in pixels
+    :param max_memory: the memory budget of a block of scanlines (bytes or a String such as '512MB') or 'None'
+    :return: an XArray DataArray (lat, lon) of float32 cell means
+    """
+    resolution = max(360.0 / size[0], 180.0 / size[1])   # Square cells: 2:1 global images within size
+
+    block_scanlines = swath_binning.BLOCK_SCANLINES
+    if max_memory is not None:
+        nxtrack = OMIReader(filename, load = False).get_shape(var)[1]
+        block_scanlines = max(1, parse_size(max_memory) // (BYTES_PER_PIXEL * nxtrack))
+
+    binned = swath_binning.bin_swaths([filename], var, resolution, block_scanlines = block_scanlines, workers = 1)
+    return binned[var].astype('float32')
+
+
+# IV. QUICKLOOKS - - - - - - -
+def quicklook_file(filename, outdir, var = None, size = (1024, 1024), agg = 'nearest', limits = None,
+                   percentiles = (2, 98), cmap = 'viridis', max_memory = None, force = False):
+    """
+    Renders the quicklook of one data file (if it isn't current)
+    :param filename: a full path String
+    :param outdir: the output directory String
+    :param var: a data variable String or 'None' for the file type's default (see DEFAULT_VARS)
+    :param size: a tuple of the maximum (width, height) in pixels (the aspect ratio of the data is kept)
+    :param agg: how data pixels of grids are aggregated (see render_grid.AGGREGATIONS; swaths are binned means)
+    :param limits: a tuple of fixed color limits (vmin, vmax) or 'None' for percentiles
+    :param percentiles: a tuple of (low, high) percentiles used as color limits when limits is 'None'
+    :param cmap: a colormap name (see get_colormap)
+    :param max_memory: the memory budget of a band being aggregated (bytes or a String such as '512MB') or 'None'
+    :param force: whether to render even if the quicklook is current
+    :return: a Python dictionary of the result (status, output, limits, seconds, and error if any)
+    """
+    start = time.perf_counter()
+    source = Datasource(filename, load = False)
+
+    if source.reader is None:
+        return {'status': 'skipped', 'error': 'unknown file type'}
+
+    names = source.get_vars()
+    if var is None:
+        var = DEFAULT_VARS.get(source.stype) if DEFAULT_VARS.get(source.stype) in names else next(iter(names), None)
+    if var not in names:
+        return {'status': 'skipped', 'error': f"no variable '{var}'"}
+
+    output = get_output(filename, var, outdir)
+    settings = {'var': var, 'size': list(size), 'agg': agg, 'limits': None if limits is None else list(limits),
+                'percentiles': list(percentiles), 'cmap': cmap}
+    if not force and is_current(output, filename, settings):
+        return {'status': 'current', 'output': output}
+
+    shape = source.reader.get_shape(var)
+    if shape is None or len(shape) != 2:
+        return {'status': 'skipped', 'error': f"'{var}' isn't a 2D grid"}
+
+    if getattr(source.reader, 'is_swath', lambda: False)():   # Level 2: binned (mean) instead of aggregated
+        try:
+            image = render_swath(filename, var, size, max_memory)
+        finally:
+            Datasource.close_handles(filename)
+    else:
+        # The largest image within size that keeps the aspect ratio and isn't finer than the data
+        scale = min(size[0] / shape[1], size[1] / shape[0], 1.0)
+        width, height = max(1, round(shape[1] * scale)), max(1, round(shape[0] * scale))
+
+        block_rows = render_grid.BLOCK_ROWS
+        if max_memory is not None:
+            block_rows = max(1, parse_size(max_memory) // (BYTES_PER_PIXEL * shape[1]))
+
+        try:
+            image = render_grid.render(source, var, width, height, agg = agg, block_rows = block_rows)
+        finally:
+            Datasource.close_handles(filename)
+    if image is None:
+        return {'status': 'failed', 'error': f"could not read '{var}'"}
+
+    values = image.values
+    lats = image[image.dims[0]].values
+    if lats.size > 1 and lats[0] < lats[-1]:   # North up
+        values = values[::-1]
+
+    color_limits = get_limits(values, limits, percentiles) or (0.0, 1.0)
+    rgba = colorize(values, *color_limits, get_colormap(cmap))
+
+    text = {'Title': f'{os.path.basename(filename)} {var}',
+            'eviz:source': filename,
+            'eviz:source_mtime': repr(os.path.getmtime(filename)),
+            'eviz:settings': json.dumps(settings, sort_keys = True),
+            'eviz:limits': json.dumps(list(color_limits))}
+
+    partial = output + '.partial'
+    try:
+        write_png(partial, rgba, text)
+        os.replace(partial, output)
+    finally:
+        remove(partial)
+
+    return {'status': 'done', 'output': output, 'limits': list(color_limits),
+            'seconds': time.perf_counter() - start}
+
+
+def quicklook_worker(filename, outdir, options):
+    """
+    Renders one quicklook in a worker process, returning errors instead of raising them
+    :return: a Python dictionary of the result (see quicklook_file)
+    """
+    logging.disable(logging.INFO)
+    try:
+        return quicklook_file(filename, outdir, **options)
+    except Exception as e:
+        return {'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+
+
+def quicklook(sources, outdir, workers = None, **options):
+    """
+    Renders the quicklooks of every data file of the given sources that isn't current, across a process pool
+    :param sources: a Python list of directory, glob pattern, or catalog file Strings
+    :param outdir: the output directory String
+    :param workers: the number of worker processes or 'None' for one per CPU
+    :param options: quicklook_file keyword arguments
+    :return: a Python dictionary of input path String keys and result dictionary values
+    """
+    os.makedirs(outdir, exist_ok = True)
+    todo = find_inputs(sources)
+    log.info(f'QUICKLOOKS OF {len(todo)} FILES')
+
+    results = {}
+    with ProcessPoolExecutor(max_workers = workers, max_tasks_per_child = MAX_TASKS_PER_WORKER) as pool:
+        futures = {pool.submit(quicklook_worker, fn, outdir, options): fn for fn in todo}
+
+        for future in as_completed(futures):
+            fn = futures[future]
+            results[fn] = future.result()
+            log.debug(f"{results[fn]['status'].upper()}: {fn} {results[fn].get('error', '')}")
+
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Make PNG quicklooks of OMI and Landsat HDF files')
+    parser.add_argument('inputs', nargs = '+', help = 'directories, glob patterns, or catalog files')
+    parser.add_argument('-o', '--outdir', required = True)
+    parser.add_argument('--var', default = None, help = 'the variable to render (default: by file type)')
+    parser.add_argument('--size', type = int, nargs = 2, default = (1024, 1024), metavar = ('WIDTH', 'HEIGHT'))
+    parser.add_argument('--agg', choices = render_grid.AGGREGATIONS, default = 'nearest')
+    limits = parser.add_mutually_exclusive_group()
+    limits.add_argument('--limits', type = float, nargs = 2, default = None, metavar = ('VMIN', 'VMAX'))
+    limits.add_argument('--percentiles', type = float, nargs = 2, default = (2, 98), metavar = ('LOW', 'HIGH'))
+    parser.add_argument('--cmap', default = 'viridis')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--max-memory', default = None, help = 'memory budget per worker, e.g. 512MB')
+    parser.add_argument('--force', action = 'store_true', help = 'render current quicklooks again')
+    args = parser.parse_args()
+
+    results = quicklook(args.inputs, args.outdir, args.workers, var = args.var, size = tuple(args.size),
+                        agg = args.agg, limits = args.limits, percentiles = tuple(args.percentiles), cmap = args.cmap,
+                        max_memory = args.max_memory, force = args.force)
+
+    counts = {}
+    for result in results.values():
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    print(', '.join(f'{count} {status}' for status, count in sorted(counts.items())))
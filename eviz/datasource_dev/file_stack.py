@@ -0,0 +1,102 @@
+"""
+The purpose of this file is to select and stack many OMI or Landsat files of one grid along a datetime64
+time axis, using the times in their filenames (see filename_meta.py) so no file is opened to find them.
+
+    • index_files sorts files by time once; select_files then finds a time range by binary search
+    • open_stack reads the selected files straight into one preallocated (time, lat, lon) array (read_into),
+      with a monotonic datetime64[ns] time index that .sel(time = slice(...)) can use
+
+Usage:
+    stack = open_stack(glob.glob('OMI/*.he5'), 'ColumnAmountO3', start = '2022-07-01', end = '2022-07-31')
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import logging
+
+import numpy as np
+import xarray as xr
+
+from datasource import Datasource
+import filename_meta
+
+log = logging.getLogger(__name__)
+
+
+# II. HELPER FUNCTIONS - - - - - - -
+def file_time(path):
+    """
+    Returns the time of a file from its name
+    :param path: a filename or path String
+    :return: a datetime64[ns] or NaT if the name follows neither naming convention
+    """
+    meta = filename_meta.parse(path)
+    if meta is None:
+        return np.datetime64('NaT', 'ns')
+    return np.datetime64(meta['date'], 'ns')
+
+
+def index_files(paths):
+    """
+    Sorts files by the time in their names (files without one are left out)
+    :param paths: a Python list of path Strings
+    :return: a tuple of a Python list of sorted paths and a datetime64[ns] NumPy array of their times
+    """
+    paths = list(paths)
+    times = np.array([file_time(path) for path in paths], dtype = 'datetime64[ns]')
+
+    for path in [path for path, time in zip(paths, times) if np.isnat(time)]:
+        log.warning(f'SKIPPING {path}: NO TIME IN FILENAME')
+
+    order = np.argsort(times, kind = 'stable')
+    order = order[~np.isnat(times[order])]
+    return [paths[i] for i in order], times[order]
+
+
+def select_files(paths, times, start = None, end = None):
+    """
+    Selects the files of a time range from an index (see index_files)
+    :param paths: a Python list of paths sorted by time
+    :param times: a sorted datetime64 NumPy array of their times
+    :param start: the first time (datetime64, datetime.date or ISO String) or 'None'
+    :param end: the last time (inclusive) or 'None'
+    :return: a tuple of the selected paths and times
+    """
+    first = 0 if start is None else np.searchsorted(times, np.datetime64(start, 'ns'), side = 'left')
+    last = len(times) if end is None else np.searchsorted(times, np.datetime64(end, 'ns'), side = 'right')
+    return paths[first:last], times[first:last]
+
+
+# III. TOP-LEVEL FUNCTIONS - - - - - - -
+def open_stack(paths, var, start = None, end = None, window = None, dtype = 'float32'):
+    """
+    Reads one variable of many files on the same grid into a (time, lat, lon) DataArray sorted by time
+    :param paths: a Python list of path Strings (any order)
+    :param var: a data variable String
+    :param start: the first time (datetime64, datetime.date or ISO String) or 'None'
+    :param end: the last time (inclusive) or 'None'
+    :param window: a tuple of (row, column) slices or 'None' for the whole grid
+    :param dtype: the floating-point dtype of the stack
+    :return: an XArray DataArray with the file path of each time step, or 'None' if no file was selected
+    """
+    paths, times = select_files(*index_files(paths), start, end)
+    if not paths:
+        log.warning('NO FILES SELECTED')
+        return None
+
+    grid = Datasource(paths[0], load = False).get_grid(var)
+    if grid is None:
+        return None
+
+    dims = grid['dims']
+    coords = {dim: grid['coords'][dim] for dim in dims[1:]}
+    if window is not None:
+        coords = {dim: coords[dim][win] for dim, win in zip(dims[1:], window)}
+
+    stack = np.empty((len(paths),) + tuple(coord.size for coord in coords.values()), dtype = dtype)
+    for i, path in enumerate(paths):
+        if Datasource(path, load = False).read_into(var, stack[i], window) is None:
+            stack[i] = np.nan   # Variable missing in this file (warned by the reader)
+
+    coords[dims[0]] = times
+    coords['file'] = (dims[0], paths)
+    return xr.DataArray(stack, dims = dims, coords = coords, name = var, attrs = grid['attrs'])
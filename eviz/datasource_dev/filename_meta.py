@@ -0,0 +1,71 @@
+"""
+The purpose of this file is to parse the metadata encoded in OMI and Landsat filenames, so catalogs can be
+built and filtered without opening any file.
+
+    • Landsat: LXSPPPRRRYYYYDDDGSIVV (e.g. LT50830152011214GLC00.hdf)
+        sensor (X), satellite (S), WRS path (PPP) & row (RRR), acquisition year & day of year (YYYYDDD),
+        ground station (GSI), version (VV)
+
+    • OMI: <instrument>_<level>-<product>_<YYYY>m<MMDD>[t<hhmm>-o<orbit>]_v<VVV>-<YYYY>m<MMDD>t<hhmmss>.<ext>
+        (e.g. OMI-Aura_L3-OMTO3e_2022m0709_v003-2022m0711t031807.he5,
+              OMI-Aura_L2-OMTO3_2022m0709t0023-o98765_v003-2022m0709t063627.he5)
+        instrument, processing level, product, observation date, orbit (Level 2), version, production time
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import os
+import re
+from datetime import date, datetime, timedelta
+
+LANDSAT_PATTERN = re.compile(r'L(?P<sensor>[COITEM])(?P<satellite>[1-8])(?P<path>[0-9]{3})(?P<row>[0-9]{3})'
+                             r'(?P<year>[12][0-9]{3})(?P<doy>[0-3][0-9]{2})(?P<station>[A-Z]{3})(?P<version>[0-9]{2})'
+                             r'[.].{3}$')
+
+OMI_PATTERN = re.compile(r'(?P<instrument>OM[^_]*)_(?P<level>L[1-3])-(?P<product>[^_]+)_'
+                         r'(?P<year>[12][0-9]{3})m(?P<month>[01][0-9])(?P<day>[0-3][0-9])(?:t[0-9]{4}-o(?P<orbit>[0-9]+))?_'
+                         r'v(?P<version>[0-9]{3})-(?P<produced>[12][0-9]{3}m[01][0-9][0-3][0-9]t[0-9]{6})[.].{3}$')
+
+
+# II. PARSERS - - - - - - -
+def parse_landsat(filename):
+    """
+    Returns the metadata of a Landsat filename
+    :param filename: a filename or path String
+    :return: a Python dictionary (sensor, satellite, path, row, date, station, version) or 'None'
+    """
+    match = LANDSAT_PATTERN.match(os.path.basename(filename))
+    if match is None:
+        return None
+
+    fields = match.groupdict()
+    return {'source': 'Landsat', 'sensor': fields['sensor'], 'satellite': int(fields['satellite']),
+            'path': int(fields['path']), 'row': int(fields['row']),
+            'date': date(int(fields['year']), 1, 1) + timedelta(days = int(fields['doy']) - 1),
+            'station': fields['station'], 'version': fields['version']}
+
+
+def parse_omi(filename):
+    """
+    Returns the metadata of an OMI filename
+    :param filename: a filename or path String
+    :return: a Python dictionary (instrument, level, product, date, orbit, version, produced) or 'None'
+    """
+    match = OMI_PATTERN.match(os.path.basename(filename))
+    if match is None:
+        return None
+
+    fields = match.groupdict()
+    return {'source': 'OMI', 'instrument': fields['instrument'], 'level': fields['level'],
+            'product': fields['product'],
+            'date': date(int(fields['year']), int(fields['month']), int(fields['day'])),
+            'orbit': int(fields['orbit']) if fields['orbit'] else None,
+            'version': fields['version'], 'produced': datetime.strptime(fields['produced'], '%Ym%m%dt%H%M%S')}
+
+
+def parse(filename):
+    """
+    Returns the metadata of an OMI or Landsat filename
+    :param filename: a filename or path String
+    :return: a Python dictionary or 'None'
+    """
+    return parse_landsat(filename) or parse_omi(filename)
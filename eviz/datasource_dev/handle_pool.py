@@ -0,0 +1,169 @@
+"""
+The purpose of this file is to define the HandlePool class, a bounded LRU pool of open HDF file handles
+shared by all readers of a process so that reading a file again skips the open and metadata traversal.
+
+    • Handles are keyed by path (plus any open options) and reference counted
+    • Only idle handles (no references) are closed when the pool is over its size
+    • Each handle has a lock that readers hold while using it (h5py and HDF4 objects are not safe for
+      concurrent access); a pool may instead share one lock between the pool and all of its handles,
+      which is what the HDF4 library needs since it isn't thread-safe even across files
+    • Each handle carries a 'meta' dictionary where readers cache parsed metadata (data groups,
+      coordinates, attributes) for as long as the handle stays open
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+
+class PooledHandle:
+    """
+    An open file handle held by a HandlePool.
+    """
+
+    def __init__(self, key, fid, lock, mtime):
+        """
+        Wraps an open file handle
+        :param key: the pool key (path, options)
+        :param fid: an open file reader object
+        :param lock: the lock to hold while using the file reader object
+        :param mtime: the file modification time when opened
+        """
+        self.key = key
+        self.fid = fid
+        self.lock = lock
+        self.mtime = mtime
+        self.refs = 0
+        self.uses = 0
+        self.meta = {}
+
+    def __repr__(self):
+        """
+        Returns handle info
+        :return: a String
+        """
+        return f'PooledHandle({self.key[0]}; refs={self.refs}; uses={self.uses})'
+
+
+class HandlePool:
+    """
+    Bounded, thread-safe LRU pool of open file handles with reference counting.
+    """
+
+    def __init__(self, opener, closer, maxsize = 8, lock = None):
+        """
+        Creates an empty pool
+        :param opener: a function (path, **options) returning an open file reader object
+        :param closer: a function closing a file reader object
+        :param maxsize: the maximum number of idle handles kept open
+        :param lock: a lock shared by the pool and all its handles, or 'None' for one lock per handle
+        """
+        self.opener = opener
+        self.closer = closer
+        self.maxsize = maxsize
+        self.shared_lock = lock
+        self.lock = lock if lock is not None else threading.RLock()
+        self.handles = OrderedDict()   # key -> PooledHandle, least recently used first
+
+        os.register_at_fork(after_in_child = self.forget_all)
+
+    def __repr__(self):
+        """
+        Returns pool info
+        :return: a String
+        """
+        return f'HandlePool({len(self.handles)}/{self.maxsize} open) \n' + \
+               '\n'.join(repr(handle) for handle in self.handles.values())
+
+    def __len__(self):
+        return len(self.handles)
+
+    def get_key(self, path, options):
+        """
+        Returns the pool key of a file and its open options
+        :param path: a path String
+        :param options: a Python dictionary of open options
+        :return: a hashable tuple
+        """
+        return (os.path.abspath(path), tuple(sorted(options.items())))
+
+    def acquire(self, path, **options):
+        """
+        Returns an open handle of a file (opening it if needed) and adds a reference to it;
+        the caller holds handle.lock while using handle.fid and calls release() afterwards
+        :param path: a path String
+        :param options: keyword options passed to the opener (part of the pool key)
+        :return: a PooledHandle object
+        """
+        key = self.get_key(path, options)
+
+        with self.lock:
+            handle = self.handles.get(key)
+
+            if handle is not None and handle.refs == 0 and handle.mtime != os.stat(path).st_mtime:
+                self.discard(key)   # File changed on disk since it was opened
+                handle = None
+
+            if handle is None:
+                mtime = os.stat(path).st_mtime
+                fid = self.opener(path, **options)
+                lock = self.shared_lock if self.shared_lock is not None else threading.RLock()
+                handle = PooledHandle(key, fid, lock, mtime)
+                self.handles[key] = handle
+
+            self.handles.move_to_end(key)
+            handle.refs += 1
+            handle.uses += 1
+
+            self.evict()
+            return handle
+
+    def release(self, handle):
+        """
+        Removes a reference to a handle; idle handles stay open until evicted
+        :param handle: a PooledHandle object
+        """
+        with self.lock:
+            handle.refs -= 1
+            if self.handles.get(handle.key) is not handle and handle.refs == 0:
+                self.closer(handle.fid)   # Handle was discarded while in use
+            self.evict()
+
+    def evict(self):
+        """
+        Closes least recently used idle handles until the pool is within its size
+        """
+        with self.lock:
+            idle = [key for key, handle in self.handles.items() if handle.refs == 0]
+            for key in idle[:max(0, len(self.handles) - self.maxsize)]:
+                self.discard(key)
+
+    def discard(self, key):
+        """
+        Removes a handle from the pool, closing it now if idle or on its last release otherwise
+        :param key: a pool key
+        """
+        with self.lock:
+            handle = self.handles.pop(key)
+            if handle.refs == 0:
+                self.closer(handle.fid)
+
+    def close(self, path = None):
+        """
+        Removes the handles of one file (all open options), or all handles
+        :param path: a path String or 'None' for every file
+        """
+        with self.lock:
+            for key in list(self.handles.keys()):
+                if path is None or key[0] == os.path.abspath(path):
+                    self.discard(key)
+
+    def forget_all(self):
+        """
+        Drops every handle without closing it (used in forked child processes, whose inherited
+        handles belong to the parent)
+        """
+        self.handles = OrderedDict()
+        self.lock = threading.RLock()   # Another parent thread may have held the old lock
+        if self.shared_lock is not None:
+            self.shared_lock = self.lock
@@ -0,0 +1,237 @@
+"""
+The purpose of this file is to interpret Landsat quality bands (cfmask and the packed *_qa bands) through
+lookup tables indexed by raw QA value, so a whole tile of QA is turned into a mask or a decoded layer with one
+gather (no per-flag shift/AND temporaries).
+
+Named layers (LandsatReader.read_qa) are decoded into uint8: 0/1 for one-bit flags and cfmask classes, the
+field value for wider fields (e.g. cloud confidence); up to 8 boolean layers can also be bit-packed into one
+uint8 band (bit i = layer i, described by CF flag_masks/flag_meanings attributes).
+
+Quality masks (LandsatReader mask = ...) are given as:
+    • cfmask classes: a class name or value, or a tuple/list of them, e.g. ('cloud', 'shadow')
+    • a Python dictionary of QA variable keys: cfmask -> classes as above; any other (bit-packed) QA band ->
+      an integer of bits, masking pixels where any of them is set, e.g. {'cfmask': 'cloud', 'sr_cloud_qa': 0xFF}
+
+cfmask classes: 0 clear, 1 water, 2 cloud shadow, 3 snow, 4 cloud, 255 fill
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import numpy as np
+
+CFMASK = 'cfmask'
+CFMASK_CLASSES = {'clear': 0, 'water': 1, 'shadow': 2, 'snow': 3, 'cloud': 4, 'fill': 255}
+
+# Named layers of QA bands: (kind, ...) where
+#   ('bits', first bit, number of bits) -> the field value (a flag if one bit)
+#   ('class', value)                    -> whether the QA value is a class value
+#   ('any',)                            -> whether the QA value is nonzero (LEDAPS flag bands store 0 or 255)
+QA_LAYERS = {'cfmask': dict({name: ('class', value) for name, value in CFMASK_CLASSES.items()},
+                            **{'class': ('bits', 0, 8)}),
+             'pixel_qa': {'fill': ('bits', 0, 1), 'clear': ('bits', 1, 1), 'water': ('bits', 2, 1),
+                          'cloud_shadow': ('bits', 3, 1), 'snow': ('bits', 4, 1), 'cloud': ('bits', 5, 1),
+                          'cloud_confidence': ('bits', 6, 2), 'cirrus_confidence': ('bits', 8, 2),
+                          'terrain_occlusion': ('bits', 10, 1)},
+             'sr_cloud_qa': {'ddv': ('bits', 0, 1), 'cloud': ('bits', 1, 1), 'cloud_shadow': ('bits', 2, 1),
+                             'adjacent_cloud': ('bits', 3, 1), 'snow': ('bits', 4, 1), 'water': ('bits', 5, 1)},
+             'sr_aerosol': {'fill': ('bits', 0, 1), 'aerosol_retrieval': ('bits', 1, 1),
+                            'aerosol_interpolated': ('bits', 2, 1), 'water': ('bits', 3, 1),
+                            'aerosol_level': ('bits', 6, 2)},
+             'radsat_qa': dict({'fill': ('bits', 0, 1)},
+                               **{f'saturated_band{band}': ('bits', band, 1) for band in range(1, 12)})}
+
+# Layers of QA bands without a definition above
+DEFAULT_LAYERS = {'set': ('any',)}
+
+# Variables a quality mask applies to (QA bands themselves, such as toa_band6_qa, are never masked)
+MASKED_PREFIXES = ('sr_band', 'toa_band')
+
+
+# II. HELPER FUNCTIONS - - - - - - -
+def get_class(value):
+    """
+    Returns the value of a cfmask class
+    :param value: a class name String (see CFMASK_CLASSES) or value
+    :return: an integer
+    """
+    if isinstance(value, str):
+        if value.lower() not in CFMASK_CLASSES:
+            raise ValueError(f"unknown cfmask class '{value}' (one of {list(CFMASK_CLASSES)})")
+        return CFMASK_CLASSES[value.lower()]
+    return int(value)
+
+
+def get_values(dtype):
+    """
+    Returns every value of a QA dtype in lookup-table order
+    :param dtype: an 8- or 16-bit integer NumPy dtype
+    :return: a tuple of int64 NumPy arrays of the raw values and of their bits (the table indices)
+    """
+    dtype = np.dtype(dtype)
+    index = np.arange(2 ** (8 * dtype.itemsize))
+    return index.astype(f'u{dtype.itemsize}').view(dtype).astype('int64'), index
+
+
+def get_layers(var):
+    """
+    Returns the named layers of a QA band
+    :param var: a QA variable String name
+    :return: a Python dictionary of layer name String keys and definition tuple values (see QA_LAYERS)
+    """
+    return QA_LAYERS.get(var, DEFAULT_LAYERS)
+
+
+def get_layer(var, layer):
+    """
+    Returns the definition of a named layer of a QA band
+    :param var: a QA variable String name
+    :param layer: a layer name String
+    :return: a definition tuple (see QA_LAYERS)
+    """
+    layers = get_layers(var)
+    if layer not in layers:
+        raise ValueError(f"unknown layer '{layer}' of '{var}' (one of {list(layers)})")
+    return layers[layer]
+
+
+def is_flag(definition):
+    """
+    Returns whether a layer is boolean (decoded to 0/1)
+    :param definition: a definition tuple (see QA_LAYERS)
+    :return: Boolean
+    """
+    return definition[0] != 'bits' or definition[2] == 1
+
+
+def get_layer_attrs(var, layer):
+    """
+    Returns the attributes of a decoded layer (CF flag conventions)
+    :param var: a QA variable String name
+    :param layer: a layer name String
+    :return: a Python dictionary
+    """
+    definition = get_layer(var, layer)
+    attrs = {'long_name': f'{var} {layer}', 'qa_layer': repr(definition)}
+    if is_flag(definition):
+        attrs.update(flag_values = [0, 1], flag_meanings = f'not_{layer} {layer}')
+    else:
+        attrs.update(valid_range = [0, 2 ** definition[2] - 1])
+    return attrs
+
+
+def get_index(raw):
+    """
+    Returns the lookup-table indices of raw QA values (their bits as unsigned integers)
+    :param raw: an 8- or 16-bit integer NumPy array
+    :return: a NumPy array view
+    """
+    if raw.dtype.kind not in 'iu' or raw.dtype.itemsize > 2:
+        raise TypeError(f'QA lookup tables need 8- or 16-bit integer bands, not {raw.dtype}')
+    return raw.view(f'u{raw.dtype.itemsize}')
+
+
+# III. TOP-LEVEL FUNCTIONS - - - - - - -
+def parse_mask(mask):
+    """
+    Normalizes a quality mask
+    :param mask: a mask as described above or 'None'
+    :return: a Python dictionary of QA variable keys and ('classes', tuple) or ('bits', int) values, or 'None'
+    """
+    if mask is None:
+        return None
+    if not isinstance(mask, dict):
+        mask = {CFMASK: mask}
+
+    conditions = {}
+    for var, condition in mask.items():
+        if var == CFMASK:
+            values = condition if isinstance(condition, (tuple, list, set)) else (condition,)
+            conditions[var] = ('classes', tuple(sorted(get_class(value) for value in values)))
+        else:
+            if not isinstance(condition, (int, np.integer)) or isinstance(condition, bool):
+                raise ValueError(f"the mask of QA band '{var}' must be an integer of bits, not {condition!r}")
+            conditions[var] = ('bits', int(condition))
+
+    return conditions
+
+
+def make_lut(condition, dtype):
+    """
+    Returns the boolean lookup table of a mask condition over every raw value of a QA dtype
+    :param condition: a ('classes', tuple) or ('bits', int) tuple (see parse_mask)
+    :param dtype: the 8- or 16-bit integer NumPy dtype of the QA band
+    :return: a boolean NumPy array indexed by get_index(raw)
+    """
+    kind, arg = condition
+    raw, index = get_values(dtype)
+    if kind == 'classes':
+        return np.isin(raw, arg)
+    return (index & arg) != 0
+
+
+def make_layer_lut(var, layer, dtype):
+    """
+    Returns the uint8 lookup table decoding a named layer of a QA band
+    :param var: a QA variable String name
+    :param layer: a layer name String (see QA_LAYERS)
+    :param dtype: the 8- or 16-bit integer NumPy dtype of the QA band
+    :return: a uint8 NumPy array indexed by get_index(raw)
+    """
+    definition = get_layer(var, layer)
+    raw, index = get_values(dtype)
+
+    if definition[0] == 'class':
+        return (raw == definition[1]).astype('uint8')
+    if definition[0] == 'any':
+        return (raw != 0).astype('uint8')
+
+    first, nbits = definition[1:]
+    return ((index >> first) & (2 ** nbits - 1)).astype('uint8')
+
+
+def make_packed_lut(var, layers, dtype):
+    """
+    Returns the uint8 lookup table decoding up to 8 boolean layers of a QA band into one bit field
+    (bit i = layers[i])
+    :param var: a QA variable String name
+    :param layers: a Python list of layer name Strings
+    :param dtype: the 8- or 16-bit integer NumPy dtype of the QA band
+    :return: a uint8 NumPy array indexed by get_index(raw)
+    """
+    if len(layers) > 8:
+        raise ValueError(f'at most 8 layers fit in one packed uint8 band, not {len(layers)}')
+
+    lut = np.zeros(2 ** (8 * np.dtype(dtype).itemsize), dtype = 'uint8')
+    for bit, layer in enumerate(layers):
+        if not is_flag(get_layer(var, layer)):
+            raise ValueError(f"layer '{layer}' of '{var}' isn't a flag and can't be bit-packed")
+        lut |= make_layer_lut(var, layer, dtype) << bit
+
+    return lut
+
+
+def decode(raw, lut, out = None):
+    """
+    Decodes raw QA values with a lookup table (one gather)
+    :param raw: an 8- or 16-bit integer NumPy array of raw QA values
+    :param lut: a lookup table (see make_layer_lut, make_packed_lut)
+    :param out: a contiguous NumPy array of the raw shape and lookup-table dtype or 'None'
+    :return: a NumPy array
+    """
+    return np.take(lut, get_index(raw), out = out, mode = 'clip')
+
+
+def apply_luts(tiles, luts):
+    """
+    Returns the mask of one tile: the pixels any QA condition selects
+    :param tiles: a Python dictionary of QA variable keys and raw tile values
+    :param luts: a Python dictionary of QA variable keys and lookup tables (see make_lut)
+    :return: a boolean NumPy array or 'None' if there are no conditions
+    """
+    mask = None
+    for var, lut in luts.items():
+        selected = lut[get_index(tiles[var])]
+        if mask is None:
+            mask = selected
+        else:
+            mask |= selected
+    return mask
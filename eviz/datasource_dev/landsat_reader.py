@@ -3,6 +3,9 @@
 
 """
 
+import os
+import time
+
 import numpy as np
 import xarray as xr
 # from datetime import datetime
@@ -10,33 +13,56 @@ import xarray as xr
 import pyhdf.error
 from pyhdf.SD import SD, SDC
 
+from reader_stats import ReaderStats
+from handle_pool import HandlePool
+import filename_meta
+import band_math
+import landsat_qa
+
+import threading
 import logging
 logging.basicConfig(level = logging.INFO)
 
+# Open SD files shared by all Landsat readers of the process; the HDF4 library is not thread-safe, so the
+# pool and all of its handles share one lock (also held by unpooled readers)
+POOL = HandlePool(lambda path, **options: SD(path, SDC.READ), lambda fid: fid.end(), lock = threading.RLock())
+
+# Number of rows read_into reads (and restores) at a time
+BLOCK_ROWS = 512
+
+# HDF4 number types of the SDS in Landsat files -> NumPy dtypes
+SDC_DTYPES = {SDC.INT8: 'int8', SDC.UINT8: 'uint8', SDC.INT16: 'int16', SDC.UINT16: 'uint16', SDC.INT32: 'int32',
+              SDC.UINT32: 'uint32', SDC.FLOAT32: 'float32', SDC.FLOAT64: 'float64'}
+
 class LandsatReader:
     """
     Handles reading Landsat data from HDF4 files.
     """
 
     # I. Constructor
-    def __init__(self, filename, var = None):
+    def __init__(self, filename, var = None, stats_callback = None, load = True, pooled = True, dtype = None,
+                 mask = None):
         """
         Constructs an object to generate either an XArray DataArray (if variable name given)
         or an XArray Dataset to represent Landsat data from an HDF4 file.
         :param filename: a full path String of a Landsat data file
         :param var: a data variable String name or tuple/list of String name(s)
+        :param stats_callback: a function called with each per-stage measurement (see ReaderStats) or 'None'
+        :param load: whether to read the data now (False leaves self.data as 'None' for windowed reads)
+        :param pooled: whether to keep the file open in the shared handle pool (POOL) between reads
+        :param dtype: the floating-point dtype of restored data or 'None' for float64
+        :param mask: a quality mask (see landsat_qa.py) setting masked sr_band*/toa_band* pixels to NaN while
+                     they are restored, or 'None'
         """
-        self.fn = filename
+        self.set_defaults(filename, stats_callback, pooled, dtype, mask)
         self.var_input = var
         self.var = var
         self.ftype = self.get_ftype()
 
-        self.log = logging.getLogger(__name__)
-
-        if isinstance(self.var, type(None)):
-            self.data = self.read_file()
+        if load:
+            self.data = self.read()
         else:
-            self.data = self.read_set()
+            self.data = None
 
     def __repr__(self):
         """
@@ -46,14 +72,90 @@ class LandsatReader:
         return f'Reader object: {self.ftype}; {self.var_input}; {type(self.data)} \n{self.fn}'
 
     # II. Accessor & Helper Methods
+    def set_defaults(self, filename, stats_callback = None, pooled = True, dtype = None, mask = None):
+        """
+        Sets the reader attributes that don't depend on the file's contents (also used by benchmark_readers.bare
+        for readers that haven't read their file)
+        :param filename: a full path String of a Landsat data file
+        :return: 'None' (see the constructor for the other parameters)
+        """
+        self.fn = filename
+
+        self.log = logging.getLogger(__name__)
+        self.stats = ReaderStats(filename, stats_callback)
+
+        self.dtype = dtype
+        self.mask = landsat_qa.parse_mask(mask)
+        self.mask_cache = {}   # (rows, columns) -> bit-packed quality mask of a block, kept during one read
+        self.pooled = pooled
+        self.handle = None   # PooledHandle of the open file
+        self.meta = {}   # Parsed metadata of the open file when not pooled
+
     def get_fid(self):
         """
-        Accesses the file reader object for a file
+        Accesses the file reader object for a file (from the handle pool if pooled) and holds the HDF4 lock;
+        every call is paired with close_fid
         :return: a file reader (SD) object
         """
-        fid = SD(self.fn, SDC.READ)
+        start = time.perf_counter()
+
+        if self.pooled:
+            self.handle = POOL.acquire(self.fn)
+            self.handle.lock.acquire()
+            fid = self.handle.fid
+            nbytes = os.path.getsize(self.fn) if self.handle.uses == 1 else 0   # 0 when reused
+        else:
+            POOL.lock.acquire()
+            try:
+                fid = SD(self.fn, SDC.READ)
+            except BaseException:
+                POOL.lock.release()
+                raise
+            self.meta = {}
+            nbytes = os.path.getsize(self.fn)
+
+        self.stats.record('open', start, nbytes)
         return fid
 
+    def close_fid(self, fid):
+        """
+        Closes a file reader object, or gives it back to the handle pool if pooled, and releases the HDF4 lock
+        :param fid: a file reader (SD) object
+        """
+        self.mask_cache.clear()
+
+        if self.pooled:
+            handle = self.handle
+            handle.lock.release()
+            POOL.release(handle)
+        else:
+            try:
+                fid.end()
+            finally:
+                POOL.lock.release()
+
+    def get_meta(self):
+        """
+        Returns the parsed-metadata cache of the open file (kept with the pooled handle)
+        :return: a Python dictionary
+        """
+        if self.pooled and self.handle is not None:
+            return self.handle.meta
+        return self.meta
+
+    def get_datasets(self, fid):
+        """
+        Returns the dataset (SDS) descriptions of a file
+        :param fid: a file reader (SD) object
+        :return: a Python dictionary of dataset name String keys and info tuple values
+        """
+        meta = self.get_meta()
+
+        if 'datasets' not in meta:
+            meta['datasets'] = fid.datasets()
+
+        return meta['datasets']
+
     # - - - - - A. Data Restoration
     def get_fill(self, ds):
         """
@@ -88,26 +190,161 @@ class LandsatReader:
                 return value
         return 0
 
-    def restore_data(self, ds):
+    def restore_data(self, ds, window = None):
         """
         Restores the data o a given dataset (SDS) object
         :param ds: an SDS object
+        :param window: a tuple of (row, column) slices to read or 'None' for the whole dataset
         :return: a NumPy array
         """
+        start = time.perf_counter()
         fill = self.get_fill(ds)
         scale = self.get_scale(ds)
         offset = self.get_offset(ds)
+        self.stats.record('attrs', start)
 
-        data = ds.get()  # .astype('float')
+        start = time.perf_counter()
+        data = ds.get() if window is None else ds[window]  # .astype('float')
+        self.stats.record('read', start, data.nbytes)
 
-        data = np.where(data != fill, data, np.nan)  # fill
-        data *= scale  # scale
-        data += offset  # offset
+        start = time.perf_counter()
+        if self.dtype is not None:   # Restores a copy in the output dtype (no float64 temporary)
+            data = self.restore_into(data.astype(self.dtype), fill, scale, offset)
+        else:
+            data = np.where(data != fill, data, np.nan)  # fill
+            data *= scale  # scale
+            data += offset  # offset
 
         data = np.expand_dims(data, axis = 0)
+        self.stats.record('restore', start, data.nbytes)
 
         return data
 
+    def restore_into(self, out, fill, scale, offset):
+        """
+        Restores raw data in place (fill values become NaN, then scale and offset are applied)
+        :param out: a floating-point NumPy array of raw data
+        :param fill: the fill value or 'None'
+        :param scale: the scale factor
+        :param offset: the offset value
+        :return: the same NumPy array
+        """
+        if fill is not None:
+            np.putmask(out, out == fill, np.nan)
+        if scale != 1:
+            out *= scale
+        if offset != 0:
+            out += offset
+
+        return out
+
+    def get_block_window(self, ds, window = None):
+        """
+        Returns the rows and columns of a window of a given dataset (SDS) object
+        :param ds: an SDS object
+        :param window: a tuple of (row, column) slices or 'None' for the whole dataset
+        :return: a tuple of a range of row indices and a slice of columns (with explicit bounds)
+        """
+        shape = ds.info()[2]
+        if window is None:
+            window = tuple(slice(0, n) for n in shape)
+
+        return range(*window[0].indices(shape[0])), slice(*window[1].indices(shape[1]))
+
+    def is_masked(self, var):
+        """
+        Returns whether the quality mask applies to a data variable
+        :param var: a data variable String name
+        :return: Boolean
+        """
+        return self.mask is not None and var.startswith(landsat_qa.MASKED_PREFIXES) and not var.endswith('_qa')
+
+    def get_luts(self, fid):
+        """
+        Returns the lookup tables of the quality mask for the QA bands of a file (cached with its metadata)
+        :param fid: a file reader (SD) object
+        :return: a Python dictionary of QA variable keys and boolean lookup tables
+        """
+        cache = self.get_meta().setdefault('mask_luts', {})
+        key = tuple(sorted(self.mask.items()))
+
+        if key not in cache:
+            datasets = self.get_datasets(fid)
+            luts = {}
+            for var, condition in self.mask.items():
+                if var not in datasets:
+                    self.log.warning(f"VARIABLE '{var}' DOES NOT EXIST: NOT MASKING WITH IT")
+                    continue
+                luts[var] = landsat_qa.make_lut(condition, SDC_DTYPES[datasets[var][2]])
+            cache[key] = luts
+
+        return cache[key]
+
+    def read_mask(self, fid, rows, cols):
+        """
+        Reads the QA bands of a block and returns its quality mask; the mask is kept (bit-packed) until the file
+        is closed, so the QA of a block is read once however many variables of the read it masks
+        :param fid: a file reader (SD) object
+        :param rows: a range of row indices
+        :param cols: a slice of columns
+        :return: a boolean NumPy array or 'None' if no QA band of the mask exists
+        """
+        key = (rows.start, rows.stop, rows.step, cols.start, cols.stop, cols.step)
+        if key in self.mask_cache:
+            packed, shape = self.mask_cache[key]
+            return np.unpackbits(packed, count = shape[0] * shape[1]).view(bool).reshape(shape)
+
+        luts = self.get_luts(fid)
+        if not luts:
+            return None
+
+        start = time.perf_counter()
+        tiles = {var: fid.select(var)[slice(rows.start, rows.stop, rows.step), cols] for var in luts}
+        self.stats.record('read', start, sum(tile.nbytes for tile in tiles.values()))
+
+        mask = landsat_qa.apply_luts(tiles, luts)
+        self.mask_cache[key] = (np.packbits(mask), mask.shape)
+        return mask
+
+    def read_blocks(self, fid, var, ds, dest, rows, cols, block_rows = BLOCK_ROWS):
+        """
+        Reads and restores rows of a dataset (SDS) object into an array block by block, applying the quality
+        mask to each block as it is restored
+        :param fid: a file reader (SD) object
+        :param var: the data variable String name of the dataset
+        :param ds: an SDS object
+        :param dest: a writeable floating-point NumPy array of (rows, columns)
+        :param rows: a range of row indices
+        :param cols: a slice of columns
+        :param block_rows: the number of rows read per block
+        :return: dest
+        """
+        start = time.perf_counter()
+        fill = self.get_fill(ds)
+        scale = self.get_scale(ds)
+        offset = self.get_offset(ds)
+        self.stats.record('attrs', start)
+
+        masked = self.is_masked(var)
+
+        for i in range(0, len(rows), block_rows):
+            block = rows[i:i + block_rows]
+            out = dest[i:i + len(block)]
+
+            start = time.perf_counter()
+            out[...] = ds[slice(block.start, block.stop, block.step), cols]
+            self.stats.record('read', start, out.nbytes)
+
+            mask = self.read_mask(fid, block, cols) if masked else None
+
+            start = time.perf_counter()
+            self.restore_into(out, fill, scale, offset)
+            if mask is not None:
+                np.putmask(out, mask, np.nan)
+            self.stats.record('restore', start, out.nbytes)
+
+        return dest
+
     # - - - - - B. Dimensions
     def get_dims(self, ds):
         """
@@ -160,17 +397,19 @@ class LandsatReader:
         :param fid: a file reader (SD) object
         :return: bool - False if there are no file-level coordinates, True if there are any
         """
+        meta = self.get_meta()
+        if 'fid_coords' in meta:
+            return meta['fid_coords']
+
         coord_sets = []  # will hold datasets suspected to be coordinates
 
-        for i in range(len(fid.datasets())):
+        for i in range(len(self.get_datasets(fid))):
             ds = fid.select(i)
             if bool(ds.iscoordvar()):
                 coord_sets.append(ds)
 
-        if len(coord_sets) > 0:
-            return True
-        else:
-            return False
+        meta['fid_coords'] = len(coord_sets) > 0
+        return meta['fid_coords']
 
     def get_coord_bounds(self, fid):
         """
@@ -178,11 +417,17 @@ class LandsatReader:
         :param fid: a file reader (SD) object
         :return: a Python dictionary of String keys and numeric values
         """
+        meta = self.get_meta()
+        if 'coord_bounds' in meta:
+            return meta['coord_bounds']
+
+        start = time.perf_counter()
         coord_attrs = {}
         # Gets our coordinate-related attributes
         for key, value in fid.attributes().items():
             if 'coordinate' in key.lower():
                 coord_attrs[key] = value
+        self.stats.record('attrs', start)
 
         coord_bounds = {}
         # Gets our coordinate bounds
@@ -196,6 +441,7 @@ class LandsatReader:
             if 'west' in key.lower():
                 coord_bounds['lonW'] = coord_attrs[key]
 
+        meta['coord_bounds'] = coord_bounds
         return coord_bounds
 
     def get_ds_coords(self, fid, ds):
@@ -205,7 +451,10 @@ class LandsatReader:
         :param ds: an SDS object
         :return: a Python dictionary of String keys and NumPy array values
         """
-        bounds = self.get_coord_bounds(fid)
+        bounds = self.get_coord_bounds(fid)   # Attribute reads are timed as 'attrs', not 'coords'
+        times = self.get_time(fid)
+
+        start = time.perf_counter()
 
         latN = bounds['latN']
         latS = bounds['latS']
@@ -221,9 +470,9 @@ class LandsatReader:
 
             lats = np.linspace(latS, latN + lat_space, lat_shape)
             lons = np.linspace(lonW, lonE + lon_space, lon_shape)
-            times = [self.get_time(fid)]
 
             coords = {'times': times, 'lats': lats, 'lons': lons}
+            self.stats.record('coords', start, lats.nbytes + lons.nbytes)
             return coords
 
         # else:   # Coords already set at file level
@@ -231,18 +480,27 @@ class LandsatReader:
 
     def get_time(self, fid):
         """
-        Returns the time(s) at which the data was measured/acquired
+        Returns the time(s) at which the data was measured/acquired: the acquisition date (YYYYDDD) of the
+        filename if it follows the Landsat naming convention (no attributes are read), or else the
+        AcquisitionDate attribute (e.g. '2011-08-02T20:51:34.000000Z')
         :param fid: an SD object
-        :return: a DateTime object
+        :return: a datetime64[ns] NumPy array of one time
         """
-        time = fid.attributes()['AcquisitionDate']
-        return time
+        fn_meta = filename_meta.parse_landsat(self.fn)
+        if fn_meta is not None:
+            return np.array([fn_meta['date']], dtype = 'datetime64[ns]')
+
+        start = time.perf_counter()
+        acquired = fid.attributes()['AcquisitionDate']
+        self.stats.record('attrs', start)
+        return np.array([str(acquired).rstrip('Z')], dtype = 'datetime64[ns]')
 
     # III. Top-Level Methods
-    def get_array(self, fid):
+    def get_array(self, fid, window = None):
         """
         Returns an XArray DataArray of an HDF4 dataset given the file and Landsat reader objects
         :param fid: a file reader (SD) object
+        :param window: a tuple of (row, column) slices to read or 'None' for the whole dataset
         :return: an XArray DataArray
         """
         try:
@@ -261,13 +519,27 @@ class LandsatReader:
             lons = coords_dict['lons']
             times = coords_dict['times']
 
-            xr_arr = xr.DataArray(self.restore_data(ds), coords=[times, lats, lons], dims=['time', 'lat', 'lon'])
+            if window is not None:   # Keeps only the coordinates of the window
+                lats = lats[window[0]]
+                lons = lons[window[1]]
+
+            if self.is_masked(self.var):   # Masks block by block while restoring
+                rows, cols = self.get_block_window(ds, window)
+                shape = (1, len(rows), len(range(cols.start, cols.stop, cols.step)))
+                data = np.empty(shape, dtype = self.dtype or 'float64')
+                self.read_blocks(fid, self.var, ds, data[0], rows, cols)
+            else:
+                data = self.restore_data(ds, window)
+
+            start = time.perf_counter()
+            xr_arr = xr.DataArray(data, coords=[times, lats, lons], dims=['time', 'lat', 'lon'])
 
             xr_arr.attrs = ds.attributes()
 
             dims_attrs = self.get_dims_attrs(ds)
             xr_arr.lat.attrs = dims_attrs['lat']
             xr_arr.lon.attrs = dims_attrs['lon']
+            self.stats.record('assemble', start, data.nbytes)
 
         return xr_arr
 
@@ -277,65 +549,64 @@ class LandsatReader:
         :return: an XArray DataArray or Dataset
         """
         fid = self.get_fid()
-        self.log.info('READING FILE')
-
-        if self.check_fid_coords(fid):  # File-level coords exist
-            pass
-        else:
-            fid_coords = False  # File-level coords do not exist
-
-        if isinstance(self.var_input, str):
-            xr_arr = self.get_array(fid)
-            self.log.info('DATA ARRAY CREATED')
+        self.log.debug('READING FILE')
 
-            try:
-                xr_arr.name = self.var_input
-            except AttributeError:
-                self.log.warning('EMPTY DATA ARRAY')
-
-            self.log.info('CLOSING FILE')
-            fid.end()
-
-            return xr_arr
+        try:
+            if self.check_fid_coords(fid):  # File-level coords exist
+                pass
+            else:
+                fid_coords = False  # File-level coords do not exist
 
-        elif isinstance(self.var_input, tuple) or isinstance(self.var_input, list):
-            if len(self.var_input) == 1:
-                self.var = self.var_input[0]
+            if isinstance(self.var_input, str):
                 xr_arr = self.get_array(fid)
-                self.log.info('DATA ARRAY CREATED')
+                self.log.debug('DATA ARRAY CREATED')
 
                 try:
-                    xr_arr.name = self.var_input[0]
+                    xr_arr.name = self.var_input
                 except AttributeError:
                     self.log.warning('EMPTY DATA ARRAY')
 
-                self.log.info('CLOSING FILE')
-                fid.end()
-
                 return xr_arr
-            else:
-                xr_ds = xr.Dataset()
 
-                for var in self.var_input:
-                    if var in fid.datasets().keys():
-                        self.var = var
-                        xr_ds[var] = self.get_array(fid)
-                    else:
-                        self.log.warning(f"VARIABLE '{var}' DOES NOT EXIST")
+            elif isinstance(self.var_input, tuple) or isinstance(self.var_input, list):
+                if len(self.var_input) == 1:
+                    self.var = self.var_input[0]
+                    xr_arr = self.get_array(fid)
+                    self.log.debug('DATA ARRAY CREATED')
 
-                xr_ds.attrs = fid.attributes()
-                self.log.info('DATASET CREATED')
+                    try:
+                        xr_arr.name = self.var_input[0]
+                    except AttributeError:
+                        self.log.warning('EMPTY DATA ARRAY')
 
-                self.log.info('CLOSING FILE')
-                fid.end()
-
-                if '*empty*' in repr(xr_ds.data_vars):  # If the dataset is empty
-                    self.log.warning('EMPTY DATASET')
-                    return None
+                    return xr_arr
                 else:
-                    return xr_ds
-        else:
-            return None
+                    xr_ds = xr.Dataset()
+
+                    for var in self.var_input:
+                        if var in self.get_datasets(fid).keys():
+                            self.var = var
+                            xr_arr = self.get_array(fid)
+
+                            start = time.perf_counter()
+                            xr_ds[var] = xr_arr
+                            self.stats.record('assemble', start)
+                        else:
+                            self.log.warning(f"VARIABLE '{var}' DOES NOT EXIST")
+
+                    xr_ds.attrs = fid.attributes()
+                    self.log.debug('DATASET CREATED')
+
+                    if '*empty*' in repr(xr_ds.data_vars):  # If the dataset is empty
+                        self.log.warning('EMPTY DATASET')
+                        return None
+                    else:
+                        return xr_ds
+            else:
+                return None
+        finally:
+            self.log.debug('CLOSING FILE')
+            self.close_fid(fid)
 
     def read_file(self):
         """
@@ -343,30 +614,413 @@ class LandsatReader:
         :return: an XArray Dataset
         """
         fid = self.get_fid()
-        self.log.info('READING FILE')
+        self.log.debug('READING FILE')
+
+        try:
+            if self.check_fid_coords(fid):  # File-level coords exist
+                pass
+            else:
+                fid_coords = False  # File-level coords do not exist
+
+            xr_ds = xr.Dataset()
+
+            for var in self.get_datasets(fid).keys():
+                self.var = var
+                xr_arr = self.get_array(fid)
+
+                start = time.perf_counter()
+                xr_ds[var] = xr_arr
+                self.stats.record('assemble', start)
+
+            xr_ds.attrs = fid.attributes()
+            self.log.debug('DATASET CREATED')
 
-        if self.check_fid_coords(fid):  # File-level coords exist
-            pass
+            if '*empty*' in repr(xr_ds.data_vars):  # If the dataset is empty
+                self.log.warning('EMPTY DATASET')
+                return None
+            else:
+                return xr_ds
+        finally:
+            self.log.debug('CLOSING FILE')
+            self.close_fid(fid)
+
+    def read(self):
+        """
+        Reads the requested data variable(s), or the whole file if none were given
+        :return: an XArray DataArray or Dataset
+        """
+        if isinstance(self.var_input, type(None)):
+            return self.read_file()
         else:
-            fid_coords = False  # File-level coords do not exist
+            return self.read_set()
 
-        xr_ds = xr.Dataset()
+    def read_window(self, var, window = None):
+        """
+        Reads a rectangular window of one data variable without reading the rest of the file
+        :param var: a data variable String name
+        :param window: a tuple of (row, column) slices or 'None' for the whole scene
+        :return: an XArray DataArray or 'None'
+        """
+        fid = self.get_fid()
+        self.log.debug('READING WINDOW')
 
-        for var in fid.datasets().keys():
+        try:
             self.var = var
-            xr_ds[var] = self.get_array(fid)
+            xr_arr = self.get_array(fid, window)
+
+            try:
+                xr_arr.name = var
+            except AttributeError:
+                self.log.warning('EMPTY DATA ARRAY')
 
-        xr_ds.attrs = fid.attributes()
-        self.log.info('DATASET CREATED')
+            return xr_arr
+        finally:
+            self.log.debug('CLOSING FILE')
+            self.close_fid(fid)
 
-        fid.end()
-        self.log.info('CLOSING FILE')
+    def read_into(self, var, out, window = None, block_rows = BLOCK_ROWS):
+        """
+        Reads and restores one data variable (or a window of it) straight into a caller-provided array, such as
+        one time step of a preallocated stack or an array backed by multiprocessing.shared_memory; rows are read
+        in blocks so only one block of raw integers is held besides the output
+        :param var: a data variable String name
+        :param out: a writeable floating-point NumPy array with the (window) shape of the dataset,
+                    optionally with a leading time dimension of 1
+        :param window: a tuple of (row, column) slices or 'None' for the whole scene
+        :param block_rows: the number of rows read per block
+        :return: out, or 'None' if the variable doesn't exist
+        """
+        if not np.issubdtype(out.dtype, np.floating):
+            raise TypeError(f'read_into needs a floating-point array to hold NaN fill values, not {out.dtype}')
 
-        if '*empty*' in repr(xr_ds.data_vars):  # If the dataset is empty
-            self.log.warning('EMPTY DATASET')
-            return None
-        else:
-            return xr_ds
+        fid = self.get_fid()
+        self.log.debug('READING INTO BUFFER')
+
+        try:
+            if var not in self.get_datasets(fid):
+                self.log.warning(f"VARIABLE '{var}' DOES NOT EXIST")
+                return None
+
+            ds = fid.select(var)
+            rows, cols = self.get_block_window(ds, window)
+
+            dest = out.reshape((len(rows), len(range(cols.start, cols.stop, cols.step))))   # Drops a time dimension
+            if not np.shares_memory(dest, out):
+                raise ValueError('read_into needs an output array that can be reshaped without copying')
+
+            self.read_blocks(fid, var, ds, dest, rows, cols, block_rows)
+            return out
+        finally:
+            self.log.debug('CLOSING FILE')
+            self.close_fid(fid)
+
+    def read_valid(self, var, window = None, block_rows = BLOCK_ROWS):
+        """
+        Reads only the valid pixels of a data variable (neither fill nor masked by the quality mask), dropping
+        the rest block by block as they are restored
+        :param var: a data variable String name
+        :param window: a tuple of (row, column) slices or 'None' for the whole scene
+        :param block_rows: the number of rows read per block
+        :return: a tuple of NumPy arrays of flat (row-major) pixel indices into the window and their restored
+                 values, or 'None' if the variable doesn't exist
+        """
+        fid = self.get_fid()
+        try:
+            if var not in self.get_datasets(fid):
+                self.log.warning(f"VARIABLE '{var}' DOES NOT EXIST")
+                return None
+
+            ds = fid.select(var)
+            rows, cols = self.get_block_window(ds, window)
+            ncols = len(range(cols.start, cols.stop, cols.step))
+            buffer = np.empty((min(block_rows, len(rows)), ncols), dtype = self.dtype or 'float64')
+
+            indices, values = [], []
+            for i in range(0, len(rows), block_rows):
+                block = rows[i:i + block_rows]
+                out = self.read_blocks(fid, var, ds, buffer[:len(block)], block, cols, block_rows)
+
+                keep = ~np.isnan(out)
+                indices.append(np.flatnonzero(keep) + i * ncols)
+                values.append(out[keep])
+
+            return (np.concatenate(indices) if indices else np.empty(0, dtype = 'int64'),
+                    np.concatenate(values) if values else np.empty(0, dtype = buffer.dtype))
+        finally:
+            self.close_fid(fid)
+
+    def read_qa(self, var, layers = None, window = None, packed = False, block_rows = BLOCK_ROWS):
+        """
+        Decodes named layers of a QA band (cfmask or a packed *_qa band) into compact uint8 arrays through lookup
+        tables indexed by raw QA value (see landsat_qa.py), block by block; QA is never restored to float
+        :param var: a QA variable String name
+        :param layers: a layer name String, a Python list of them, or 'None' for every layer of the band
+        :param window: a tuple of (row, column) slices or 'None' for the whole scene
+        :param packed: whether to bit-pack (up to 8) boolean layers into one uint8 band (bit i = layer i)
+        :param block_rows: the number of rows decoded per block
+        :return: an XArray DataArray (one layer, or packed) or Dataset of uint8 layers, or 'None'
+        """
+        names = list(landsat_qa.get_layers(var)) if layers is None else [layers] if isinstance(layers, str) \
+            else list(layers)
+
+        fid = self.get_fid()
+        try:
+            datasets = self.get_datasets(fid)
+            if var not in datasets:
+                self.log.warning(f"VARIABLE '{var}' DOES NOT EXIST")
+                return None
+
+            start = time.perf_counter()
+            dtype = SDC_DTYPES[datasets[var][2]]
+            cache = self.get_meta().setdefault('qa_luts', {})
+            if packed:
+                key = (var, tuple(names))
+                if key not in cache:
+                    cache[key] = landsat_qa.make_packed_lut(var, names, dtype)
+                luts = {var: cache[key]}
+            else:
+                luts = {}
+                for name in names:
+                    if (var, name) not in cache:
+                        cache[(var, name)] = landsat_qa.make_layer_lut(var, name, dtype)
+                    luts[name] = cache[(var, name)]
+            self.stats.record('attrs', start)
+
+            ds = fid.select(var)
+            rows, cols = self.get_block_window(ds, window)
+            shape = (1, len(rows), len(range(cols.start, cols.stop, cols.step)))
+            outs = {name: np.empty(shape, dtype = 'uint8') for name in luts}
+
+            for i in range(0, len(rows), block_rows):
+                block = rows[i:i + block_rows]
+
+                start = time.perf_counter()
+                raw = ds[slice(block.start, block.stop, block.step), cols]
+                self.stats.record('read', start, raw.nbytes)
+
+                start = time.perf_counter()
+                for name, lut in luts.items():
+                    landsat_qa.decode(raw, lut, out = outs[name][0, i:i + len(block)])
+                self.stats.record('restore', start, raw.size * len(luts))
+
+            start = time.perf_counter()
+            coords = self.get_ds_coords(fid, ds)
+            lats = coords['lats'] if window is None else coords['lats'][window[0]]
+            lons = coords['lons'] if window is None else coords['lons'][window[1]]
+            dims_attrs = self.get_dims_attrs(ds)
+
+            arrays = {}
+            for name, out in outs.items():
+                xr_arr = xr.DataArray(out, coords = [coords['times'], lats, lons], dims = ['time', 'lat', 'lon'],
+                                      name = name)
+                if packed:
+                    xr_arr.attrs = {'long_name': f'{var} flags', 'flag_masks': [2 ** bit for bit in range(len(names))],
+                                    'flag_meanings': ' '.join(names)}
+                else:
+                    xr_arr.attrs = landsat_qa.get_layer_attrs(var, name)
+                xr_arr.lat.attrs = dims_attrs['lat']
+                xr_arr.lon.attrs = dims_attrs['lon']
+                arrays[name] = xr_arr
+            self.stats.record('assemble', start, sum(out.nbytes for out in outs.values()))
+
+            if packed or isinstance(layers, str):
+                return next(iter(arrays.values()))
+            return xr.Dataset(arrays, attrs = {'qa_variable': var})
+        finally:
+            self.close_fid(fid)
+
+    def get_shape(self, var):
+        """
+        Returns the shape of a data variable without reading its data
+        :param var: a data variable String name
+        :return: a tuple of dimension sizes or 'None'
+        """
+        fid = self.get_fid()
+        try:
+            datasets = self.get_datasets(fid)
+            return tuple(datasets[var][1]) if var in datasets else None
+        finally:
+            self.close_fid(fid)
+
+    def get_dtype(self, var):
+        """
+        Returns the stored (raw) dtype of a data variable without reading its data
+        :param var: a data variable String name
+        :return: a NumPy dtype or 'None'
+        """
+        fid = self.get_fid()
+        try:
+            datasets = self.get_datasets(fid)
+            return np.dtype(SDC_DTYPES[datasets[var][2]]) if var in datasets else None
+        finally:
+            self.close_fid(fid)
+
+    def get_var_coords(self, var):
+        """
+        Returns the coordinates of a data variable in dimension order without reading its data
+        :param var: a data variable String name
+        :return: a Python dictionary of String keys and NumPy array values (time, rows, columns) or 'None'
+        """
+        fid = self.get_fid()
+        try:
+            if var not in self.get_datasets(fid):
+                return None
+
+            return self.get_ds_coords(fid, fid.select(var))
+        finally:
+            self.close_fid(fid)
+
+    def read_cells(self, var, rows, cols):
+        """
+        Reads and restores single grid cells of a data variable, reading only the rows (and column range)
+        that hold them and restoring only the gathered values
+        :param var: a data variable String name
+        :param rows: an integer NumPy array of row indices
+        :param cols: an integer NumPy array of column indices
+        :return: a float64 NumPy array of restored values or 'None'
+        """
+        fid = self.get_fid()
+        try:
+            if var not in self.get_datasets(fid):
+                self.log.warning(f"VARIABLE '{var}' DOES NOT EXIST")
+                return None
+            if rows.size == 0:
+                return np.empty(0)
+
+            ds = fid.select(var)
+
+            start = time.perf_counter()
+            fill = self.get_fill(ds)
+            scale = self.get_scale(ds)
+            offset = self.get_offset(ds)
+            self.stats.record('attrs', start)
+
+            unique_rows, inverse = np.unique(rows, return_inverse = True)
+            first, last = int(cols.min()), int(cols.max())
+
+            def gather(sds):
+                start = time.perf_counter()
+                block = np.concatenate([sds[int(row):int(row) + 1, first:last + 1] for row in unique_rows])
+                self.stats.record('read', start, block.nbytes)
+                return block[inverse, cols - first]
+
+            values = gather(ds).astype('float64')
+            luts = self.get_luts(fid) if self.is_masked(var) else {}
+            mask = landsat_qa.apply_luts({qa: gather(fid.select(qa)) for qa in luts}, luts)
+
+            start = time.perf_counter()
+            self.restore_into(values, fill, scale, offset)
+            if mask is not None:
+                np.putmask(values, mask, np.nan)
+            self.stats.record('restore', start, values.nbytes)
+
+            return values
+        finally:
+            self.close_fid(fid)
+
+    def compute(self, expression, window = None, mask = band_math.CLOUD_CLASSES, dtype = 'float32',
+                block_rows = BLOCK_ROWS):
+        """
+        Evaluates a band-math expression (e.g. '(sr_band4 - sr_band3) / (sr_band4 + sr_band3)') or a built-in
+        index ('NDVI', 'NBR', 'NDWI', 'EVI') block by block, decoding fill/scale/offset and masking cfmask
+        classes in the same pass (see band_math.py); no restored band is held in memory
+        :param expression: an expression String of SDS names and band aliases, or a built-in index name
+        :param window: a tuple of (row, column) slices or 'None' for the whole scene
+        :param mask: a tuple of cfmask classes to set to NaN (cfmask fill is included), or 'None' for no mask
+        :param dtype: the floating-point dtype of the result
+        :param block_rows: the number of rows evaluated per block
+        :return: an XArray DataArray
+        """
+        expression, name = band_math.expand(expression, self.fn)
+        names = band_math.get_names(expression)
+
+        fid = self.get_fid()
+        try:
+            datasets = self.get_datasets(fid)
+            unknown = [var for var in names if var not in datasets]
+            if unknown:
+                raise ValueError(f'unknown variables in {expression!r}: {unknown}')
+            if mask is not None and 'cfmask' not in datasets:
+                self.log.warning("VARIABLE 'cfmask' DOES NOT EXIST: NOT MASKING CLOUDS")
+                mask = None
+
+            sds = {var: fid.select(var) for var in names + ([] if mask is None else ['cfmask'])}
+            shape = sds[names[0]].info()[2] if names else None
+            if shape is None or any(ds.info()[2] != shape for ds in sds.values()):
+                raise ValueError(f'{expression!r} needs variables of one shape')
+
+            start = time.perf_counter()
+            restore = {}
+            for var in names:   # Python scalars (NumPy scalar reprs aren't valid numexpr)
+                fill = self.get_fill(sds[var])
+                restore[var] = (None if fill is None else np.asarray(fill).item(),
+                                float(self.get_scale(sds[var])), float(self.get_offset(sds[var])))
+            mask_values = ()
+            if mask is not None:
+                mask_fill = self.get_fill(sds['cfmask'])
+                mask_values = tuple(int(value) for value in mask)
+                if mask_fill is not None:
+                    mask_values += (int(mask_fill),)
+            self.stats.record('attrs', start)
+
+            evaluate = band_math.make_evaluator(expression, restore, None if mask is None else 'cfmask',
+                                                mask_values)
+
+            if window is None:
+                window = tuple(slice(0, n) for n in shape)
+            rows = range(*window[0].indices(shape[0]))
+            cols = slice(*window[1].indices(shape[1]))
+            out = np.empty((1, len(rows), len(range(shape[1])[cols])), dtype = dtype)
+
+            for i in range(0, len(rows), block_rows):
+                block = rows[i:i + block_rows]
+
+                start = time.perf_counter()
+                raw = {var: ds[slice(block.start, block.stop, block.step), cols] for var, ds in sds.items()}
+                self.stats.record('read', start, sum(tile.nbytes for tile in raw.values()))
+
+                start = time.perf_counter()
+                evaluate(raw, out[0, i:i + len(block)])
+                self.stats.record('restore', start, out[0, i:i + len(block)].nbytes)
+
+            start = time.perf_counter()
+            coords = self.get_ds_coords(fid, sds[names[0]])
+            xr_arr = xr.DataArray(out, coords = [coords['times'], coords['lats'][window[0]],
+                                                 coords['lons'][window[1]]], dims = ['time', 'lat', 'lon'],
+                                  name = name)
+            xr_arr.attrs = {'expression': expression,
+                            'masked_cfmask_classes': list(mask_values) if mask is not None else []}
+
+            dims_attrs = self.get_dims_attrs(sds[names[0]])
+            xr_arr.lat.attrs = dims_attrs['lat']
+            xr_arr.lon.attrs = dims_attrs['lon']
+            self.stats.record('assemble', start, out.nbytes)
+
+            return xr_arr
+        finally:
+            self.close_fid(fid)
+
+    def get_vars(self):
+        """
+        Returns the names of the data variables in the file without reading their data
+        :return: a Python list of variable name Strings
+        """
+        fid = self.get_fid()
+        try:
+            return list(self.get_datasets(fid).keys())
+        finally:
+            self.close_fid(fid)
+
+    def get_attrs(self):
+        """
+        Returns the file attributes (as set on Datasets) without reading any data
+        :return: a Python dictionary of attributes
+        """
+        fid = self.get_fid()
+        try:
+            return fid.attributes()
+        finally:
+            self.close_fid(fid)
 
     # IV. Future OOP Things
     def get_ftype(self):
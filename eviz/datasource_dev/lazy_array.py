@@ -0,0 +1,89 @@
+"""
+The purpose of this file is to open data variables lazily: XArray DataArrays whose values are read (and
+restored) from the file only when they are indexed or computed, one window at a time.
+
+    • Indexing a lazy array (isel, sel, slicing) reads only the selected window with the reader's read_into
+    • Nothing is cached: reading the same window twice reads the file twice; .load() or .values reads the
+      whole selection into memory
+    • Used by Datasource when the requested data would exceed its memory budget (max_memory)
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+
+class ReaderArray(BackendArray):
+    """
+    An XArray backend array reading windows of one (time, row, column) variable through a reader.
+    """
+
+    # I. Constructor
+    def __init__(self, reader, var, shape, dtype):
+        """
+        Constructs a lazy array over one data variable
+        :param reader: an OMI or Landsat Reader object
+        :param var: a data variable String name
+        :param shape: a tuple of (rows, columns)
+        :param dtype: the floating-point dtype of restored values
+        """
+        self.reader = reader
+        self.var = var
+        self.shape = (1,) + tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    # II. Accessor & Helper Methods
+    def __getitem__(self, key):
+        """
+        Reads the values of an XArray indexer
+        :param key: an XArray ExplicitIndexer
+        :return: a NumPy array
+        """
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC,
+                                                  self.read_key)
+
+    def read_key(self, key):
+        """
+        Reads the values of a basic key (integers & slices)
+        :param key: a tuple of one integer or slice per dimension (time, row, column)
+        :return: a NumPy array
+        """
+        window = []
+        drop = []
+        for axis, (k, n) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                window.append(slice(*k.indices(n)))
+            else:   # An integer keeps a dimension of 1, dropped after reading
+                k = int(k) % n
+                window.append(slice(k, k + 1, 1))
+                drop.append(axis)
+
+        shape = tuple(len(range(win.start, win.stop, win.step)) for win in window)
+        out = np.empty(shape, dtype = self.dtype)
+
+        if out.size and window[0] == slice(0, 1, 1):
+            if self.reader.read_into(self.var, out, tuple(window[1:])) is None:
+                raise KeyError(self.var)
+        elif out.size:
+            raise IndexError(f'index out of range for the time dimension of {self.var}')
+
+        return out.squeeze(axis = tuple(drop)) if drop else out
+
+
+# III. TOP-LEVEL FUNCTIONS - - - - - - -
+def open_lazy(reader, var, grid, dtype):
+    """
+    Returns a lazy XArray DataArray of one data variable
+    :param reader: an OMI or Landsat Reader object
+    :param var: a data variable String name
+    :param grid: a Python dictionary of the variable dims, coords and attrs (see Datasource.get_grid)
+    :param dtype: the floating-point dtype of restored values
+    :return: an XArray DataArray
+    """
+    dims = grid['dims']
+    shape = tuple(grid['coords'][dim].size for dim in dims[1:])
+    data = indexing.LazilyIndexedArray(ReaderArray(reader, var, shape, dtype))
+
+    return xr.DataArray(xr.Variable(dims, data, attrs = dict(grid['attrs'])), coords = grid['coords'], name = var)
@@ -3,42 +3,79 @@
 
 """
 
+import os
+import time
+
 import numpy as np
 import xarray as xr
 # from datetime import datetime
 
 import h5py
 
+from reader_stats import ReaderStats
+from handle_pool import HandlePool
+import chunk_decoder
+import filename_meta
+
 import logging
 logging.basicConfig(level = logging.INFO)
 
+# Open h5py files shared by all OMI readers of the process
+POOL = HandlePool(lambda path, **options: h5py.File(path, 'r', **options), lambda fid: fid.close())
+
+# h5py file-access defaults for OMI L3 grids: data fields are gzip-compressed (180, 180) float32 chunks
+# (~127 KB each, 32 per 0.25 degree field), so the 1 MB h5py default cache holds only ~8 of them and
+# repeated sub-region reads keep decompressing the same chunks. 8 MB holds a whole 0.25 degree field;
+# rdcc_nslots is a prime ~100x the number of cached chunks.
+#   rdcc_nbytes   -> raw data chunk cache size per dataset (bytes)
+#   rdcc_nslots   -> number of chunk slots in the cache hash table
+#   rdcc_w0       -> chunk preemption policy (0 to 1; 1 evicts fully read chunks first)
+#   driver        -> 'None'/'sec2' (default POSIX), 'stdio' (buffered C stdio), 'core' (whole file in memory;
+#                    best for small files that are read completely)
+#   page_buf_size -> page buffer size in bytes for files written with the paged file space strategy
+# HDF5 shares one open file between opens of the same path, so the settings of the first open apply for as
+# long as any handle on the file stays open (e.g. in POOL).
+ACCESS_DEFAULTS = {'rdcc_nbytes': 8 * 1024 * 1024, 'rdcc_nslots': 6421, 'rdcc_w0': 0.75,
+                   'driver': None, 'page_buf_size': None}
+
 class OMIReader:
     """
     Handles reading OMI data from HDF5 files.
 
     **** OMI Level 1B data files are written in HE4 format while Level 2
          and Level 3 product are in HE5 format ****
+
+    Level 3 files hold grids (HDFEOS/GRIDS) read as (time, lat, lon) arrays; Level 2 files hold swaths
+    (HDFEOS/SWATHS) read as (scanline, pixel) arrays with 2D latitude & longitude coordinates
+    (see swath_binning.py to grid them).
     """
 
     # I. Constructor
-    def __init__(self, filename, var = None):
+    def __init__(self, filename, var = None, stats_callback = None, load = True, pooled = True, access = None,
+                 decode_threads = 0, dtype = None):
         """
         Constructs an object to generate either an XArray DataArray (if variable name given)
         or an XArray Dataset to represent OMI data from an HDF5 file.
         :param filename: a full path String of an OMI data file
         :param var: a data variable String name or tuple/list of String name(s)
-        """
-        self.fn = filename
+        :param stats_callback: a function called with each per-stage measurement (see ReaderStats) or 'None'
+        :param load: whether to read the data now (False leaves self.data as 'None' for windowed reads)
+        :param pooled: whether to keep the file open in the shared handle pool (POOL) between reads
+        :param access: a Python dictionary of h5py file-access settings overriding ACCESS_DEFAULTS or 'None'
+        :param decode_threads: the number of threads decoding compressed chunks in parallel (see chunk_decoder.py),
+                               'None' for one per CPU, or 0 to let h5py decode them
+        :param dtype: the floating-point dtype of restored data or 'None' (float32 fields stay float32, integer
+                      fields become float64)
+        """
+        self.set_defaults(filename, stats_callback, pooled, access, decode_threads, dtype)
         self.var_input = var
         self.var = var
         self.ftype = self.get_ftype()
 
-        self.log = logging.getLogger(__name__)
-
-        if isinstance(self.var, type(None)):
-            self.data = self.read_file()
+        if load:
+            self.data = self.read()
         else:
-            self.data = self.read_set()
+            self.data = None
 
     def __repr__(self):
         """
@@ -48,26 +85,137 @@ class OMIReader:
         return f'Reader object: {self.ftype}; {self.var_input}; {type(self.data)} \n{self.fn}'
 
     # II. Accessor & Helper Functions
+    def set_defaults(self, filename, stats_callback = None, pooled = True, access = None, decode_threads = 0,
+                     dtype = None):
+        """
+        Sets the reader attributes that don't depend on the file's contents (also used by benchmark_readers.bare
+        for readers that haven't read their file)
+        :param filename: a full path String of an OMI data file
+        :return: 'None' (see the constructor for the other parameters)
+        """
+        self.fn = filename
+
+        self.log = logging.getLogger(__name__)
+        self.stats = ReaderStats(filename, stats_callback)
+
+        self.access = self.get_access(access)
+        self.decode_threads = decode_threads
+        self.dtype = dtype
+
+        self.pooled = pooled
+        self.handle = None   # PooledHandle of the open file
+        self.meta = {}   # Parsed metadata of the open file when not pooled
+        self.structure = None   # 'GRIDS' or 'SWATHS' once a handle of the file has been opened
+
     def get_fid(self):
         """
-        Access the file reader object for a given HDF5 file
+        Access the file reader object for a given HDF5 file (from the handle pool if pooled);
+        every call is paired with close_fid
         :return: an h5py file reader object
         """
-        fid = h5py.File(self.fn, 'r')
+        start = time.perf_counter()
+
+        if self.pooled:
+            self.handle = POOL.acquire(self.fn, **self.access)
+            self.handle.lock.acquire()
+            fid = self.handle.fid
+            nbytes = os.path.getsize(self.fn) if self.handle.uses == 1 else 0   # 0 when reused
+        else:
+            fid = h5py.File(self.fn, 'r', **self.access)
+            self.meta = {}
+            nbytes = os.path.getsize(self.fn)
+
+        self.stats.record('open', start, nbytes)
         return fid
 
+    def get_access(self, access):
+        """
+        Returns the h5py file-access settings, leaving out unset (None) values
+        :param access: a Python dictionary of settings overriding ACCESS_DEFAULTS or 'None'
+        :return: a Python dictionary of h5py.File keyword arguments
+        """
+        settings = dict(ACCESS_DEFAULTS)
+        settings.update(access or {})
+
+        unknown = set(settings) - set(ACCESS_DEFAULTS)
+        if unknown:
+            raise ValueError(f'unknown h5py access settings: {sorted(unknown)}')
+        if settings['driver'] not in (None, 'sec2', 'stdio', 'core'):
+            raise ValueError(f"unsupported h5py driver '{settings['driver']}'")
+
+        return {key: value for key, value in settings.items() if value is not None}
+
+    def close_fid(self, fid):
+        """
+        Closes a file reader object, or gives it back to the handle pool if pooled
+        :param fid: an h5py file reader object
+        """
+        if self.pooled:
+            handle = self.handle
+            handle.lock.release()
+            POOL.release(handle)
+        else:
+            fid.close()
+
+    def get_meta(self):
+        """
+        Returns the parsed-metadata cache of the open file (kept with the pooled handle)
+        :return: a Python dictionary
+        """
+        if self.pooled and self.handle is not None:
+            return self.handle.meta
+        return self.meta
+
+    def get_structure(self, fid):
+        """
+        Returns the HDF-EOS structure of the file
+        :param fid: a file identifier object
+        :return: 'GRIDS' (Level 3) or 'SWATHS' (Level 2)
+        """
+        if self.structure is None:   # Kept on the reader: the file (and so its structure) doesn't change
+            self.structure = 'GRIDS' if 'GRIDS' in fid['HDFEOS'] else 'SWATHS'
+
+        return self.structure
+
     def get_data_group(self, fid):
         """
         Finds and returns the contents of the file data field subgroup in dictionary format
         :param fid: a file identifier object
         :return: a Python dictionary of dataset name String keys and dataset object values
         """
-        parent_contents = dict(fid['HDFEOS']['GRIDS'])  # contents of our parent group
-        sub = list(parent_contents.values())[0]  # our sub-parent group object
-        sub_contents = dict(sub)  # contents of our sub-parent group
-        data_group = list(sub_contents.values())[0]  # our data group object
+        meta = self.get_meta()
 
-        return dict(data_group)
+        if 'data_group' not in meta:
+            structure = self.get_structure(fid)
+            parent_contents = dict(fid['HDFEOS'][structure])  # contents of our parent group
+            sub = list(parent_contents.values())[0]  # our sub-parent group object
+
+            if structure == 'SWATHS':   # Swaths also hold a 'Geolocation Fields' group
+                data_group = sub['Data Fields']
+            else:
+                sub_contents = dict(sub)  # contents of our sub-parent group
+                data_group = list(sub_contents.values())[0]  # our data group object
+
+            meta['data_group'] = dict(data_group)
+
+        return meta['data_group']
+
+    def get_geo_group(self, fid):
+        """
+        Returns the contents of the swath geolocation field subgroup (Latitude, Longitude, Time, ...)
+        :param fid: a file identifier object
+        :return: a Python dictionary of dataset name String keys and dataset object values (empty for grids)
+        """
+        meta = self.get_meta()
+
+        if 'geo_group' not in meta:
+            if self.get_structure(fid) == 'SWATHS':
+                sub = list(dict(fid['HDFEOS']['SWATHS']).values())[0]
+                meta['geo_group'] = dict(sub['Geolocation Fields'])
+            else:
+                meta['geo_group'] = {}
+
+        return meta['geo_group']
 
     # - - - - - A. Attributes
     def convert_dict_dtype(self, sample_dict):
@@ -76,7 +224,12 @@ class OMIReader:
         :param sample_dict: a Python dictionary of attributes
         :return: a Python dictionary of attributes
         """
+        start = time.perf_counter()
+        nbytes = 0
+
         for key, item in sample_dict.items():
+            nbytes += getattr(item, 'nbytes', 0)
+
             if isinstance(item, np.ndarray):  # Converts np arrays to a list to, if applicable, an int or float
                 item = list(item)
 
@@ -91,6 +244,7 @@ class OMIReader:
 
             sample_dict[key] = item  # Updates any changes to the key value
 
+        self.stats.record('attrs', start, nbytes)
         return sample_dict
 
     def get_fid_attrs(self, fid):
@@ -99,12 +253,18 @@ class OMIReader:
         :param fid: a file reader object
         :return: a Python dictionary of attributes
         """
-        fid_attrs = dict(fid['HDFEOS']['ADDITIONAL']['FILE_ATTRIBUTES'].attrs)
-        fid_attrs = self.convert_dict_dtype(fid_attrs)
+        meta = self.get_meta()
+
+        if 'fid_attrs' not in meta:
+            start = time.perf_counter()
+            fid_attrs = dict(fid['HDFEOS']['ADDITIONAL']['FILE_ATTRIBUTES'].attrs)
+            fid_attrs = self.convert_dict_dtype(fid_attrs)
+            self.stats.record('attrs', start)
 
-        fid_attrs.update(self.get_plot_attrs(fid))
+            fid_attrs.update(self.get_plot_attrs(fid))
+            meta['fid_attrs'] = fid_attrs
 
-        return fid_attrs
+        return dict(meta['fid_attrs'])
 
     def get_plot_attrs(self, fid):
         """
@@ -112,13 +272,18 @@ class OMIReader:
         :param fid: a file reader object
         :return: a Python dictionary of attributes
         """
-        parent_contents = dict(fid['HDFEOS']['GRIDS'])
-        subgroup = list(parent_contents.values())[0]
+        meta = self.get_meta()
 
-        plot_attrs = dict(subgroup.attrs)
-        plot_attrs = self.convert_dict_dtype(plot_attrs)
+        if 'plot_attrs' not in meta:
+            start = time.perf_counter()
+            parent_contents = dict(fid['HDFEOS'][self.get_structure(fid)])
+            subgroup = list(parent_contents.values())[0]
 
-        return plot_attrs
+            plot_attrs = dict(subgroup.attrs)
+            meta['plot_attrs'] = self.convert_dict_dtype(plot_attrs)
+            self.stats.record('attrs', start)
+
+        return dict(meta['plot_attrs'])
 
     def get_ds_attrs(self, ds):
         """
@@ -126,10 +291,13 @@ class OMIReader:
         :param ds: an HDF5 dataset object
         :return: a Python dictionary of attributes
         """
-        ds_attrs = dict(ds.attrs)
-        ds_attrs = self.convert_dict_dtype(ds_attrs)
+        cache = self.get_meta().setdefault('ds_attrs', {})
+
+        if ds.name not in cache:
+            ds_attrs = dict(ds.attrs)
+            cache[ds.name] = self.convert_dict_dtype(ds_attrs)
 
-        return ds_attrs
+        return dict(cache[ds.name])
 
     # - - - - - B. Data Restoration
     def get_fill(self, ds_attrs):
@@ -165,10 +333,11 @@ class OMIReader:
                 return value
         return 0
 
-    def restore_data(self, ds):
+    def restore_data(self, ds, window = None):
         """
         Restores the data of a given dataset object
         :param ds: an HDF5 dataset object
+        :param window: a tuple of (row, column) slices to read or 'None' for the whole dataset
         :return: a NumPy array
         """
         ds_attrs = self.get_ds_attrs(ds)
@@ -177,23 +346,68 @@ class OMIReader:
         scale = self.get_scale(ds_attrs)
         offset = self.get_offset(ds_attrs)
 
-        data = ds[()]  # .astype('float')
+        start = time.perf_counter()
+        data = self.read_raw(ds, window)  # .astype('float')
+        self.stats.record('read', start, data.nbytes)
 
-        data = np.where(data != fill, data, np.nan)
-        data *= scale
-        data += offset
+        start = time.perf_counter()
+        if self.dtype is not None:   # Restores a copy in the output dtype
+            data = self.restore_into(data.astype(self.dtype), ds_attrs)
+        else:
+            data = np.where(data != fill, data, np.nan)
+            data *= scale
+            data += offset
 
         data = np.expand_dims(data, axis = 0)
+        self.stats.record('restore', start, data.nbytes)
 
         return data
 
+    def read_raw(self, ds, window = None):
+        """
+        Reads the raw data of a dataset, decoding its chunks in parallel if enabled and supported
+        :param ds: an HDF5 dataset object
+        :param window: a tuple of (row, column) slices to read or 'None' for the whole dataset
+        :return: a NumPy array
+        """
+        if self.decode_threads != 0 and chunk_decoder.supports(ds, window):
+            shape = tuple(hi - lo for lo, hi in chunk_decoder.get_bounds(ds, window))
+            return chunk_decoder.decode_into(ds, np.empty(shape, dtype = ds.dtype), window, self.decode_threads)
+
+        return ds[()] if window is None else ds[window]
+
+    def restore_into(self, out, ds_attrs):
+        """
+        Restores raw data in place (fill values become NaN, then scale and offset are applied)
+        :param out: a floating-point NumPy array of raw data
+        :param ds_attrs: a Python dictionary of dataset attributes
+        :return: the same NumPy array
+        """
+        fill = self.get_fill(ds_attrs)
+        scale = self.get_scale(ds_attrs)
+        offset = self.get_offset(ds_attrs)
+
+        if fill is not None:
+            np.putmask(out, out == fill, np.nan)
+        if scale != 1:
+            out *= scale
+        if offset != 0:
+            out += offset
+
+        return out
+
     # - - - - - C. Coordinates & Dimensions
     def get_time(self, fid):
         """
-        Returns the time at which the data was measured/acquired
+        Returns the time at which the data was measured/acquired, parsed from the filename if it follows the
+        OMI naming convention (no attributes are read) or else from the granule date attributes
         :param fid: a file reader object
-        :return: a list of a DateTime object
+        :return: a datetime64[ns] NumPy array of one time
         """
+        fn_meta = filename_meta.parse_omi(self.fn)
+        if fn_meta is not None:
+            return np.array([fn_meta['date']], dtype = 'datetime64[ns]')
+
         fid_attrs = self.get_fid_attrs(fid)
 
         year = month = day = None
@@ -210,8 +424,7 @@ class OMIReader:
                     day = '0'+day
 
         time = year + '-' + month + '-' + day
-        times = [time]
-        # times = [datetime.strptime(time, '%Y %b %d')]
+        times = np.array([time], dtype = 'datetime64[ns]')
 
         return times
 
@@ -221,7 +434,17 @@ class OMIReader:
         :param fid: a file reader object
         :return: a Python dictionary of String keys and NumPy array values
         """
-        plot_attrs = self.get_plot_attrs(fid)
+        meta = self.get_meta()
+        if 'coords' in meta:
+            return meta['coords']
+
+        if self.get_structure(fid) == 'SWATHS':
+            raise ValueError(f'{self.fn} holds swaths, which have no grid coordinates (see read_swath_fields)')
+
+        plot_attrs = self.get_plot_attrs(fid)   # Attribute reads are timed as 'attrs', not 'coords'
+        times = self.get_time(fid)
+
+        start = time.perf_counter()
 
         lonW = plot_attrs['GridSpan'][0]
         lonE = plot_attrs['GridSpan'][1]
@@ -233,9 +456,11 @@ class OMIReader:
 
         lons = np.linspace(lonW, lonE, lon_size)
         lats = np.linspace(latS, latN, lat_size)
-        times = self.get_time(fid)
 
-        return {'times': times, 'lons': lons, 'lats': lats}
+        meta['coords'] = {'times': times, 'lons': lons, 'lats': lats}
+        self.stats.record('coords', start, lons.nbytes + lats.nbytes)
+
+        return meta['coords']
 
     def get_ds_dims(self, ds, coords):
         """
@@ -277,12 +502,13 @@ class OMIReader:
         return coords
 
     # III. Top-Level Functions
-    def get_array(self, data_group, fid_coords):
+    def get_array(self, data_group, fid_coords, window = None):
         """
         Returns an XArray DataArray of an HDF5 dataset given the data field subgroup contents and
         file-level coordinates.
         :param data_group: a Python dictionary of String keys and HDF5 dataset object values
         :param fid_coords: a Python dictionary of file coordinates (NumPy arrays)
+        :param window: a tuple of (row, column) slices to read or 'None' for the whole dataset
         :return: an XArray DataArray
         """
         try:
@@ -296,14 +522,20 @@ class OMIReader:
         else:
             self.log.debug(f'CONFIGURING {self.var} ARRAY')
 
-            data = self.restore_data(hdf_ds)
+            data = self.restore_data(hdf_ds, window)
             ds_attrs = self.get_ds_attrs(hdf_ds)
 
             ds_dims = self.get_ds_dims(hdf_ds, fid_coords)
             ds_coords = self.check_coords(ds_dims, fid_coords)
 
-            xr_arr = xr.DataArray(data, dims=list(ds_dims.keys()), coords=list(ds_coords.values()))
+            coords = list(ds_coords.values())
+            if window is not None:   # Keeps only the coordinates of the window
+                coords = coords[:1] + [coord[win] for coord, win in zip(coords[1:], window)]
+
+            start = time.perf_counter()
+            xr_arr = xr.DataArray(data, dims=list(ds_dims.keys()), coords=coords)
             xr_arr.attrs = ds_attrs
+            self.stats.record('assemble', start, data.nbytes)
 
         return xr_arr
 
@@ -313,66 +545,67 @@ class OMIReader:
         :return: an XArray DataArray or Dataset
         """
         fid = self.get_fid()
-        self.log.info('READING FILE')
-
-        data_group = self.get_data_group(fid)
-        fid_coords = self.get_coords(fid)
-
-        if isinstance(self.var_input, str):
-            xr_arr = self.get_array(data_group, fid_coords)
-            self.log.info('DATA ARRAY CREATED')
-
-            try:
-                xr_arr.name = self.var_input
-            except AttributeError:
-                self.log.warning('EMPTY DATA ARRAY')
+        if self.get_structure(fid) == 'SWATHS':
+            return self.read_swaths(fid)
+        self.log.debug('READING FILE')
 
-            self.log.info('CLOSING FILE')
-            fid.close()
-
-            return xr_arr
+        try:
+            data_group = self.get_data_group(fid)
+            fid_coords = self.get_coords(fid)
 
-        elif isinstance(self.var_input, tuple) or isinstance(self.var_input, list):
-            if len(self.var_input) == 1:
-                self.var = self.var_input[0]
+            if isinstance(self.var_input, str):
                 xr_arr = self.get_array(data_group, fid_coords)
-                self.log.info('DATA ARRAY CREATED')
+                self.log.debug('DATA ARRAY CREATED')
 
                 try:
-                    xr_arr.name = self.var_input[0]
+                    xr_arr.name = self.var_input
                 except AttributeError:
                     self.log.warning('EMPTY DATA ARRAY')
 
-                self.log.info('CLOSING FILE')
-                fid.close()
-
                 return xr_arr
 
-            else:
-                xr_ds = xr.Dataset()
+            elif isinstance(self.var_input, tuple) or isinstance(self.var_input, list):
+                if len(self.var_input) == 1:
+                    self.var = self.var_input[0]
+                    xr_arr = self.get_array(data_group, fid_coords)
+                    self.log.debug('DATA ARRAY CREATED')
 
-                fid_attrs = self.get_fid_attrs(fid)
+                    try:
+                        xr_arr.name = self.var_input[0]
+                    except AttributeError:
+                        self.log.warning('EMPTY DATA ARRAY')
 
-                for var in self.var_input:
-                    if var in data_group.keys():
-                        self.var = var
-                        xr_ds[var] = self.get_array(data_group, fid_coords)
-                    else:
-                        self.log.warning(f"VARIABLE '{var}' DOES NOT EXIST")
+                    return xr_arr
 
-                xr_ds.attrs = fid_attrs
-                self.log.info('DATASET CREATED')
+                else:
+                    xr_ds = xr.Dataset()
 
-                self.log.info('CLOSING FILE')
-                fid.close()
+                    fid_attrs = self.get_fid_attrs(fid)
 
-                if '*empty*' in repr(xr_ds.data_vars):  # If the dataset is empty
-                    self.log.warning('EMPTY DATASET')
-                    return None
-                else:
-                    return xr_ds
-        else:
-            return None
+                    for var in self.var_input:
+                        if var in data_group.keys():
+                            self.var = var
+                            xr_arr = self.get_array(data_group, fid_coords)
+
+                            start = time.perf_counter()
+                            xr_ds[var] = xr_arr
+                            self.stats.record('assemble', start)
+                        else:
+                            self.log.warning(f"VARIABLE '{var}' DOES NOT EXIST")
+
+                    xr_ds.attrs = fid_attrs
+                    self.log.debug('DATASET CREATED')
+
+                    if '*empty*' in repr(xr_ds.data_vars):  # If the dataset is empty
+                        self.log.warning('EMPTY DATASET')
+                        return None
+                    else:
+                        return xr_ds
+            else:
+                return None
+        finally:
+            self.log.debug('CLOSING FILE')
+            self.close_fid(fid)
 
     def read_file(self):
         """
@@ -382,27 +615,332 @@ class OMIReader:
         xr_ds = xr.Dataset()
 
         fid = self.get_fid()
-        self.log.info('READING FILE')
+        if self.get_structure(fid) == 'SWATHS':
+            return self.read_swaths(fid)
+        self.log.debug('READING FILE')
 
-        data_group = self.get_data_group(fid)
-        fid_attrs = self.get_fid_attrs(fid)
-        fid_coords = self.get_coords(fid)
+        try:
+            data_group = self.get_data_group(fid)
+            fid_attrs = self.get_fid_attrs(fid)
+            fid_coords = self.get_coords(fid)
+
+            for var in data_group.keys():
+                self.var = var
+                xr_arr = self.get_array(data_group, fid_coords)
+
+                start = time.perf_counter()
+                xr_ds[var] = xr_arr
+                self.stats.record('assemble', start)
+
+            xr_ds.attrs = fid_attrs
+            self.log.debug('DATASET CREATED')
+
+            if '*empty*' in repr(xr_ds.data_vars):   # If the dataset is empty
+                self.log.warning('EMPTY DATASET')
+                return None
+            else:
+                return xr_ds
+        finally:
+            self.log.debug('CLOSING FILE')
+            self.close_fid(fid)
+
+    def read(self):
+        """
+        Reads the requested data variable(s), or the whole file if none were given
+        :return: an XArray DataArray or Dataset
+        """
+        if self.structure == 'SWATHS':   # Otherwise found on the handle read_file/read_set open
+            return self.read_swaths()
+        elif isinstance(self.var_input, type(None)):
+            return self.read_file()
+        else:
+            return self.read_set()
+
+    def read_window(self, var, window = None):
+        """
+        Reads a rectangular window of one data variable without reading the rest of the file
+        :param var: a data variable String name
+        :param window: a tuple of (row, column) slices or 'None' for the whole grid
+        :return: an XArray DataArray or 'None'
+        """
+        fid = self.get_fid()
+        self.log.debug('READING WINDOW')
+
+        try:
+            data_group = self.get_data_group(fid)
+            fid_coords = self.get_coords(fid)
 
-        for var in data_group.keys():
             self.var = var
-            xr_ds[var] = self.get_array(data_group, fid_coords)
+            xr_arr = self.get_array(data_group, fid_coords, window)
+
+            try:
+                xr_arr.name = var
+            except AttributeError:
+                self.log.warning('EMPTY DATA ARRAY')
+
+            return xr_arr
+        finally:
+            self.log.debug('CLOSING FILE')
+            self.close_fid(fid)
+
+    def read_into(self, var, out, window = None):
+        """
+        Reads and restores one data variable (or a window of it) straight into a caller-provided array, such as
+        one time step of a preallocated stack or an array backed by multiprocessing.shared_memory, using
+        h5py's read_direct so no intermediate arrays are made
+        :param var: a data variable String name
+        :param out: a writeable, C-contiguous floating-point NumPy array with the (window) shape of the dataset,
+                    optionally with a leading time dimension of 1
+        :param window: a tuple of (row, column) slices or 'None' for the whole grid
+        :return: out, or 'None' if the variable doesn't exist
+        """
+        if not np.issubdtype(out.dtype, np.floating):
+            raise TypeError(f'read_into needs a floating-point array to hold NaN fill values, not {out.dtype}')
+
+        fid = self.get_fid()
+        self.log.debug('READING INTO BUFFER')
+
+        try:
+            data_group = self.get_data_group(fid)
+            if var not in data_group:
+                self.log.warning(f"VARIABLE '{var}' DOES NOT EXIST")
+                return None
+
+            ds = data_group[var]
+            ds_attrs = self.get_ds_attrs(ds)
+
+            shape = ds.shape if window is None else tuple(len(range(*win.indices(n)))
+                                                          for win, n in zip(window, ds.shape))
+            dest = out.reshape(shape)   # Drops a leading time dimension; raises if it would have to copy
+            if not np.shares_memory(dest, out):
+                raise ValueError('read_into needs a C-contiguous output array')
+
+            start = time.perf_counter()
+            if self.decode_threads != 0 and chunk_decoder.supports(ds, window):
+                chunk_decoder.decode_into(ds, dest, window, self.decode_threads)
+            else:
+                ds.read_direct(dest, source_sel = window)   # HDF5 converts to the dtype of the output array
+            self.stats.record('read', start, dest.nbytes)
+
+            start = time.perf_counter()
+            self.restore_into(dest, ds_attrs)
+            self.stats.record('restore', start, dest.nbytes)
+
+            return out
+        finally:
+            self.log.debug('CLOSING FILE')
+            self.close_fid(fid)
+
+    def get_shape(self, var):
+        """
+        Returns the shape of a data variable without reading its data
+        :param var: a data variable String name
+        :return: a tuple of dimension sizes or 'None'
+        """
+        fid = self.get_fid()
+        try:
+            data_group = self.get_data_group(fid)
+
+            return data_group[var].shape if var in data_group else None
+        finally:
+            self.close_fid(fid)
+
+    def get_dtype(self, var):
+        """
+        Returns the stored (raw) dtype of a data variable without reading its data
+        :param var: a data variable String name
+        :return: a NumPy dtype or 'None'
+        """
+        fid = self.get_fid()
+        try:
+            data_group = self.get_data_group(fid)
+
+            return data_group[var].dtype if var in data_group else None
+        finally:
+            self.close_fid(fid)
 
-        xr_ds.attrs = fid_attrs
-        self.log.info('DATASET CREATED')
+    def get_var_coords(self, var):
+        """
+        Returns the coordinates of a data variable in dimension order without reading its data
+        :param var: a data variable String name
+        :return: a Python dictionary of String keys and NumPy array values (time, rows, columns) or 'None'
+        """
+        fid = self.get_fid()
+        try:
+            data_group = self.get_data_group(fid)
+            if var not in data_group:
+                return None
+
+            fid_coords = self.get_coords(fid)
+            return self.check_coords(self.get_ds_dims(data_group[var], fid_coords), fid_coords)
+        finally:
+            self.close_fid(fid)
+
+    def read_cells(self, var, rows, cols):
+        """
+        Reads and restores single grid cells of a data variable, reading only the rows (and column range)
+        that hold them and restoring only the gathered values
+        :param var: a data variable String name
+        :param rows: an integer NumPy array of row indices
+        :param cols: an integer NumPy array of column indices
+        :return: a float64 NumPy array of restored values or 'None'
+        """
+        fid = self.get_fid()
+        try:
+            data_group = self.get_data_group(fid)
+            if var not in data_group:
+                self.log.warning(f"VARIABLE '{var}' DOES NOT EXIST")
+                return None
+            if rows.size == 0:
+                return np.empty(0)
+
+            ds = data_group[var]
+            ds_attrs = self.get_ds_attrs(ds)
+
+            start = time.perf_counter()
+            unique_rows, inverse = np.unique(rows, return_inverse = True)
+            first, last = int(cols.min()), int(cols.max())
+            block = ds[unique_rows, first:last + 1]   # h5py takes one increasing index list per selection
+            values = block[inverse, cols - first].astype('float64')
+            self.stats.record('read', start, block.nbytes)
+
+            start = time.perf_counter()
+            self.restore_into(values, ds_attrs)
+            self.stats.record('restore', start, values.nbytes)
 
-        self.log.info('CLOSING FILE')
-        fid.close()
+            return values
+        finally:
+            self.close_fid(fid)
 
-        if '*empty*' in repr(xr_ds.data_vars):   # If the dataset is empty
-            self.log.warning('EMPTY DATASET')
+    def get_vars(self):
+        """
+        Returns the names of the data variables in the file without reading their data
+        :return: a Python list of variable name Strings
+        """
+        fid = self.get_fid()
+        try:
+            return list(self.get_data_group(fid).keys())
+        finally:
+            self.close_fid(fid)
+
+    def get_attrs(self):
+        """
+        Returns the file attributes (as set on Datasets) without reading any data
+        :return: a Python dictionary of attributes
+        """
+        fid = self.get_fid()
+        try:
+            return self.get_fid_attrs(fid)
+        finally:
+            self.close_fid(fid)
+
+    # - - - - - Swaths (Level 2)
+    def is_swath(self):
+        """
+        Determines if the file holds swaths (Level 2) rather than grids (Level 3)
+        :return: Boolean
+        """
+        if self.structure is None:
+            fid = self.get_fid()
+            try:
+                self.get_structure(fid)
+            finally:
+                self.close_fid(fid)
+
+        return self.structure == 'SWATHS'
+
+    def read_swath_fields(self, names, rows = None, raw = ()):
+        """
+        Reads data and geolocation fields of a swath, optionally only a block of scanlines, so whole orbits
+        can be streamed in blocks
+        :param names: a Python list of field name Strings (e.g. ['ColumnAmountO3', 'Latitude', 'Longitude'])
+        :param rows: a slice of scanlines or 'None' for every scanline
+        :param raw: field name Strings to return unrestored (e.g. bit-packed quality flags)
+        :return: a Python dictionary of field name String keys and NumPy array values or 'None'
+        """
+        fid = self.get_fid()
+        try:
+            fields = dict(self.get_geo_group(fid))
+            fields.update(self.get_data_group(fid))
+
+            result = {}
+            for name in names:
+                if name not in fields:
+                    self.log.warning(f"VARIABLE '{name}' DOES NOT EXIST")
+                    return None
+                ds = fields[name]
+
+                start = time.perf_counter()
+                data = ds[()] if rows is None else ds[rows]
+                self.stats.record('read', start, data.nbytes)
+
+                if name not in raw:
+                    start = time.perf_counter()
+                    data = self.restore_into(data.astype(self.dtype or np.result_type(data.dtype, np.float32)),
+                                             self.get_ds_attrs(ds))
+                    self.stats.record('restore', start, data.nbytes)
+                result[name] = data
+
+            return result
+        finally:
+            self.close_fid(fid)
+
+    def read_swaths(self, fid = None):
+        """
+        Reads the requested swath data variable(s), or every (scanline, pixel) variable if none were given,
+        with 2D latitude & longitude coordinates
+        :param fid: a file reader object already opened by the read (closed here) or 'None'
+        :return: an XArray DataArray or Dataset
+        """
+        if fid is None:
+            fid = self.get_fid()
+        try:   # Datasets are only used while the file is open (unpooled handles close)
+            data_group = self.get_data_group(fid)
+            geo_shape = self.get_geo_group(fid)['Latitude'].shape
+            fid_attrs = self.get_fid_attrs(fid)
+
+            if isinstance(self.var_input, str):
+                names = [self.var_input]
+            elif self.var_input is None:
+                names = [name for name, ds in data_group.items() if ds.shape == geo_shape]
+            else:
+                names = list(self.var_input)
+
+            for name in list(names):
+                if name not in data_group:
+                    self.log.warning(f"VARIABLE '{name}' DOES NOT EXIST")
+                    names.remove(name)
+                elif data_group[name].shape[:2] != geo_shape:
+                    self.log.warning(f"SKIPPING '{name}' WITH SHAPE {data_group[name].shape}")
+                    names.remove(name)
+
+            ds_attrs = {name: self.get_ds_attrs(data_group[name]) for name in names}
+            ds_dims = {name: data_group[name].ndim for name in names}
+        finally:
+            self.close_fid(fid)
+
+        if not names:
             return None
-        else:
-            return xr_ds
+
+        fields = self.read_swath_fields(['Latitude', 'Longitude'] + names)
+        coords = {'lat': (('scanline', 'pixel'), fields['Latitude']),
+                  'lon': (('scanline', 'pixel'), fields['Longitude'])}
+
+        start = time.perf_counter()
+        arrays = {}
+        for name in names:
+            dims = ['scanline', 'pixel'] + [f'{name}_dim{i}' for i in range(2, ds_dims[name])]
+            arrays[name] = xr.DataArray(fields[name], dims = dims, coords = coords, name = name,
+                                        attrs = ds_attrs[name])
+
+        if isinstance(self.var_input, str) or (self.var_input is not None and len(self.var_input) == 1):
+            xr_arr = list(arrays.values())[0]
+            self.stats.record('assemble', start, xr_arr.nbytes)
+            return xr_arr
+
+        xr_ds = xr.Dataset(arrays, attrs = fid_attrs)
+        self.stats.record('assemble', start)
+        return xr_ds
 
     # IV. Future OOP Things
     def get_ftype(self):
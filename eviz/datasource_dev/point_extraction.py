@@ -0,0 +1,182 @@
+"""
+The purpose of this file is to extract the values of many points (e.g. ground stations) from many OMI or
+Landsat files without reading whole grids.
+
+    • Grid indices and interpolation weights are computed once per distinct grid (template) of a process; the
+      last TEMPLATE_CACHE_SIZE templates are kept
+    • Only the rows (and the column range) holding the points are read from each file (read_cells), and
+      fill/scale/offset are applied to the gathered values only
+    • Files are processed in parallel by a process pool
+
+Methods:
+    • nearest  -> the value of the grid cell nearest to each point
+    • bilinear -> the distance-weighted value of the four cells around each point (NaN if any of them is
+                  missing)
+
+Points outside a grid are NaN.
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import os
+import functools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+from datasource import Datasource
+from zonal_stats import digest
+
+log = logging.getLogger(__name__)
+
+METHODS = ('nearest', 'bilinear')
+
+# Templates of the current process: (grid digest, points digest, method) -> template
+TEMPLATE_CACHE = {}
+TEMPLATE_CACHE_SIZE = 16
+
+
+# II. HELPER FUNCTIONS - - - - - - -
+def fractional_index(coord, values):
+    """
+    Returns the fractional positions of values along a monotonic coordinate
+    :param coord: a 1D NumPy array of ascending or descending coordinates
+    :param values: a 1D NumPy array of locations
+    :return: a float64 NumPy array of positions (NaN outside the coordinate range)
+    """
+    positions = np.arange(coord.size, dtype = 'float64')
+
+    if coord.size > 1 and coord[-1] < coord[0]:
+        return np.interp(values, coord[::-1], positions[::-1], left = np.nan, right = np.nan)
+    return np.interp(values, coord, positions, left = np.nan, right = np.nan)
+
+
+def make_template(row_coord, col_coord, lats, lons, method):
+    """
+    Computes the grid cells and weights of every point on one grid
+    :param row_coord: a 1D NumPy array of row (latitude) coordinates
+    :param col_coord: a 1D NumPy array of column (longitude) coordinates
+    :param lats: a 1D NumPy array of point latitudes
+    :param lons: a 1D NumPy array of point longitudes
+    :param method: 'nearest' or 'bilinear'
+    :return: a Python dictionary of 'rows', 'cols', 'weights' (points x cells) and 'valid' (points) arrays
+    """
+    fy = fractional_index(row_coord, lats)
+    fx = fractional_index(col_coord, lons)
+    valid = ~np.isnan(fy) & ~np.isnan(fx)
+    fy = np.where(valid, fy, 0)
+    fx = np.where(valid, fx, 0)
+
+    if method == 'nearest':
+        rows = np.rint(fy).astype('int64')[:, np.newaxis]
+        cols = np.rint(fx).astype('int64')[:, np.newaxis]
+        weights = np.ones(rows.shape)
+    else:
+        y0 = np.clip(np.floor(fy).astype('int64'), 0, max(row_coord.size - 2, 0))
+        x0 = np.clip(np.floor(fx).astype('int64'), 0, max(col_coord.size - 2, 0))
+        wy = fy - y0
+        wx = fx - x0
+        y1 = np.minimum(y0 + 1, row_coord.size - 1)
+        x1 = np.minimum(x0 + 1, col_coord.size - 1)
+
+        rows = np.stack([y0, y0, y1, y1], axis = 1)
+        cols = np.stack([x0, x1, x0, x1], axis = 1)
+        weights = np.stack([(1 - wy) * (1 - wx), (1 - wy) * wx, wy * (1 - wx), wy * wx], axis = 1)
+
+    return {'rows': rows, 'cols': cols, 'weights': weights, 'valid': valid}
+
+
+def get_template(coords, lats, lons, method):
+    """
+    Returns the (cached) template of a grid
+    :param coords: a Python dictionary of variable coordinates in dimension order (time, rows, columns)
+    :param lats: a 1D NumPy array of point latitudes
+    :param lons: a 1D NumPy array of point longitudes
+    :param method: 'nearest' or 'bilinear'
+    :return: a Python dictionary (see make_template)
+    """
+    row_coord, col_coord = list(coords.values())[1:]
+    key = (digest(row_coord, col_coord), digest(lats, lons), method)
+
+    if key not in TEMPLATE_CACHE:
+        if len(TEMPLATE_CACHE) >= TEMPLATE_CACHE_SIZE:
+            TEMPLATE_CACHE.pop(next(iter(TEMPLATE_CACHE)))
+        TEMPLATE_CACHE[key] = make_template(row_coord, col_coord, lats, lons, method)
+    return TEMPLATE_CACHE[key]
+
+
+def extract_file(filename, var, lats, lons, method = 'nearest'):
+    """
+    Extracts the point values of one file
+    :param filename: a full path String
+    :param var: a data variable String
+    :param lats: a 1D NumPy array of point latitudes
+    :param lons: a 1D NumPy array of point longitudes
+    :param method: 'nearest' or 'bilinear'
+    :return: a tuple of the file time (a datetime64 or 'None') and a float64 NumPy array of point values
+    """
+    values = np.full(lats.size, np.nan)
+
+    source = Datasource(filename, load = False)
+    if source.reader is None:
+        return None, values
+
+    coords = source.reader.get_var_coords(var)
+    if coords is None:
+        log.warning(f"VARIABLE '{var}' DOES NOT EXIST IN {filename}")
+        return None, values
+
+    template = get_template(coords, lats, lons, method)
+    valid = template['valid']
+
+    # Each distinct cell is read once
+    cells, inverse = np.unique(np.stack([template['rows'][valid].ravel(), template['cols'][valid].ravel()]),
+                               axis = 1, return_inverse = True)
+    gathered = source.reader.read_cells(var, cells[0], cells[1])[inverse.ravel()]
+
+    weights = template['weights'][valid]
+    gathered = gathered.reshape(weights.shape)
+    values[valid] = np.where(weights > 0, weights * gathered, 0).sum(axis = 1)   # Zero weights ignore NaN cells
+
+    return list(coords.values())[0][0], values
+
+
+# III. TOP-LEVEL FUNCTIONS - - - - - - -
+def extract_points(paths, var, lats, lons, method = 'nearest', workers = None):
+    """
+    Extracts the values of points from many files of the same variable
+    (usage: extract_points(sorted(glob.glob('OMI/*.he5')), 'ColumnAmountO3', station_lats, station_lons))
+    :param paths: a Python list of full path Strings
+    :param var: a data variable String
+    :param lats: a sequence of point latitudes
+    :param lons: a sequence of point longitudes
+    :param method: 'nearest' or 'bilinear'
+    :param workers: the number of worker processes, 'None' for one per CPU, or 1 to run in this process
+    :return: an XArray DataArray (time, point) with the file path of each time step
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, not '{method}'")
+
+    lats = np.asarray(lats, dtype = 'float64').ravel()
+    lons = np.asarray(lons, dtype = 'float64').ravel()
+    if lats.shape != lons.shape:
+        raise ValueError('lats and lons must have the same number of points')
+
+    paths = list(paths)
+    extract = functools.partial(extract_file, var = var, lats = lats, lons = lons, method = method)
+
+    if workers == 1 or len(paths) <= 1:
+        results = [extract(path) for path in paths]
+    else:
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            results = list(pool.map(extract, paths, chunksize = max(1, len(paths) // (4 * workers))))
+
+    times = np.array([time for time, _ in results], dtype = 'datetime64[ns]')   # NaT for unread files
+    values = np.array([values for _, values in results]).reshape(len(paths), lats.size)
+
+    return xr.DataArray(values, dims = ['time', 'point'], name = var,
+                        coords = {'time': times, 'file': ('time', paths),
+                                  'lat': ('point', lats), 'lon': ('point', lons)},
+                        attrs = {'method': method})
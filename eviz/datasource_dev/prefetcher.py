@@ -0,0 +1,291 @@
+"""
+The purpose of this file is to prefetch the next files of a date-sorted file list while a user steps or
+animates through it (e.g. day by day through OMI Level 3 files in iViz), so each frame comes from memory
+instead of a full synchronous read.
+
+    • Reads run in a background thread pool and land in a bounded in-memory LRU cache (DataCache)
+    • After each step the next k files in the stepping direction are queued; k adapts to the observed read
+      latency and step interval (enough reads in flight to cover one read), limited by max_depth and by
+      the cache size
+    • Jumping elsewhere cancels queued reads that are no longer ahead (a read already running finishes and
+      is cached)
+    • Cache entries are keyed by the read (DatasourceSpec) and the file modification time
+
+Usage:
+    frames = Prefetcher(sorted(glob.glob('OMI/*.he5')), 'ColumnAmountO3')
+    data = frames.get(0)
+    data = frames.step()      # the next file, usually already in memory
+    data = frames.get(200)    # a jump: reads 200, cancels what was queued, prefetches 201, 202, ...
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from datasource_spec import DatasourceSpec
+import async_executor
+
+CACHE_BYTES = 512 * 1024 * 1024
+
+# Weight of the newest observation in the moving averages of read latency and step interval
+SMOOTHING = 0.3
+
+
+class DataCache:
+    """
+    Bounded (by bytes), thread-safe LRU cache of read data.
+    """
+
+    # I. Constructor
+    def __init__(self, max_bytes = CACHE_BYTES):
+        """
+        Creates an empty cache
+        :param max_bytes: the maximum total size of the cached data in bytes
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()   # key -> (data, nbytes)
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        """
+        Returns cache info
+        :return: a String
+        """
+        return f'DataCache({len(self)} entries; {self.nbytes} / {self.max_bytes} bytes)'
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    # II. Top-Level Methods
+    def get(self, key):
+        """
+        Returns cached data and marks it as recently used
+        :param key: a hashable key
+        :return: the data or 'None'
+        """
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, data):
+        """
+        Caches data, evicting the least recently used entries to make room (data larger than the cache
+        isn't cached)
+        :param key: a hashable key
+        :param data: an XArray DataArray/Dataset or NumPy array (or 'None', which isn't cached)
+        """
+        nbytes = getattr(data, 'nbytes', 0)
+        if data is None or nbytes > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            while self.entries and self.nbytes + nbytes > self.max_bytes:
+                self.nbytes -= self.entries.popitem(last = False)[1][1]
+            self.entries[key] = (data, nbytes)
+            self.nbytes += nbytes
+
+    def clear(self):
+        """
+        Removes every entry
+        """
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+class Prefetcher:
+    """
+    Steps through an ordered file list, reading ahead in the background.
+    """
+
+    # I. Constructor
+    def __init__(self, paths, var = None, window = None, depth = 2, max_depth = 8, cache = None, workers = 1,
+                 **options):
+        """
+        Creates a prefetcher over a file list (nothing is read until the first get)
+        :param paths: a Python list of path Strings in stepping order (e.g. sorted by date)
+        :param var: a data variable String, a tuple/list of Strings, or 'None' for every variable
+        :param window: a tuple of (row, column) slices or 'None' for the whole grid
+        :param depth: the number of files read ahead until read latency and step interval are known
+        :param max_depth: the maximum number of files read ahead
+        :param cache: a DataCache object (e.g. shared by several prefetchers) or 'None' for a new one
+        :param workers: the number of background reader threads
+        :param options: Datasource keyword arguments (see datasource_spec.OPTIONS)
+        """
+        self.specs = [DatasourceSpec(path, var, window, **options) for path in paths]
+        self.depth = max(1, depth)
+        self.max_depth = max(1, max_depth)
+        self.cache = cache if cache is not None else DataCache()
+
+        self.pool = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'eviz-prefetch')
+        self.pending = {}   # index -> Future of a queued or running read
+        self.lock = threading.Lock()
+
+        self.position = None
+        self.direction = 1
+        self.last_step = None
+        self.latency = None   # moving average of read seconds
+        self.interval = None   # moving average of seconds between single steps
+        self.item_bytes = None   # moving average of read sizes
+
+        self.stats = {'hits': 0, 'waits': 0, 'misses': 0, 'prefetched': 0, 'cancelled': 0}
+
+    def __repr__(self):
+        """
+        Returns prefetcher info
+        :return: a String
+        """
+        return (f'Prefetcher({len(self)} files; position {self.position}; depth {self.get_depth()}; '
+                f'{self.stats})')
+
+    def __len__(self):
+        return len(self.specs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Cancels queued reads and stops the background threads (running reads finish)
+        """
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+        self.pool.shutdown(wait = False, cancel_futures = True)
+
+    # II. Accessor & Helper Methods
+    def get_key(self, i):
+        """
+        Returns the cache key of a file (a changed file gets a new key)
+        :param i: a file index
+        :return: a tuple of (DatasourceSpec, modification time)
+        """
+        spec = self.specs[i]
+        return spec, os.path.getmtime(spec.filename)
+
+    def average(self, current, value):
+        """
+        Returns an exponential moving average updated with a new observation
+        """
+        return value if current is None else (1 - SMOOTHING) * current + SMOOTHING * value
+
+    def get_depth(self):
+        """
+        Returns the number of files to read ahead: enough reads to cover the read latency at the current
+        step rate, limited by max_depth and by half the cache
+        :return: an integer
+        """
+        depth = self.depth
+        if self.latency is not None and self.interval:
+            depth = math.ceil(self.latency / self.interval) + 1
+        if self.item_bytes:
+            depth = min(depth, int(self.cache.max_bytes / 2 // self.item_bytes))
+
+        return max(1, min(depth, self.max_depth))
+
+    def read(self, i):
+        """
+        Reads a file and caches its data (runs in the calling or a background thread)
+        :param i: a file index
+        :return: an XArray DataArray or Dataset, or 'None'
+        """
+        start = time.perf_counter()
+        data = self.specs[i].read()
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            self.latency = self.average(self.latency, elapsed)
+            if data is not None:
+                self.item_bytes = self.average(self.item_bytes, data.nbytes)
+
+        self.cache.put(self.get_key(i), data)
+        return data
+
+    def schedule(self, i):
+        """
+        Queues reads of the files ahead of a position and cancels queued reads that aren't ahead anymore
+        :param i: the current file index
+        """
+        depth = self.get_depth()
+        ahead = [j for j in (i + self.direction * k for k in range(1, depth + 1)) if 0 <= j < len(self)]
+
+        with self.lock:
+            for j, future in list(self.pending.items()):
+                if future.done():
+                    del self.pending[j]
+                elif j not in ahead and future.cancel():   # Fails (and the read finishes) if already running
+                    del self.pending[j]
+                    self.stats['cancelled'] += 1
+
+            for j in ahead:
+                if j not in self.pending and self.get_key(j) not in self.cache:
+                    self.pending[j] = self.pool.submit(self.read, j)
+                    self.stats['prefetched'] += 1
+
+    # III. Top-Level Methods
+    def get(self, i):
+        """
+        Returns the data of a file, from memory if it was prefetched, then queues the files ahead of it
+        :param i: a file index
+        :return: an XArray DataArray or Dataset, or 'None'
+        """
+        if not 0 <= i < len(self):
+            raise IndexError(f'file index {i} out of range for {len(self)} files')
+
+        now = time.perf_counter()
+        with self.lock:
+            if self.position is not None and i != self.position:
+                if abs(i - self.position) == 1:   # Only single steps measure the stepping rate
+                    self.interval = self.average(self.interval, now - self.last_step)
+                self.direction = 1 if i > self.position else -1
+            self.position = i
+            self.last_step = now
+            future = self.pending.pop(i, None)
+
+        data = self.cache.get(self.get_key(i))
+        if data is not None:
+            self.stats['hits'] += 1
+            if future is not None:
+                future.cancel()
+        elif future is not None and not future.cancel():   # Already being read: waits for it
+            self.stats['waits'] += 1
+            data = future.result()
+        else:
+            self.stats['misses'] += 1
+            data = self.read(i)
+
+        self.schedule(i)
+        return data
+
+    def step(self, delta = 1):
+        """
+        Returns the data of the file delta steps from the current one
+        :param delta: a number of files (negative steps backwards)
+        :return: an XArray DataArray or Dataset, or 'None'
+        """
+        return self.get((self.position if self.position is not None else -delta) + delta)
+
+    async def aget(self, i):
+        """
+        Returns the data of a file without blocking the event loop (see get)
+        :param i: a file index
+        :return: an XArray DataArray or Dataset, or 'None'
+        """
+        return await async_executor.run_blocking(self.specs[i].filename, self.get, i)
@@ -0,0 +1,85 @@
+"""
+The purpose of this file is to define the ReaderStats class, a per-stage timing and memory record kept by
+the OMI and Landsat readers.
+
+Stages:
+    • open     -> opening the file identifier (bytes: file size on disk)
+    • attrs    -> parsing attributes into Python data types (bytes: raw attribute values)
+    • coords   -> constructing coordinates from attributes already parsed (bytes: coordinate arrays)
+    • read     -> raw dataset reads, ds[()] / ds.get() (bytes: raw array)
+    • restore  -> fill/scale/offset restoration (bytes: restored array)
+    • assemble -> building XArray DataArrays and Datasets (bytes: data array)
+"""
+
+import time
+
+
+class ReaderStats:
+    """
+    Accumulates the number of calls, seconds and bytes spent in each reading stage of a reader and
+    optionally forwards every measurement to a callback (e.g. for shipping to a metrics system).
+    """
+
+    STAGES = ('open', 'attrs', 'coords', 'read', 'restore', 'assemble')
+
+    def __init__(self, filename = None, callback = None):
+        """
+        Creates an empty stats record
+        :param filename: the full path String of the file being read
+        :param callback: a function called with a Python dictionary (file, stage, seconds, bytes) for
+                         every measurement, or 'None'
+        """
+        self.fn = filename
+        self.callback = callback
+        self.stages = {}
+        self.reset()
+
+    def __repr__(self):
+        """
+        Returns a table of the stats record
+        :return: a String
+        """
+        lines = [f'{"stage":<10}{"calls":>7}{"ms":>12}{"MB":>12}']
+        for stage, rec in self.stages.items():
+            lines.append(f'{stage:<10}{rec["calls"]:>7}{rec["seconds"] * 1e3:>12.3f}{rec["bytes"] / 1e6:>12.3f}')
+        return '\n'.join(lines)
+
+    def reset(self):
+        """
+        Clears all recorded measurements
+        """
+        self.stages = {stage: {'calls': 0, 'seconds': 0.0, 'bytes': 0} for stage in self.STAGES}
+
+    def record(self, stage, start, nbytes = 0):
+        """
+        Records one measurement of a stage
+        :param stage: a stage name String
+        :param start: the time.perf_counter() value at which the stage started
+        :param nbytes: the number of bytes handled by the stage
+        :return: the elapsed time in seconds
+        """
+        seconds = time.perf_counter() - start
+
+        rec = self.stages.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'bytes': 0})
+        rec['calls'] += 1
+        rec['seconds'] += seconds
+        rec['bytes'] += int(nbytes)
+
+        if self.callback is not None:
+            self.callback({'file': self.fn, 'stage': stage, 'seconds': seconds, 'bytes': int(nbytes)})
+
+        return seconds
+
+    def total(self):
+        """
+        Returns the total time over all stages
+        :return: a float of seconds
+        """
+        return sum(rec['seconds'] for rec in self.stages.values())
+
+    def as_dict(self):
+        """
+        Returns a copy of the stats record
+        :return: a Python dictionary of stage name String keys and dictionary values
+        """
+        return {stage: dict(rec) for stage, rec in self.stages.items()}
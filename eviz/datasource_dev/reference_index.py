@@ -0,0 +1,287 @@
+"""
+The purpose of this file is to build kerchunk-style reference indices of OMI HE5 files: JSON documents mapping
+each HDFEOS grid variable to the byte ranges of its chunks (Zarr v2 metadata + [url, offset, length] per chunk),
+so a Zarr reader can open the original files with parallel byte-range reads and no h5py handle.
+
+Reference layout (version 1):
+    .zgroup, .zattrs                  -> group metadata & file attributes (get_fid_attrs)
+    time, lat, lon                    -> inline coordinates (time in days since 1970-01-01)
+    <variable>/.zarray, .zattrs       -> shape (time, lat, lon), chunks, codecs & CF attributes (get_ds_attrs)
+    <variable>/<t>.<i>.<j>            -> [url, offset, length] of an HDF5 chunk (never written chunks are left out
+                                         and read as the fill value)
+
+    • Supported storage: contiguous, or chunked with any combination of deflate (zlib) and shuffle
+    • Indices of many files on the same grid combine along time into one virtual dataset (combine_references)
+
+Opening an index (needs fsspec):
+    xr.open_dataset('reference://', engine = 'zarr',
+                    backend_kwargs = {'consolidated': False, 'storage_options': {'fo': 'omi_refs.json'}})
+
+Usage:
+    python reference_index.py INPUT [INPUT ...] [--outdir DIR] [--combined FILE] [--url-prefix PREFIX]
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import os
+import json
+import base64
+import logging
+
+import numpy as np
+from h5py import h5z
+
+from omi_reader import OMIReader
+
+log = logging.getLogger(__name__)
+
+# HE5 attribute name -> CF attribute name
+CF_NAMES = {'ScaleFactor': 'scale_factor', 'Offset': 'add_offset', 'Units': 'units', 'Title': 'long_name',
+            'MissingValue': 'missing_value', 'ValidRange': 'valid_range', '_FillValue': '_FillValue'}
+
+CODECS = {h5z.FILTER_DEFLATE: 'zlib', h5z.FILTER_SHUFFLE: 'shuffle'}
+
+
+# II. HELPER FUNCTIONS - - - - - - -
+def jsonable(value):
+    """
+    Converts an attribute value into a JSON-compatible value
+    :param value: an attribute value (Python or NumPy)
+    :return: a JSON-compatible value
+    """
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [jsonable(v) for v in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return str(value)   # 'nan'/'inf' (not valid JSON numbers)
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def cf_attrs(ds_attrs):
+    """
+    Translates HE5 dataset attributes into CF attributes (other attributes are kept under their own name)
+    :param ds_attrs: a Python dictionary of dataset attributes (see OMIReader.get_ds_attrs)
+    :return: a Python dictionary of JSON-compatible attributes
+    """
+    attrs = {}
+    for key, value in ds_attrs.items():
+        attrs[CF_NAMES.get(key, key)] = jsonable(value)
+
+    if attrs.get('scale_factor') == 1 and attrs.get('add_offset', 0) == 0:   # Nothing to undo
+        attrs.pop('scale_factor')
+        attrs.pop('add_offset', None)
+    return attrs
+
+
+def inline(values):
+    """
+    Returns an inline (base64) reference of an uncompressed array chunk
+    :param values: a NumPy array
+    :return: a String
+    """
+    return 'base64:' + base64.b64encode(np.ascontiguousarray(values).tobytes()).decode('ascii')
+
+
+def zarray(shape, chunks, dtype, fill, compressor = None, filters = None):
+    """
+    Returns Zarr v2 array metadata
+    :return: a JSON String
+    """
+    fill = jsonable(fill)
+    if isinstance(fill, str):
+        fill = fill.capitalize().replace('Inf', 'Infinity')   # Zarr v2 spells them 'NaN', 'Infinity'
+    return json.dumps({'zarr_format': 2, 'shape': list(shape), 'chunks': list(chunks), 'dtype': dtype.str,
+                       'fill_value': fill, 'order': 'C', 'compressor': compressor, 'filters': filters})
+
+
+def add_coord(refs, name, values, attrs):
+    """
+    Adds an inline 1D coordinate
+    :param refs: a Python dictionary of references
+    :param name: the coordinate name String
+    :param values: a 1D NumPy array
+    :param attrs: a Python dictionary of attributes
+    """
+    refs[f'{name}/.zarray'] = zarray(values.shape, values.shape, values.dtype, None)
+    refs[f'{name}/.zattrs'] = json.dumps(dict(attrs, _ARRAY_DIMENSIONS = [name]))
+    refs[f'{name}/0'] = inline(values)
+
+
+def dataset_refs(ds, name, url, attrs):
+    """
+    Returns the references of one 2D HDF5 dataset, with a leading time dimension of 1
+    :param ds: an h5py Dataset object
+    :param name: the variable name String
+    :param url: the file URL/path String written into the references
+    :param attrs: a Python dictionary of JSON-compatible attributes
+    :return: a Python dictionary of references, or 'None' if the storage isn't supported
+    """
+    refs = {}
+    plist = ds.id.get_create_plist()
+    filters = [plist.get_filter(i) for i in range(plist.get_nfilters())]
+
+    if any(f[0] not in CODECS for f in filters):
+        log.warning(f"SKIPPING '{name}': UNSUPPORTED HDF5 FILTERS {[f[3] for f in filters]}")
+        return None
+
+    compressor = None
+    codecs = []
+    for f in filters:   # HDF5 lists filters in the order they were applied when writing
+        if f[0] == h5z.FILTER_DEFLATE:
+            compressor = {'id': 'zlib', 'level': int(f[2][0]) if f[2] else 6}
+        elif compressor is not None:   # Zarr only applies filters before the compressor
+            log.warning(f"SKIPPING '{name}': FILTER AFTER COMPRESSION")
+            return None
+        else:
+            codecs.append({'id': 'shuffle', 'elementsize': ds.dtype.itemsize})
+
+    if ds.chunks is None:
+        chunks = ds.shape
+        stored = [((0,) * ds.ndim, ds.id.get_offset(), ds.id.get_storage_size(), 0)]
+    else:
+        chunks = ds.chunks
+        stored = []
+        for i in range(ds.id.get_num_chunks()):
+            info = ds.id.get_chunk_info(i)
+            stored.append((info.chunk_offset, info.byte_offset, info.size, info.filter_mask))
+
+    # Zarr readers treat the array fill value as another _FillValue, so it must be the same one
+    fill = attrs.get('_FillValue', ds.fillvalue)
+    refs[f'{name}/.zarray'] = zarray((1,) + ds.shape, (1,) + chunks, ds.dtype, fill, compressor, codecs or None)
+    refs[f'{name}/.zattrs'] = json.dumps(dict(attrs, _ARRAY_DIMENSIONS = ['time', 'lat', 'lon']))
+
+    for offset, byte_offset, size, mask in stored:
+        if mask:
+            log.warning(f"SKIPPING '{name}': CHUNK {offset} SKIPPED A FILTER")
+            return None
+        if byte_offset is None:   # Contiguous storage that was never written
+            continue
+        key = '.'.join(['0'] + [str(o // c) for o, c in zip(offset, chunks)])
+        refs[f'{name}/{key}'] = [url, int(byte_offset), int(size)]
+
+    return refs
+
+
+# III. TOP-LEVEL FUNCTIONS - - - - - - -
+def make_references(filename, url = None):
+    """
+    Builds the reference index of one OMI HE5 file
+    :param filename: a full path String
+    :param url: the URL/path String written into the references or 'None' for the absolute file path
+    :return: a Python dictionary (kerchunk version 1 references)
+    """
+    reader = OMIReader(filename, load = False, pooled = False)
+    url = url or os.path.abspath(filename)
+
+    fid = reader.get_fid()
+    try:
+        data_group = reader.get_data_group(fid)
+        coords = reader.get_coords(fid)
+        fid_attrs = reader.get_fid_attrs(fid)
+
+        refs = {'.zgroup': json.dumps({'zarr_format': 2}),
+                '.zattrs': json.dumps({key: jsonable(value) for key, value in fid_attrs.items()})}
+
+        days = [(np.datetime64(t, 'D') - np.datetime64('1970-01-01', 'D')).astype('int64') for t in coords['times']]
+        add_coord(refs, 'time', np.array(days, dtype = '<i8'), {'units': 'days since 1970-01-01',
+                                                                 'calendar': 'standard'})
+        add_coord(refs, 'lat', coords['lats'].astype('<f8'), {'units': 'degrees_north'})
+        add_coord(refs, 'lon', coords['lons'].astype('<f8'), {'units': 'degrees_east'})
+
+        for name, ds in data_group.items():
+            if ds.shape != (coords['lats'].size, coords['lons'].size):
+                log.warning(f"SKIPPING '{name}' WITH SHAPE {ds.shape}")
+                continue
+            var_refs = dataset_refs(ds, name, url, cf_attrs(reader.get_ds_attrs(ds)))
+            if var_refs is not None:
+                refs.update(var_refs)
+    finally:
+        reader.close_fid(fid)
+
+    return {'version': 1, 'refs': refs}
+
+
+def combine_references(indices):
+    """
+    Combines the reference indices of files on the same grid (with the same chunks and codecs) into one index
+    along time (sorted by time)
+    :param indices: a Python list of reference dictionaries (see make_references)
+    :return: a Python dictionary (kerchunk version 1 references)
+    """
+    def first_time(index):
+        return np.frombuffer(base64.b64decode(index['refs']['time/0'][len('base64:'):]), dtype = '<i8')[0]
+
+    indices = sorted(indices, key = first_time)
+    base = indices[0]['refs']
+    variables = [key.split('/')[0] for key in base if key.endswith('/.zarray') and key.split('/')[0] not in
+                 ('time', 'lat', 'lon')]
+
+    refs = {'.zgroup': base['.zgroup'], '.zattrs': base['.zattrs']}
+    for name in ('lat', 'lon'):
+        for suffix in ('.zarray', '.zattrs', '0'):
+            refs[f'{name}/{suffix}'] = base[f'{name}/{suffix}']
+
+    times = []
+    for t, index in enumerate(indices):
+        other = index['refs']
+        if other['lat/0'] != base['lat/0'] or other['lon/0'] != base['lon/0']:
+            raise ValueError(f'index {t} is on another grid')
+        times.append(first_time(index))
+
+        for name in variables:
+            if f'{name}/.zarray' not in other:
+                continue   # Missing in this file: read as fill values
+            if other[f'{name}/.zarray'] != base[f'{name}/.zarray']:
+                raise ValueError(f"index {t} stores '{name}' with other chunks or codecs")
+            for key, value in other.items():
+                if key.startswith(name + '/') and key[len(name) + 1].isdigit():
+                    chunk = key[len(name) + 1:].split('.')
+                    refs[f'{name}/' + '.'.join([str(t)] + chunk[1:])] = value
+
+    for name in variables:
+        meta = json.loads(base[f'{name}/.zarray'])
+        meta['shape'][0] = len(indices)
+        refs[f'{name}/.zarray'] = json.dumps(meta)
+        refs[f'{name}/.zattrs'] = base[f'{name}/.zattrs']
+
+    add_coord(refs, 'time', np.array(times, dtype = '<i8'), json.loads(base['time/.zattrs']))
+    return {'version': 1, 'refs': refs}
+
+
+def write_references(index, path):
+    """
+    Writes a reference index as JSON
+    :param index: a Python dictionary of references
+    :param path: the output path String
+    """
+    with open(path, 'w') as f:
+        json.dump(index, f)
+
+
+if __name__ == "__main__":
+    import argparse
+    from eviz_convert import find_inputs
+
+    parser = argparse.ArgumentParser(description = 'Build kerchunk-style reference indices of OMI HE5 files')
+    parser.add_argument('inputs', nargs = '+', help = 'directories, glob patterns, or catalog files')
+    parser.add_argument('--outdir', default = None, help = 'directory for one <file>.json index per file')
+    parser.add_argument('--combined', default = None, help = 'path of one combined index')
+    parser.add_argument('--url-prefix', default = None, help = "URL prefix replacing each file's directory")
+    args = parser.parse_args()
+
+    indices = []
+    for fn in find_inputs(args.inputs):
+        if not fn.endswith('.he5'):
+            continue
+        url = args.url_prefix.rstrip('/') + '/' + os.path.basename(fn) if args.url_prefix else None
+        index = make_references(fn, url)
+        indices.append(index)
+        if args.outdir:
+            os.makedirs(args.outdir, exist_ok = True)
+            write_references(index, os.path.join(args.outdir, os.path.basename(fn) + '.json'))
+
+    if args.combined and indices:
+        write_references(combine_references(indices), args.combined)
+    print(f'{len(indices)} files indexed')
@@ -0,0 +1,181 @@
+"""
+The purpose of this file is to read data variables already aggregated to a screen's pixel grid (see
+Datasource.render_array), so plots and iViz maps get about as many values as they can show instead of a whole
+full-resolution float64 scene.
+
+    • The output grid covers a lat/lon bounding box with (up to) width x height pixels; it is never finer than
+      the data, so every output pixel aggregates at least one data pixel
+    • mean / min / max / mode read the window in bands of output rows (Datasource.read_into) and reduce each
+      band with np.bincount / ufunc.at over flat output pixel indices as it is read: only one band of data is
+      in memory
+    • nearest reads a strided window (every k-th row and column, the file formats' own subsampling) and keeps
+      the data pixel nearest each output pixel center, reading roughly one value per output pixel
+    • Output values are float32; mode is for categorical variables (integer values 0 - 255, e.g. cfmask)
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import numpy as np
+import xarray as xr
+
+AGGREGATIONS = ('mean', 'min', 'max', 'mode', 'nearest')
+
+BLOCK_ROWS = 512
+
+# The largest mode histogram of a band (output pixels x MODE_VALUES)
+MODE_CELLS = 2 ** 24
+MODE_VALUES = 256
+
+
+# II. HELPER FUNCTIONS - - - - - - -
+def get_window(coord, low, high):
+    """
+    Returns the index range of a monotonic coordinate within bounds
+    :param coord: a monotonic NumPy array
+    :param low: the lower bound or 'None'
+    :param high: the upper bound or 'None'
+    :return: a slice
+    """
+    inside = np.ones(coord.size, dtype = bool)
+    if low is not None:
+        inside &= coord >= low
+    if high is not None:
+        inside &= coord <= high
+
+    index = np.flatnonzero(inside)
+    if index.size == 0:
+        raise ValueError(f'no grid cells between {low} and {high}')
+    return slice(int(index[0]), int(index[-1]) + 1)
+
+
+def get_bins(size, nbins):
+    """
+    Returns the output pixel of each data pixel along one axis (equal shares of consecutive data pixels)
+    :param size: the number of data pixels
+    :param nbins: the number of output pixels (<= size)
+    :return: an int64 NumPy array
+    """
+    return np.arange(size) * nbins // size
+
+
+def bin_centers(coord, bins, nbins):
+    """
+    Returns the mean coordinate of the data pixels of each output pixel
+    :param coord: a NumPy array of data pixel coordinates
+    :param bins: the output pixel of each data pixel (see get_bins)
+    :param nbins: the number of output pixels
+    :return: a float64 NumPy array
+    """
+    return np.bincount(bins, weights = coord, minlength = nbins) / np.bincount(bins, minlength = nbins)
+
+
+def reduce_band(values, index, npixels, agg):
+    """
+    Aggregates one band of data to its output pixels
+    :param values: a floating-point NumPy array of restored data (NaN for missing)
+    :param index: an integer NumPy array of the same shape of flat output pixel indices within the band
+    :param npixels: the number of output pixels of the band
+    :param agg: 'mean', 'min', 'max' or 'mode'
+    :return: a float32 NumPy array of npixels values (NaN where no data)
+    """
+    valid = ~np.isnan(values)
+    index = index[valid]
+    values = values[valid]
+
+    if agg == 'mean':
+        count = np.bincount(index, minlength = npixels)
+        total = np.bincount(index, weights = values, minlength = npixels)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return np.where(count > 0, total / count, np.nan).astype('float32')
+
+    if agg == 'mode':
+        codes = values.astype('int64')
+        if codes.size and (codes.min() < 0 or codes.max() >= MODE_VALUES or np.any(codes != values)):
+            raise ValueError(f'mode needs categorical values (integers 0 - {MODE_VALUES - 1})')
+        counts = np.bincount(index * MODE_VALUES + codes, minlength = npixels * MODE_VALUES)
+        counts = counts.reshape(npixels, MODE_VALUES)
+        return np.where(counts.any(axis = 1), counts.argmax(axis = 1), np.nan).astype('float32')
+
+    fill = np.inf if agg == 'min' else -np.inf
+    result = np.full(npixels, fill, dtype = 'float32')
+    (np.minimum if agg == 'min' else np.maximum).at(result, index, values.astype('float32'))
+    result[result == fill] = np.nan
+    return result
+
+
+# III. TOP-LEVEL FUNCTIONS - - - - - - -
+def render(source, var, width, height, bbox = None, agg = 'mean', block_rows = BLOCK_ROWS):
+    """
+    Reads a data variable aggregated to an output pixel grid
+    :param source: a Datasource object
+    :param var: a data variable String
+    :param width: the number of output columns (at most the data columns in the bbox)
+    :param height: the number of output rows (at most the data rows in the bbox)
+    :param bbox: a tuple of (west, south, east, north) or 'None' for the whole grid
+    :param agg: how data pixels are aggregated (see AGGREGATIONS)
+    :param block_rows: about the number of data rows read at once
+    :return: an XArray DataArray (lat, lon) of float32, or 'None'
+    """
+    if agg not in AGGREGATIONS:
+        raise ValueError(f"agg must be one of {AGGREGATIONS}, not '{agg}'")
+
+    grid = source.get_grid(var)
+    if grid is None:
+        return None
+
+    row_dim, col_dim = grid['dims'][1:]
+    lats, lons = grid['coords'][row_dim], grid['coords'][col_dim]
+    west, south, east, north = bbox if bbox is not None else (None, None, None, None)
+    rows, cols = get_window(lats, south, north), get_window(lons, west, east)
+
+    nrows, ncols = rows.stop - rows.start, cols.stop - cols.start
+    height, width = max(1, min(height, nrows)), max(1, min(width, ncols))
+    row_bins, col_bins = get_bins(nrows, height), get_bins(ncols, width)
+
+    if agg == 'nearest':   # One strided read: every step-th row and column
+        row_step, col_step = max(1, nrows // height), max(1, ncols // width)
+        window = (slice(rows.start, rows.stop, row_step), slice(cols.start, cols.stop, col_step))
+        sampled = np.empty((len(range(rows.start, rows.stop, row_step)),
+                            len(range(cols.start, cols.stop, col_step))), dtype = 'float32')
+        if source.read_into(var, sampled, window) is None:
+            return None
+
+        # The sampled row (column) nearest the center of each output pixel
+        row_centers = (np.arange(height) + 0.5) * nrows / height - 0.5
+        col_centers = (np.arange(width) + 0.5) * ncols / width - 0.5
+        row_pick = np.clip(np.rint(row_centers / row_step), 0, sampled.shape[0] - 1).astype('int64')
+        col_pick = np.clip(np.rint(col_centers / col_step), 0, sampled.shape[1] - 1).astype('int64')
+        data = sampled[np.ix_(row_pick, col_pick)]
+        out_lats = lats[rows][row_pick * row_step]
+        out_lons = lons[cols][col_pick * col_step]
+    else:
+        # Bands of output rows holding about block_rows data rows (and a bounded mode histogram)
+        band_height = max(1, block_rows * height // nrows)
+        if agg == 'mode':
+            band_height = max(1, min(band_height, MODE_CELLS // (width * MODE_VALUES)))
+
+        data = np.empty((height, width), dtype = 'float32')
+        first_rows = np.searchsorted(row_bins, np.arange(height + 1))   # First data row of each output row
+        buffer = None
+
+        for top in range(0, height, band_height):
+            bottom = min(top + band_height, height)
+            start, stop = int(first_rows[top]), int(first_rows[bottom])
+
+            if buffer is None or buffer.shape[0] < stop - start:
+                buffer = np.empty((stop - start, ncols), dtype = 'float32')
+            band = buffer[:stop - start]
+            if source.read_into(var, band, (slice(rows.start + start, rows.start + stop), cols)) is None:
+                return None
+
+            index = (row_bins[start:stop, None] - top) * width + col_bins[None, :]
+            data[top:bottom] = reduce_band(band, index, (bottom - top) * width, agg).reshape(bottom - top, width)
+
+        out_lats = bin_centers(lats[rows], row_bins, height)
+        out_lons = bin_centers(lons[cols], col_bins, width)
+
+    attrs = dict(grid['attrs'], render_agg = agg, render_source_shape = [nrows, ncols])
+    coords = {row_dim: out_lats, col_dim: out_lons}
+    if grid['dims'][0] in grid['coords']:
+        coords[grid['dims'][0]] = grid['coords'][grid['dims'][0]][0]   # The time of the file (a scalar)
+
+    return xr.DataArray(data, dims = (row_dim, col_dim), coords = coords, name = var, attrs = attrs)
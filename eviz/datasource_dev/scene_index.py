@@ -0,0 +1,303 @@
+"""
+The purpose of this file is to define the SceneIndex class, a SQLite catalog of Landsat scenes with an R*Tree
+index of their footprints, so "which scenes intersect this polygon/bbox between these dates" is answered
+without opening any HDF file.
+
+Tables:
+    scenes     -> path, filename metadata (see filename_meta.py), acquisition date, bounding coordinates, mtime
+    footprints -> R*Tree of scene bounding boxes (min/max lon, min/max lat); a scene crossing the antimeridian
+                  (west > east) is stored as two boxes
+
+    • Footprints come from the bounding coordinate attributes (LandsatReader.get_coord_bounds), so each scene
+      is opened once, when it is added; re-adding an unchanged file is skipped
+    • Queries first select candidates from the R*Tree by bounding box, then test polygons exactly
+
+Usage:
+    python scene_index.py INDEX add INPUT [INPUT ...]
+    python scene_index.py INDEX query [--bbox WEST SOUTH EAST NORTH] [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+                                      [--wrs-path N] [--wrs-row N]
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import os
+import sqlite3
+import logging
+
+from landsat_reader import LandsatReader
+import filename_meta
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    sensor TEXT, satellite INTEGER, wrs_path INTEGER, wrs_row INTEGER, station TEXT, version TEXT,
+    date TEXT NOT NULL,
+    north REAL, south REAL, east REAL, west REAL,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS scenes_date ON scenes (date);
+CREATE VIRTUAL TABLE IF NOT EXISTS footprints USING rtree (id, min_lon, max_lon, min_lat, max_lat, +scene_id);
+"""
+
+
+# II. GEOMETRY HELPERS - - - - - - -
+def point_in_polygon(x, y, polygon):
+    """
+    Determines if a point is inside a polygon (even-odd rule)
+    :param x: a longitude float
+    :param y: a latitude float
+    :param polygon: a Python list of (lon, lat) vertex tuples
+    :return: Boolean
+    """
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        xi, yi = polygon[i]
+        xj, yj = polygon[j]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def segments_cross(p1, p2, q1, q2):
+    """
+    Determines if two line segments intersect
+    :param p1, p2: (x, y) end points of the first segment
+    :param q1, q2: (x, y) end points of the second segment
+    :return: Boolean
+    """
+    def orient(a, b, c):
+        value = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+        return (value > 0) - (value < 0)
+
+    def on_segment(a, b, c):
+        return min(a[0], b[0]) <= c[0] <= max(a[0], b[0]) and min(a[1], b[1]) <= c[1] <= max(a[1], b[1])
+
+    o1, o2, o3, o4 = orient(p1, p2, q1), orient(p1, p2, q2), orient(q1, q2, p1), orient(q1, q2, p2)
+    if o1 != o2 and o3 != o4:
+        return True
+    return ((o1 == 0 and on_segment(p1, p2, q1)) or (o2 == 0 and on_segment(p1, p2, q2)) or
+            (o3 == 0 and on_segment(q1, q2, p1)) or (o4 == 0 and on_segment(q1, q2, p2)))
+
+
+def box_intersects_polygon(box, polygon):
+    """
+    Determines if a bounding box and a polygon intersect
+    :param box: a tuple of (west, south, east, north)
+    :param polygon: a Python list of (lon, lat) vertex tuples
+    :return: Boolean
+    """
+    west, south, east, north = box
+    corners = [(west, south), (east, south), (east, north), (west, north)]
+
+    if any(west <= x <= east and south <= y <= north for x, y in polygon):
+        return True
+    if any(point_in_polygon(x, y, polygon) for x, y in corners):
+        return True
+
+    edges = list(zip(polygon, polygon[1:] + polygon[:1]))
+    sides = list(zip(corners, corners[1:] + corners[:1]))
+    return any(segments_cross(p1, p2, q1, q2) for p1, p2 in edges for q1, q2 in sides)
+
+
+def split_box(west, south, east, north):
+    """
+    Splits a bounding box crossing the antimeridian (west > east) into two boxes
+    :return: a Python list of (west, south, east, north) tuples
+    """
+    if west <= east:
+        return [(west, south, east, north)]
+    return [(west, south, 180.0, north), (-180.0, south, east, north)]
+
+
+class SceneIndex:
+    """
+    SQLite catalog of Landsat scenes with an R*Tree index of their footprints.
+    """
+
+    # I. Constructor
+    def __init__(self, path):
+        """
+        Opens (or creates) a scene index
+        :param path: the SQLite database path String (or ':memory:')
+        """
+        self.path = path
+        self.log = logging.getLogger(__name__)
+
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def __repr__(self):
+        """
+        Returns index info
+        :return: a String
+        """
+        return f'SceneIndex({self.path}; {len(self)} scenes)'
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM scenes').fetchone()[0]
+
+    def close(self):
+        """
+        Closes the database
+        """
+        self.db.close()
+
+    # II. Accessor & Helper Methods
+    def read_bounds(self, filename):
+        """
+        Reads the bounding coordinates of a Landsat scene
+        :param filename: a full path String
+        :return: a Python dictionary (latN, latS, lonE, lonW)
+        """
+        reader = LandsatReader(filename, load = False, pooled = False)
+        fid = reader.get_fid()
+        try:
+            return reader.get_coord_bounds(fid)
+        finally:
+            reader.close_fid(fid)
+
+    # III. Top-Level Methods
+    def add(self, filenames):
+        """
+        Adds (or updates) Landsat scenes; files that aren't Landsat scenes or are unchanged are skipped
+        :param filenames: a Python list of path Strings
+        :return: the number of scenes added or updated
+        """
+        added = 0
+
+        for fn in filenames:
+            fn = os.path.abspath(fn)
+            meta = filename_meta.parse_landsat(fn)
+            if meta is None:
+                self.log.warning(f'SKIPPING NON-LANDSAT FILE {fn}')
+                continue
+
+            mtime = os.stat(fn).st_mtime
+            row = self.db.execute('SELECT id, mtime FROM scenes WHERE path = ?', (fn,)).fetchone()
+            if row is not None and row['mtime'] == mtime:
+                continue
+
+            try:
+                bounds = self.read_bounds(fn)
+            except Exception:
+                self.log.error(f'COULD NOT READ BOUNDS OF {fn}', exc_info = True)
+                continue
+
+            with self.db:
+                if row is not None:
+                    self.db.execute('DELETE FROM footprints WHERE scene_id = ?', (row['id'],))
+                    self.db.execute('DELETE FROM scenes WHERE id = ?', (row['id'],))
+
+                scene_id = self.db.execute(
+                    'INSERT INTO scenes (path, sensor, satellite, wrs_path, wrs_row, station, version, date, '
+                    'north, south, east, west, mtime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (fn, meta['sensor'], meta['satellite'], meta['path'], meta['row'], meta['station'],
+                     meta['version'], meta['date'].isoformat(), bounds['latN'], bounds['latS'], bounds['lonE'],
+                     bounds['lonW'], mtime)).lastrowid
+
+                for west, south, east, north in split_box(bounds['lonW'], bounds['latS'], bounds['lonE'],
+                                                          bounds['latN']):
+                    self.db.execute('INSERT INTO footprints (min_lon, max_lon, min_lat, max_lat, scene_id) '
+                                    'VALUES (?, ?, ?, ?, ?)', (west, east, south, north, scene_id))
+            added += 1
+
+        return added
+
+    def remove_missing(self):
+        """
+        Removes scenes whose files no longer exist
+        :return: the number of scenes removed
+        """
+        missing = [row['id'] for row in self.db.execute('SELECT id, path FROM scenes')
+                   if not os.path.exists(row['path'])]
+        with self.db:
+            for scene_id in missing:
+                self.db.execute('DELETE FROM footprints WHERE scene_id = ?', (scene_id,))
+                self.db.execute('DELETE FROM scenes WHERE id = ?', (scene_id,))
+        return len(missing)
+
+    def query(self, bbox = None, polygon = None, start = None, end = None, wrs_path = None, wrs_row = None):
+        """
+        Returns the scenes intersecting an area between two dates
+        :param bbox: a tuple of (west, south, east, north) or 'None'
+        :param polygon: a Python list of (lon, lat) vertex tuples or 'None'
+        :param start: the first date (datetime.date or 'YYYY-MM-DD' String) or 'None'
+        :param end: the last date (inclusive) or 'None'
+        :param wrs_path: a WRS path number or 'None'
+        :param wrs_row: a WRS row number or 'None'
+        :return: a Python list of scene dictionaries sorted by date
+        """
+        sql = 'SELECT DISTINCT s.* FROM scenes s'
+        where = []
+        args = []
+
+        if polygon is not None:   # The R*Tree selects candidates by the polygon's bounding box
+            polygon = list(polygon)
+            xs = [x for x, _ in polygon]
+            ys = [y for _, y in polygon]
+            boxes = [(min(xs), min(ys), max(xs), max(ys))]
+        elif bbox is not None:
+            boxes = split_box(*bbox)
+        else:
+            boxes = []
+
+        if boxes:
+            sql += ' JOIN footprints f ON f.scene_id = s.id'
+            where.append('(' + ' OR '.join(['(f.max_lon >= ? AND f.min_lon <= ? AND f.max_lat >= ? AND '
+                                            'f.min_lat <= ?)'] * len(boxes)) + ')')
+            for west, south, east, north in boxes:
+                args += [west, east, south, north]
+
+        for column, op, value in (('date', '>=', start), ('date', '<=', end),
+                                  ('wrs_path', '=', wrs_path), ('wrs_row', '=', wrs_row)):
+            if value is not None:
+                where.append(f's.{column} {op} ?')
+                args.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY s.date, s.path'
+
+        scenes = [dict(row) for row in self.db.execute(sql, args)]
+
+        if polygon is not None:   # Exact tests of the R*Tree candidates
+            tests = [lambda box: box_intersects_polygon(box, polygon)]
+            if bbox is not None:
+                tests.append(lambda box: any(box[0] <= east and box[2] >= west and box[1] <= north and
+                                             box[3] >= south for west, south, east, north in split_box(*bbox)))
+            scenes = [scene for scene in scenes
+                      if all(any(test(box) for box in split_box(scene['west'], scene['south'], scene['east'],
+                                                                 scene['north'])) for test in tests)]
+
+        return scenes
+
+
+if __name__ == "__main__":
+    import argparse
+    from eviz_convert import find_inputs
+
+    parser = argparse.ArgumentParser(description = 'Index Landsat scene footprints and query them')
+    parser.add_argument('index')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    add = commands.add_parser('add')
+    add.add_argument('inputs', nargs = '+', help = 'directories, glob patterns, or catalog files')
+
+    query = commands.add_parser('query')
+    query.add_argument('--bbox', type = float, nargs = 4, default = None, metavar = ('WEST', 'SOUTH', 'EAST', 'NORTH'))
+    query.add_argument('--start', default = None)
+    query.add_argument('--end', default = None)
+    query.add_argument('--wrs-path', type = int, default = None)
+    query.add_argument('--wrs-row', type = int, default = None)
+    args = parser.parse_args()
+
+    index = SceneIndex(args.index)
+    if args.command == 'add':
+        print(f'{index.add(find_inputs(args.inputs))} scenes added; {index}')
+    else:
+        for scene in index.query(args.bbox, None, args.start, args.end, args.wrs_path, args.wrs_row):
+            print(scene['date'], scene['path'])
+    index.close()
@@ -0,0 +1,279 @@
+"""
+The purpose of this file is to bin OMI Level 2 swath pixels onto a regular latitude/longitude grid, e.g. to
+make custom-resolution daily maps from the orbits of a day.
+
+    • Each pixel goes to the grid cell holding its center (no footprint overlap)
+    • Orbits are streamed in blocks of scanlines (read_swath_fields), and each block is accumulated with
+      np.bincount over flat cell indices: no per-pixel Python loops
+    • Orbits are binned in parallel by a process pool; each worker returns one accumulation for its orbits
+
+Statistics per cell:
+    mean   -> the weighted mean sum(w * value) / sum(w)
+    count  -> the number of pixels binned
+    weight -> the sum of pixel weights
+
+Pixel weights (all 1 by default) come from quality flags, a weight variable, or both (multiplied):
+    qa_var, qa_mask  -> pixels whose flags have any bit of qa_mask set are dropped
+                        (e.g. qa_mask = 0b1111 drops every OMTO3 pixel with a non-zero quality code)
+    qa_weights       -> instead weights pixels by their (flags & qa_mask) code, e.g. {0: 1.0, 1: 0.5};
+                        codes that aren't listed are dropped
+    weight_var       -> a variable whose (restored) values are the weights
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import os
+import functools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+from omi_reader import OMIReader
+
+log = logging.getLogger(__name__)
+
+BLOCK_SCANLINES = 256
+
+
+# II. HELPER FUNCTIONS - - - - - - -
+def make_grid(resolution = 0.25, bbox = (-180.0, -90.0, 180.0, 90.0)):
+    """
+    Returns a regular latitude/longitude grid
+    :param resolution: the cell size in degrees (a float, or a tuple of (latitude, longitude) sizes)
+    :param bbox: a tuple of (west, south, east, north); west > east crosses the antimeridian
+    :return: a Python dictionary (bbox, resolution, lats & lons of cell centers, shape)
+    """
+    dlat, dlon = resolution if isinstance(resolution, (tuple, list)) else (resolution, resolution)
+    west, south, east, north = bbox
+
+    width = (east - west) % 360.0 or 360.0   # West > east crosses the antimeridian
+    nlat = int(round((north - south) / dlat))
+    nlon = int(round(width / dlon))
+    if nlat < 1 or nlon < 1:
+        raise ValueError(f'empty grid for bbox {bbox} at resolution {resolution}')
+
+    return {'bbox': (west, south, east, north), 'resolution': (dlat, dlon),
+            'lats': south + dlat * (np.arange(nlat) + 0.5),
+            'lons': (west + dlon * (np.arange(nlon) + 0.5) + 180.0) % 360.0 - 180.0,
+            'shape': (nlat, nlon)}
+
+
+def new_accumulator(grid):
+    """
+    Returns empty per-cell sums of a grid
+    :param grid: a Python dictionary (see make_grid)
+    :return: a Python dictionary of flat NumPy arrays (sum, weight, count)
+    """
+    size = grid['shape'][0] * grid['shape'][1]
+    return {'sum': np.zeros(size), 'weight': np.zeros(size), 'count': np.zeros(size, dtype = 'int64')}
+
+
+def merge(acc, other):
+    """
+    Adds one accumulation to another
+    :param acc: a Python dictionary of flat NumPy arrays (see new_accumulator), updated in place
+    :param other: a Python dictionary of flat NumPy arrays
+    :return: acc
+    """
+    for key in acc:
+        acc[key] += other[key]
+    return acc
+
+
+def cell_index(lat, lon, grid):
+    """
+    Returns the flat grid cell index of each pixel center
+    :param lat: a NumPy array of pixel latitudes
+    :param lon: a NumPy array of pixel longitudes
+    :param grid: a Python dictionary (see make_grid)
+    :return: a tuple of a flat integer NumPy array of cell indices and a Boolean NumPy array (inside the grid)
+    """
+    west, south, east, north = grid['bbox']
+    dlat, dlon = grid['resolution']
+    nlat, nlon = grid['shape']
+
+    lon = (lon - west) % 360.0   # Longitudes east of the grid's west edge, across the antimeridian
+    row = np.floor((lat - south) / dlat)
+    col = np.floor(lon / dlon)
+
+    valid = (row >= 0) & (row < nlat) & (col >= 0) & (col < nlon)   # NaN coordinates compare False
+    index = np.where(valid, row * nlon + col, 0).astype('int64')
+    return index, valid
+
+
+def get_weights(fields, qa_var = None, qa_mask = None, qa_weights = None, weight_var = None):
+    """
+    Returns the weight of each pixel (0 drops it)
+    :param fields: a Python dictionary of field name String keys and NumPy array values
+    :param qa_var: a quality flag variable String or 'None'
+    :param qa_mask: an integer bit mask of the quality flags or 'None' for all bits
+    :param qa_weights: a Python dictionary of quality code keys and weight values or 'None'
+    :param weight_var: a weight variable String or 'None'
+    :return: a float64 NumPy array
+    """
+    weights = np.ones(next(iter(fields.values())).shape[:2])
+
+    if qa_var is not None:
+        codes = fields[qa_var].astype('int64')
+        if qa_mask is not None:
+            codes &= qa_mask
+
+        if qa_weights is None:
+            weights[codes != 0] = 0
+        else:
+            table = np.zeros(max(max(qa_weights), int(codes.max(initial = 0))) + 1)
+            for code, weight in qa_weights.items():
+                table[code] = weight
+            weights *= table[codes]
+
+    if weight_var is not None:
+        weights *= np.nan_to_num(fields[weight_var], nan = 0.0)
+
+    return weights
+
+
+def accumulate(acc, grid, values, lat, lon, weights):
+    """
+    Adds the pixels of one block of scanlines to the per-cell sums
+    :param acc: a Python dictionary of flat NumPy arrays (see new_accumulator), updated in place
+    :param grid: a Python dictionary (see make_grid)
+    :param values: a NumPy array of restored pixel values (NaN for missing)
+    :param lat: a NumPy array of pixel latitudes
+    :param lon: a NumPy array of pixel longitudes
+    :param weights: a NumPy array of pixel weights
+    :return: acc
+    """
+    index, valid = cell_index(lat, lon, grid)
+    valid &= np.isfinite(values) & (weights > 0)
+
+    index = index[valid]
+    weights = weights[valid]
+    size = acc['count'].size
+
+    acc['sum'] += np.bincount(index, weights = weights * values[valid], minlength = size)
+    acc['weight'] += np.bincount(index, weights = weights, minlength = size)
+    acc['count'] += np.bincount(index, minlength = size)
+    return acc
+
+
+# III. TOP-LEVEL FUNCTIONS - - - - - - -
+def bin_file(filename, var, grid, qa_var = None, qa_mask = None, qa_weights = None, weight_var = None,
+             block_scanlines = BLOCK_SCANLINES):
+    """
+    Bins one Level 2 orbit, streaming it in blocks of scanlines
+    :param filename: a full path String
+    :param var: a data variable String
+    :param grid: a Python dictionary (see make_grid)
+    :param block_scanlines: the number of scanlines read at once
+    :return: a Python dictionary of flat NumPy arrays (see new_accumulator)
+    """
+    acc = new_accumulator(grid)
+
+    reader = OMIReader(filename, load = False)   # Pooled: the file stays open across blocks
+    if not reader.is_swath():
+        log.warning(f'SKIPPING {filename}: NOT A SWATH FILE')
+        return acc
+
+    nscan = reader.get_shape(var)
+    if nscan is None:
+        log.warning(f"VARIABLE '{var}' DOES NOT EXIST IN {filename}")
+        return acc
+    nscan = nscan[0]
+
+    names = [var, 'Latitude', 'Longitude'] + [name for name in (qa_var, weight_var) if name is not None]
+    names = list(dict.fromkeys(names))
+
+    for start in range(0, nscan, block_scanlines):
+        fields = reader.read_swath_fields(names, slice(start, min(start + block_scanlines, nscan)),
+                                          raw = (qa_var,))
+        if fields is None:
+            return acc
+        weights = get_weights(fields, qa_var, qa_mask, qa_weights, weight_var)
+        accumulate(acc, grid, fields[var], fields['Latitude'], fields['Longitude'], weights)
+
+    return acc
+
+
+def bin_files(filenames, var, grid, **options):
+    """
+    Bins many orbits into one accumulation (the work of one process)
+    :param filenames: a Python list of full path Strings
+    :param var: a data variable String
+    :param grid: a Python dictionary (see make_grid)
+    :return: a Python dictionary of flat NumPy arrays (see new_accumulator)
+    """
+    acc = new_accumulator(grid)
+    for fn in filenames:
+        merge(acc, bin_file(fn, var, grid, **options))
+    return acc
+
+
+def bin_swaths(paths, var, resolution = 0.25, bbox = (-180.0, -90.0, 180.0, 90.0), qa_var = None, qa_mask = None,
+               qa_weights = None, weight_var = None, block_scanlines = BLOCK_SCANLINES, workers = None):
+    """
+    Bins the pixels of many Level 2 orbits onto a regular grid
+    (usage: bin_swaths(glob.glob('OMI/L2/*2022m0709t*.he5'), 'ColumnAmountO3', 0.5, qa_var = 'QualityFlags',
+                       qa_mask = 0b1111))
+    :param paths: a Python list of full path Strings
+    :param var: a data variable String
+    :param resolution: the cell size in degrees (a float, or a tuple of (latitude, longitude) sizes)
+    :param bbox: a tuple of (west, south, east, north)
+    :param qa_var: a quality flag variable String or 'None'
+    :param qa_mask: an integer bit mask of the quality flags or 'None' for all bits
+    :param qa_weights: a Python dictionary of quality code keys and weight values or 'None'
+    :param weight_var: a weight variable String or 'None'
+    :param block_scanlines: the number of scanlines read at once
+    :param workers: the number of worker processes, 'None' for one per CPU, or 1 to run in this process
+    :return: an XArray Dataset (lat, lon) of the variable mean, count, and weight
+    """
+    grid = make_grid(resolution, bbox)
+    paths = list(paths)
+    binner = functools.partial(bin_files, var = var, grid = grid, qa_var = qa_var, qa_mask = qa_mask,
+                               qa_weights = qa_weights, weight_var = weight_var, block_scanlines = block_scanlines)
+
+    if workers == 1 or len(paths) <= 1:
+        acc = binner(paths)
+    else:
+        workers = min(workers or os.cpu_count(), len(paths))
+        groups = [paths[i::workers] for i in range(workers)]   # One accumulation is sent back per worker
+        acc = new_accumulator(grid)
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            for result in pool.map(binner, groups):
+                merge(acc, result)
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = np.where(acc['weight'] > 0, acc['sum'] / acc['weight'], np.nan)
+
+    dims = ['lat', 'lon']
+    coords = {'lat': grid['lats'], 'lon': grid['lons']}
+    return xr.Dataset({var: (dims, mean.reshape(grid['shape'])),
+                       'count': (dims, acc['count'].reshape(grid['shape'])),
+                       'weight': (dims, acc['weight'].reshape(grid['shape']))},
+                      coords = coords,
+                      attrs = {'resolution': list(grid['resolution']), 'bbox': list(grid['bbox']),
+                               'files': len(paths)})
+
+
+if __name__ == "__main__":
+    import argparse
+    from eviz_convert import find_inputs
+
+    parser = argparse.ArgumentParser(description = 'Bin OMI Level 2 swaths onto a regular grid')
+    parser.add_argument('inputs', nargs = '+', help = 'directories, glob patterns, or catalog files')
+    parser.add_argument('--var', required = True)
+    parser.add_argument('--output', required = True, help = 'NetCDF output path')
+    parser.add_argument('--resolution', type = float, default = 0.25)
+    parser.add_argument('--bbox', type = float, nargs = 4, default = (-180.0, -90.0, 180.0, 90.0),
+                        metavar = ('WEST', 'SOUTH', 'EAST', 'NORTH'))
+    parser.add_argument('--qa-var', default = None)
+    parser.add_argument('--qa-mask', type = lambda text: int(text, 0), default = None)
+    parser.add_argument('--weight-var', default = None)
+    parser.add_argument('--workers', type = int, default = None)
+    args = parser.parse_args()
+
+    binned = bin_swaths([fn for fn in find_inputs(args.inputs) if fn.endswith('.he5')], args.var,
+                        args.resolution, tuple(args.bbox), args.qa_var, args.qa_mask, None, args.weight_var,
+                        workers = args.workers)
+    binned.to_netcdf(args.output)
+    print(binned)
@@ -0,0 +1,316 @@
+"""
+The purpose of this file is to generate synthetic OMI and Landsat sample files so that the readers can be
+exercised (and benchmarked) offline without the original archives.
+
+    • OMI: HDF-EOS5 grid files (HE5) laid out like OMI Level 3 products
+        HDFEOS/ADDITIONAL/FILE_ATTRIBUTES    -> granule date attributes
+        HDFEOS/GRIDS/<grid name>             -> grid span & size attributes
+        HDFEOS/GRIDS/<grid name>/Data Fields -> float32 data fields (_FillValue, ScaleFactor, Offset)
+
+    • OMI: HDF-EOS5 swath files (HE5) laid out like OMI Level 2 orbits
+        HDFEOS/SWATHS/<swath name>/Geolocation Fields -> (scanline, pixel) Latitude & Longitude, scanline Time
+        HDFEOS/SWATHS/<swath name>/Data Fields        -> float32 data fields & uint16 QualityFlags
+
+    • Landsat: HDF4 files laid out like Landsat surface reflectance (CDR) products
+        global attributes                    -> bounding coordinates & acquisition date
+        sr_band<n>                           -> int16 reflectance (_FillValue, scale_factor, add_offset)
+        cfmask                               -> uint8 cloud mask classes
+
+Filenames follow the naming conventions checked by Datasource.is_omi and Datasource.is_landsat.
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import os
+from datetime import date, timedelta
+
+import numpy as np
+import h5py
+
+OMI_FILL = np.float32(-1.2676506e+30)
+LANDSAT_FILL = -9999
+CFMASK_FILL = 255
+
+
+# II. HELPER FUNCTIONS - - - - - - -
+def omi_filename(day):
+    """
+    Returns an OMI Level 3 filename for a given date
+    :param day: a datetime.date object
+    :return: a filename String
+    """
+    produced = day + timedelta(days = 2)
+    return (f'OMI-Aura_L3-OMTO3e_{day.year}m{day.month:02d}{day.day:02d}_'
+            f'v003-{produced.year}m{produced.month:02d}{produced.day:02d}t031807.he5')
+
+
+def omi_swath_filename(day, orbit):
+    """
+    Returns an OMI Level 2 (orbit) filename for a given date
+    :param day: a datetime.date object
+    :param orbit: an orbit number
+    :return: a filename String
+    """
+    start = orbit % 14 * 100 + 23   # ~14.5 orbits per day
+    return (f'OMI-Aura_L2-OMTO3_{day.year}m{day.month:02d}{day.day:02d}t{start:04d}-o{orbit:05d}_'
+            f'v003-{day.year}m{day.month:02d}{day.day:02d}t235959.he5')
+
+
+def landsat_filename(day, sensor = 'T', satellite = 5, path = 83, row = 15):
+    """
+    Returns a Landsat filename (LXS PPPRRR YYYYDDD GSIVV) for a given date
+    :param day: a datetime.date object
+    :param sensor: a sensor letter String
+    :param satellite: a satellite number
+    :param path: a WRS path number
+    :param row: a WRS row number
+    :return: a filename String
+    """
+    doy = day.timetuple().tm_yday
+    return f'L{sensor}{satellite}{path:03d}{row:03d}{day.year}{doy:03d}GLC00.hdf'
+
+
+def make_field(shape, rng, low, high, missing = 0.0):
+    """
+    Returns a smooth random field with an optional fraction of missing (NaN) rows, like an OMI swath gap
+    :param shape: a tuple of array dimensions
+    :param rng: a NumPy random Generator
+    :param low: the minimum field value
+    :param high: the maximum field value
+    :param missing: the fraction of rows set to NaN
+    :return: a float64 NumPy array
+    """
+    y = np.linspace(0, np.pi, shape[0])[:, np.newaxis]
+    x = np.linspace(0, 2 * np.pi, shape[1])[np.newaxis, :]
+    field = 0.5 + 0.25 * np.sin(3 * y) * np.cos(2 * x) + 0.25 * rng.random(shape)
+    field = low + (high - low) * field
+
+    if missing > 0:
+        rows = rng.random(shape[0]) < missing
+        field[rows, :] = np.nan
+
+    return field
+
+
+# III. GENERATORS - - - - - - -
+def make_omi_file(directory, day = date(2022, 7, 9), nlat = 720, nlon = 1440, nvars = 4,
+                  compression = 'gzip', compression_opts = 4, shuffle = False, chunks = (180, 180),
+                  missing = 0.1, seed = 0):
+    """
+    Writes a synthetic OMI Level 3 HDF-EOS5 grid file
+    :param directory: the output directory String
+    :param day: a datetime.date object for the granule
+    :param nlat: number of latitudes in the grid
+    :param nlon: number of longitudes in the grid
+    :param nvars: number of data fields
+    :param compression: an h5py compression filter String or 'None'
+    :param compression_opts: the compression level
+    :param shuffle: whether to apply the shuffle filter
+    :param chunks: a tuple of chunk dimensions or 'None' for contiguous storage
+    :param missing: the fraction of rows written as fill values
+    :param seed: a random seed
+    :return: the full path String of the new file
+    """
+    rng = np.random.default_rng(seed)
+    path = os.path.join(directory, omi_filename(day))
+
+    names = ['ColumnAmountO3', 'RadiativeCloudFraction', 'SolarZenithAngle', 'ViewingZenithAngle']
+    names += [f'SyntheticField{i}' for i in range(len(names), nvars)]
+
+    if chunks is not None:
+        chunks = (min(chunks[0], nlat), min(chunks[1], nlon))
+
+    with h5py.File(path, 'w') as fid:
+        info = fid.create_group('HDFEOS INFORMATION')
+        info['StructMetadata.0'] = np.bytes_(b'GROUP=GridStructure\nEND_GROUP=GridStructure\n')
+
+        fid_attrs = fid.create_group('HDFEOS/ADDITIONAL/FILE_ATTRIBUTES').attrs
+        fid_attrs['GranuleDay'] = np.array([day.day], dtype = 'int32')
+        fid_attrs['GranuleDayOfYear'] = np.array([day.timetuple().tm_yday], dtype = 'int32')
+        fid_attrs['GranuleMonth'] = np.array([day.month], dtype = 'int32')
+        fid_attrs['GranuleYear'] = np.array([day.year], dtype = 'int32')
+        fid_attrs['InstrumentName'] = np.bytes_(b'OMI')
+        fid_attrs['Period'] = np.bytes_(b'Daily')
+        fid_attrs['ProcessLevel'] = np.bytes_(b'3e')
+
+        grid = fid.create_group('HDFEOS/GRIDS/OMI Column Amount O3')
+        grid.attrs['GCTPProjectionCode'] = np.array([0], dtype = 'int32')
+        grid.attrs['GridOrigin'] = np.bytes_(b'Center')
+        grid.attrs['GridSpacing'] = np.bytes_(f'({360 / nlon},{180 / nlat})'.encode())
+        grid.attrs['GridSpacingUnit'] = np.bytes_(b'deg')
+        grid.attrs['GridSpan'] = np.bytes_(b'(-180,180,-90,90)')
+        grid.attrs['GridSpanUnit'] = np.bytes_(b'deg')
+        grid.attrs['NumberOfLatitudesInGrid'] = np.array([nlat], dtype = 'int32')
+        grid.attrs['NumberOfLongitudesInGrid'] = np.array([nlon], dtype = 'int32')
+        grid.attrs['Projection'] = np.bytes_(b'Geographic')
+
+        fields = grid.create_group('Data Fields')
+        for i, name in enumerate(names[:nvars]):
+            data = make_field((nlat, nlon), rng, 50.0 + 10 * i, 700.0, missing)
+            data = np.where(np.isnan(data), OMI_FILL, data).astype('float32')
+
+            ds = fields.create_dataset(name, data = data, chunks = chunks, shuffle = shuffle,
+                                       compression = compression,
+                                       compression_opts = compression_opts if compression == 'gzip' else None)
+            ds.attrs['MissingValue'] = np.array([OMI_FILL], dtype = 'float32')
+            ds.attrs['Offset'] = np.array([0.0])
+            ds.attrs['ScaleFactor'] = np.array([1.0])
+            ds.attrs['Title'] = np.bytes_(f'Synthetic {name}'.encode())
+            ds.attrs['Units'] = np.bytes_(b'DU')
+            ds.attrs['_FillValue'] = np.array([OMI_FILL], dtype = 'float32')
+
+    return path
+
+
+def make_omi_swath_file(directory, day = date(2022, 7, 9), orbit = 98765, nscan = 1644, nxtrack = 60,
+                        chunks = (100, 60), missing = 0.05, seed = 0):
+    """
+    Writes a synthetic OMI Level 2 HDF-EOS5 swath file (one sun-synchronous orbit; each orbit crosses the
+    equator ~24.7 degrees west of the previous one)
+    :param directory: the output directory String
+    :param day: a datetime.date object for the orbit
+    :param orbit: an orbit number
+    :param nscan: number of scanlines (along track)
+    :param nxtrack: number of pixels per scanline (across track)
+    :param chunks: a tuple of chunk dimensions (gzip-compressed)
+    :param missing: the fraction of pixels written as fill values
+    :param seed: a random seed
+    :return: the full path String of the new file
+    """
+    rng = np.random.default_rng(seed)
+    path = os.path.join(directory, omi_swath_filename(day, orbit))
+    chunks = (min(chunks[0], nscan), min(chunks[1], nxtrack))
+
+    lat = np.linspace(-85.0, 85.0, nscan)[:, None] + np.zeros(nxtrack)
+    crossing = (-24.72 * orbit) % 360 - 180
+    across = np.linspace(-13.0, 13.0, nxtrack) / np.cos(np.radians(lat))   # ~2600 km wide swath
+    lon = (crossing - 0.2 * lat + np.clip(across, -60, 60) + 180) % 360 - 180
+
+    ozone = 250 + 100 * np.cos(np.radians(lat)) + rng.normal(0, 5, lat.shape)
+    ozone[rng.random(lat.shape) < missing] = OMI_FILL
+    cloud = rng.random(lat.shape)
+    quality = rng.choice(np.array([0, 0, 0, 0, 0, 0, 1, 2, 16], dtype = 'uint16'), size = lat.shape)
+
+    seconds = (np.datetime64(day.isoformat(), 's') - np.datetime64('1993-01-01', 's')).astype('float64')
+    start = seconds + (orbit % 14) * 5933.0
+
+    with h5py.File(path, 'w') as fid:
+        info = fid.create_group('HDFEOS INFORMATION')
+        info['StructMetadata.0'] = np.bytes_(b'GROUP=SwathStructure\nEND_GROUP=SwathStructure\n')
+
+        fid_attrs = fid.create_group('HDFEOS/ADDITIONAL/FILE_ATTRIBUTES').attrs
+        fid_attrs['GranuleDay'] = np.array([day.day], dtype = 'int32')
+        fid_attrs['GranuleDayOfYear'] = np.array([day.timetuple().tm_yday], dtype = 'int32')
+        fid_attrs['GranuleMonth'] = np.array([day.month], dtype = 'int32')
+        fid_attrs['GranuleYear'] = np.array([day.year], dtype = 'int32')
+        fid_attrs['InstrumentName'] = np.bytes_(b'OMI')
+        fid_attrs['OrbitNumber'] = np.array([orbit], dtype = 'int32')
+        fid_attrs['ProcessLevel'] = np.bytes_(b'2')
+
+        swath = fid.create_group('HDFEOS/SWATHS/OMI Column Amount O3')
+        geo = swath.create_group('Geolocation Fields')
+        fields = swath.create_group('Data Fields')
+
+        def add(group, name, data, fill, units, title, scale = 1.0):
+            ds = group.create_dataset(name, data = data, chunks = chunks if data.ndim == 2 else None,
+                                      compression = 'gzip' if data.ndim == 2 else None)
+            ds.attrs['MissingValue'] = np.array([fill], dtype = data.dtype)
+            ds.attrs['Offset'] = np.array([0.0])
+            ds.attrs['ScaleFactor'] = np.array([scale])
+            ds.attrs['Title'] = np.bytes_(title.encode())
+            ds.attrs['Units'] = np.bytes_(units.encode())
+            ds.attrs['_FillValue'] = np.array([fill], dtype = data.dtype)
+
+        add(geo, 'Latitude', lat.astype('float32'), OMI_FILL, 'deg', 'Geodetic Latitude')
+        add(geo, 'Longitude', lon.astype('float32'), OMI_FILL, 'deg', 'Geodetic Longitude')
+        add(geo, 'Time', start + np.arange(nscan) * 2.0, -1.2676506e+30, 's', 'Time in TAI units')
+        add(fields, 'ColumnAmountO3', ozone.astype('float32'), OMI_FILL, 'DU', 'Best Total Ozone Solution')
+        add(fields, 'RadiativeCloudFraction', cloud.astype('float32'), OMI_FILL, 'NoUnits',
+            'Radiative Cloud Fraction')
+        add(fields, 'QualityFlags', quality, np.uint16(65535), 'NoUnits', 'Quality Flags')
+
+    return path
+
+
+def make_landsat_file(directory, day = date(2011, 8, 2), nrows = 2000, ncols = 2000, nbands = 6,
+                      compression = True, compression_level = 6, fill_corners = True, seed = 0):
+    """
+    Writes a synthetic Landsat surface reflectance HDF4 file
+    :param directory: the output directory String
+    :param day: a datetime.date object for the acquisition
+    :param nrows: number of rows (YDim)
+    :param ncols: number of columns (XDim)
+    :param nbands: number of sr_band datasets
+    :param compression: whether to deflate-compress each dataset
+    :param compression_level: the deflate level
+    :param fill_corners: whether to fill the corners outside a rotated scene footprint
+    :param seed: a random seed
+    :return: the full path String of the new file
+    """
+    from pyhdf.SD import SD, SDC
+
+    rng = np.random.default_rng(seed)
+    path = os.path.join(directory, landsat_filename(day))
+
+    if fill_corners:   # Rotated scene footprint inside a north-up lat/lon box
+        y, x = np.mgrid[0:nrows, 0:ncols]
+        u = (x - ncols / 2) / ncols
+        v = (y - nrows / 2) / nrows
+        footprint = (np.abs(u * 0.96 + v * 0.26) < 0.42) & (np.abs(v * 0.96 - u * 0.26) < 0.42)
+    else:
+        footprint = np.ones((nrows, ncols), dtype = bool)
+
+    fid = SD(path, SDC.WRITE | SDC.CREATE | SDC.TRUNC)
+    fid.NorthBoundingCoordinate = 63.2
+    fid.SouthBoundingCoordinate = 61.1
+    fid.EastBoundingCoordinate = -145.2
+    fid.WestBoundingCoordinate = -150.1
+    fid.AcquisitionDate = f'{day.isoformat()}T20:51:34.000000Z'
+    fid.Satellite = 'LANDSAT_5'
+    fid.Instrument = 'TM'
+
+    def add_sds(name, data, hdf_type, fill, attrs):
+        sds = fid.create(name, hdf_type, data.shape)
+        sds.dim(0).setname('YDim')
+        sds.dim(1).setname('XDim')
+        sds.setfillvalue(fill)   # Written as the '_FillValue' attribute
+        for key, value in attrs.items():
+            setattr(sds, key, value)
+        if compression:
+            sds.setcompress(SDC.COMP_DEFLATE, compression_level)
+        sds[:] = data
+        sds.endaccess()
+
+    for band in range(1, nbands + 1):
+        refl = make_field((nrows, ncols), rng, 0, 6000)
+        refl = np.where(footprint, refl, LANDSAT_FILL).astype('int16')
+        add_sds(f'sr_band{band}', refl, SDC.INT16, LANDSAT_FILL,
+                {'long_name': f'band {band} surface reflectance', 'units': 'reflectance',
+                 'scale_factor': 0.0001, 'add_offset': 0.0})
+
+    cfmask = rng.choice(np.array([0, 0, 0, 0, 1, 2, 3, 4], dtype = 'uint8'), size = (nrows, ncols))
+    cfmask = np.where(footprint, cfmask, CFMASK_FILL).astype('uint8')
+    add_sds('cfmask', cfmask, SDC.UINT8, CFMASK_FILL,
+            {'long_name': 'cloud mask', 'units': 'quality/feature classification'})
+
+    fid.end()
+    return path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Generate synthetic OMI and Landsat sample files')
+    parser.add_argument('directory')
+    parser.add_argument('--days', type = int, default = 1)
+    parser.add_argument('--omi-shape', type = int, nargs = 2, default = (720, 1440))
+    parser.add_argument('--landsat-shape', type = int, nargs = 2, default = (2000, 2000))
+    parser.add_argument('--bands', type = int, default = 6)
+    parser.add_argument('--no-compression', action = 'store_true')
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok = True)
+    for i in range(args.days):
+        print(make_omi_file(args.directory, date(2022, 7, 9) + timedelta(days = i), *args.omi_shape,
+                            compression = None if args.no_compression else 'gzip', seed = i))
+        print(make_landsat_file(args.directory, date(2011, 8, 2) + timedelta(days = 16 * i), *args.landsat_shape,
+                                nbands = args.bands, compression = not args.no_compression, seed = i))
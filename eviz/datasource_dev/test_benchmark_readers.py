@@ -0,0 +1,77 @@
+"""
+The purpose of this file is to run the reader benchmark harness (benchmark_readers.py) as a test on small
+synthetic files, so changes that break it, or the fast paths it measures, are caught.
+
+Usage (from eviz/datasource_dev):
+    python -m pytest -q test_benchmark_readers.py
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import numpy as np
+import pytest
+
+import benchmark_readers
+from benchmark_readers import bare
+from omi_reader import OMIReader
+from landsat_reader import LandsatReader
+import synthetic_samples
+import chunk_decoder
+
+# Attributes of a reader that depend on its file or variables (bare readers don't set them)
+FILE_ATTRS = {'var', 'var_input', 'ftype', 'data'}
+
+
+@pytest.fixture(scope = 'module')
+def samples(tmp_path_factory):
+    """
+    Writes one small synthetic OMI and Landsat file
+    :return: a Python dictionary of reader class keys and full path String values
+    """
+    workdir = str(tmp_path_factory.mktemp('samples'))
+    return {OMIReader: synthetic_samples.make_omi_file(workdir, nlat = 90, nlon = 180),
+            LandsatReader: synthetic_samples.make_landsat_file(workdir, nrows = 200, ncols = 200, nbands = 2)}
+
+
+# II. TESTS - - - - - - -
+@pytest.mark.parametrize('cls', [OMIReader, LandsatReader])
+def test_bare_matches_constructor(samples, cls):
+    reader = cls(samples[cls], load = False)
+    benched = bare(cls, samples[cls])
+
+    assert set(vars(reader)) - FILE_ATTRS <= set(vars(benched))
+    benched.close_fid(benched.get_fid())
+
+
+@pytest.mark.parametrize('cls', [OMIReader, LandsatReader])
+def test_restore_matches_reader(samples, cls):
+    restored = benchmark_readers.bench_restore(cls, samples[cls], repeat = 1)
+    data = cls(samples[cls]).data
+
+    assert set(restored) == set(data.data_vars)
+    for result in restored.values():
+        assert result['mb_per_s'] > 0
+
+
+def test_chunk_decoder_matches_h5py(samples):
+    reader = bare(OMIReader, samples[OMIReader], pooled = False, access = {'rdcc_nbytes': 0})
+    fid = reader.get_fid()
+    try:
+        for ds in reader.get_data_group(fid).values():
+            if chunk_decoder.supports(ds):
+                out = chunk_decoder.decode_into(ds, np.empty(ds.shape, dtype = ds.dtype), None, 2)
+                np.testing.assert_array_equal(out, ds[()])
+    finally:
+        reader.close_fid(fid)
+
+
+def test_run(tmp_path, capsys):
+    results = benchmark_readers.run(str(tmp_path), omi_shape = (90, 180), landsat_shape = (200, 200), bands = 2,
+                                    repeat = 1)
+    benchmark_readers.report(results)
+
+    for name in ('OMIReader', 'LandsatReader'):
+        assert results[name]['open']['best_s'] > 0
+        assert results[name]['restore']
+        assert results[name]['rss']['peak_mb'] > 0
+    assert results['OMIReader']['decode']
+    assert 'peak RSS' in capsys.readouterr().out
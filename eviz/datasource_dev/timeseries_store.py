@@ -0,0 +1,245 @@
+"""
+The purpose of this file is to define the TimeSeriesStore class, a time-major Zarr store built from a stack of
+daily grid files (e.g. OMI Level 3) so that the time series of one pixel is read from one small chunk column
+instead of opening every file.
+
+Store layout:
+    time (time)                 -> seconds since 1970-01-01, one entry per ingested file
+    lat (lat), lon (lon)        -> the grid shared by every ingested file
+    <variable> (time, lat, lon) -> restored float32 values in (time_chunk, 32, 32) chunks
+
+    • Files are appended incrementally; files whose time is already in the store are skipped
+    • Files are ingested in batches so each chunk is rewritten once per batch rather than once per file
+      (larger batches make ingestion faster at the cost of batch x grid x 4 bytes of memory per variable)
+    • The time coordinate is written after the data of a batch, so an interrupted batch is dropped (and
+      overwritten) on the next append
+
+Usage:
+    python timeseries_store.py STORE INPUT [INPUT ...] [--vars VAR [VAR ...]] [--batch N]
+
+Needs the 'zarr' package.
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import logging
+
+import numpy as np
+import xarray as xr
+
+from datasource import Datasource
+from eviz_convert import ZarrWriter, clean_attrs, encode_times, find_inputs
+
+TIME_CHUNK = 4096   # ~11 years of daily files per chunk
+SPACE_CHUNKS = (32, 32)
+
+
+class TimeSeriesStore:
+    """
+    Time-major Zarr store of a stack of same-grid files, with incremental appends and pixel time-series reads.
+    """
+
+    # I. Constructor
+    def __init__(self, path, mode = 'a', time_chunk = TIME_CHUNK, space_chunks = SPACE_CHUNKS):
+        """
+        Opens (or creates) a time-series store
+        :param path: the store path String
+        :param mode: 'a' (read/write, create if missing) or 'r' (read only)
+        :param time_chunk: the number of time steps per chunk of a new store
+        :param space_chunks: a tuple of (rows, columns) per chunk of a new store
+        """
+        self.path = path
+        self.time_chunk = time_chunk
+        self.space_chunks = tuple(space_chunks)
+
+        self.log = logging.getLogger(__name__)
+        self.writer = ZarrWriter(path, mode = mode)
+
+    def __repr__(self):
+        """
+        Returns store info
+        :return: a String
+        """
+        return f'TimeSeriesStore({self.path}; {len(self)} times; {self.get_vars()})'
+
+    def __len__(self):
+        """
+        Returns the number of complete time steps in the store
+        :return: an integer
+        """
+        arrays = self.writer.arrays
+        return arrays['time'].shape[0] if 'time' in arrays else 0
+
+    # II. Accessor & Helper Methods
+    def get_vars(self):
+        """
+        Returns the names of the data variables in the store
+        :return: a Python list of variable name Strings
+        """
+        return sorted(name for name, arr in self.writer.arrays.items() if len(arr.shape) == 3)
+
+    def get_times(self):
+        """
+        Returns the time coordinate of the store
+        :return: a datetime64 NumPy array
+        """
+        if 'time' not in self.writer.arrays:
+            return np.array([], dtype = 'datetime64[s]')
+        return self.writer.arrays['time'][:].astype('datetime64[s]')
+
+    def create(self, grid, variables):
+        """
+        Creates the coordinates and (empty) data variables of a new store
+        :param grid: a Python dictionary of the file grid (see Datasource.get_grid)
+        :param variables: a Python dictionary of variable name String keys and attribute dictionary values
+        """
+        time_dim, lat_dim, lon_dim = grid['dims']
+        lats = grid['coords'][lat_dim]
+        lons = grid['coords'][lon_dim]
+
+        self.writer.create('time', ('time',), (0,), (self.time_chunk,), np.dtype('int64'),
+                           {'units': 'seconds since 1970-01-01', 'calendar': 'standard'})
+        for name, values in (('lat', lats), ('lon', lons)):
+            self.writer.create(name, (name,), values.shape, values.shape, values.dtype, {})
+            self.writer.write(name, (slice(None),), values)
+
+        chunks = (self.time_chunk, min(self.space_chunks[0], lats.size), min(self.space_chunks[1], lons.size))
+        for var, attrs in variables.items():
+            self.writer.create(var, ('time', 'lat', 'lon'), (0, lats.size, lons.size), chunks, np.dtype('float32'),
+                               clean_attrs(attrs), fill = np.nan)
+
+    def same_grid(self, grid):
+        """
+        Determines if a file grid matches the store grid
+        :param grid: a Python dictionary of the file grid (see Datasource.get_grid)
+        :return: Boolean
+        """
+        lats = grid['coords'][grid['dims'][1]]
+        lons = grid['coords'][grid['dims'][2]]
+        arrays = self.writer.arrays
+
+        return (lats.shape == arrays['lat'].shape and lons.shape == arrays['lon'].shape and
+                np.allclose(lats, arrays['lat'][:]) and np.allclose(lons, arrays['lon'][:]))
+
+    def trim(self):
+        """
+        Drops data appended after the last complete time step (left by an interrupted append)
+        """
+        for var in self.get_vars():
+            arr = self.writer.arrays[var]
+            if arr.shape[0] != len(self):
+                self.log.warning(f"DROPPING {arr.shape[0] - len(self)} INCOMPLETE TIME STEPS OF '{var}'")
+                arr.resize((len(self),) + arr.shape[1:])
+
+    def flush(self, batch):
+        """
+        Appends a batch of files to the store
+        :param batch: a Python list of (Datasource object, time in seconds) tuples
+        """
+        arrays = self.writer.arrays
+        shape = (len(batch),) + arrays['lat'].shape + arrays['lon'].shape
+        buffer = np.empty(shape, dtype = 'float32')
+
+        for var in self.get_vars():
+            for i, (source, _) in enumerate(batch):
+                if source.read_into(var, buffer[i]) is None:
+                    buffer[i] = np.nan
+            arrays[var].append(buffer, axis = 0)
+
+        arrays['time'].append(np.array([seconds for _, seconds in batch], dtype = 'int64'))
+
+        for source, _ in batch:
+            Datasource.close_handles(source.fn)
+        self.log.info(f'APPENDED {len(batch)} TIME STEPS ({len(self)} TOTAL)')
+
+    # III. Top-Level Methods
+    def append(self, filenames, variables = None, batch = 32):
+        """
+        Appends files (skipping times already in the store) in batches
+        :param filenames: a Python list of full path Strings
+        :param variables: a Python list of variable name Strings for a new store or 'None' for every variable
+                          of the first file (an existing store keeps its variables)
+        :param batch: the number of files ingested per batch
+        :return: the number of files appended
+        """
+        self.trim()
+        known = set(self.writer.arrays['time'][:].tolist()) if len(self) else set()
+
+        pending = []
+        appended = 0
+
+        for fn in filenames:
+            source = Datasource(fn, load = False)
+            names = source.get_vars()
+            if not names:
+                self.log.warning(f'SKIPPING UNREADABLE FILE {fn}')
+                continue
+
+            grid = source.get_grid(names[0])
+            seconds, attrs = encode_times(grid['coords'][grid['dims'][0]])
+            if 'units' not in attrs:
+                self.log.warning(f'SKIPPING FILE WITHOUT A DATE {fn}')
+                continue
+            if int(seconds[0]) in known:
+                continue
+
+            if 'time' not in self.writer.arrays:
+                names = [var for var in names if variables is None or var in variables]
+                self.create(grid, {var: source.get_grid(var)['attrs'] for var in names})
+            elif not self.same_grid(grid):
+                self.log.warning(f'SKIPPING FILE ON ANOTHER GRID {fn}')
+                continue
+
+            known.add(int(seconds[0]))
+            pending.append((source, int(seconds[0])))
+
+            if len(pending) == batch:
+                self.flush(pending)
+                appended += len(pending)
+                pending = []
+
+        if pending:
+            self.flush(pending)
+            appended += len(pending)
+
+        return appended
+
+    def timeseries(self, lat, lon, var):
+        """
+        Reads the time series of the grid cell nearest to a location
+        :param lat: a latitude float
+        :param lon: a longitude float
+        :param var: a data variable String
+        :return: an XArray DataArray sorted by time, or 'None' if the variable doesn't exist
+        """
+        if var not in self.get_vars():
+            self.log.warning(f"VARIABLE '{var}' DOES NOT EXIST")
+            return None
+
+        arrays = self.writer.arrays
+        lats = arrays['lat'][:]
+        lons = arrays['lon'][:]
+        i = int(np.abs(lats - lat).argmin())
+        j = int(np.abs(lons - lon).argmin())
+
+        times = self.get_times()
+        values = arrays[var][:len(times), i, j]
+        order = np.argsort(times, kind = 'stable')
+
+        attrs = {key: value for key, value in arrays[var].attrs.items() if not key.startswith('_')}
+        return xr.DataArray(values[order], dims = ['time'], name = var, attrs = attrs,
+                            coords = {'time': times[order].astype('datetime64[ns]'), 'lat': lats[i],
+                                      'lon': lons[j]})
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Append daily grid files to a time-major Zarr store')
+    parser.add_argument('store')
+    parser.add_argument('inputs', nargs = '+', help = 'directories, glob patterns, or catalog files')
+    parser.add_argument('--vars', nargs = '+', default = None)
+    parser.add_argument('--batch', type = int, default = 32)
+    args = parser.parse_args()
+
+    store = TimeSeriesStore(args.store)
+    print(f'{store.append(find_inputs(args.inputs), args.vars, args.batch)} files appended; {store}')
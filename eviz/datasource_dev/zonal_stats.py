@@ -0,0 +1,453 @@
+"""
+The purpose of this file is to compute zonal statistics (per country, basin, ... region) of one variable over
+many OMI or Landsat files, e.g. the mean ozone of each country for every day of a year.
+
+    • Zones are an integer label raster on the data grid (negative labels are outside every zone), or polygons
+      rasterized onto each grid once (cell centers, even-odd rule) and cached per grid
+    • Each file is read in blocks of rows (Datasource.read_into), only within the rows and columns the zones
+      cover, and each block is reduced per zone with np.bincount (count, sum, squares, histogram) and
+      np.minimum.at / np.maximum.at: no per-zone or per-pixel Python loops
+    • Files are processed in parallel by a process pool; each worker returns one accumulation (or one per file)
+
+Statistics per zone (STATS):
+    count, sum, mean, std, min, max
+    pct -> percentiles from a per-zone histogram of pct_bins bins over pct_range (approximate to the bin width);
+           pct_range defaults to the variable's valid range attribute (without either, pct is skipped)
+
+Polygons are given as a Python dictionary of integer label keys and geometries: GeoJSON Polygon/MultiPolygon
+(or Feature) dictionaries, or sequences of (lon, lat) rings. Longitudes must use the grid's convention (rings
+aren't split at the antimeridian).
+"""
+
+# I. IMPORT STATEMENTS - - - - - - -
+import os
+import hashlib
+import functools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+from datasource import Datasource
+import file_stack
+
+log = logging.getLogger(__name__)
+
+STATS = ('count', 'sum', 'mean', 'std', 'min', 'max', 'pct')
+
+BLOCK_ROWS = 512
+PCT_BINS = 1000
+
+# Rasterized polygons: (grid digest, polygons digest) -> zone index raster
+ZONE_CACHE = {}
+ZONE_CACHE_SIZE = 16
+
+
+# II. HELPER FUNCTIONS - - - - - - -
+def get_rings(geometry):
+    """
+    Returns the rings of a polygon geometry
+    :param geometry: a GeoJSON Polygon, MultiPolygon or Feature dictionary, a ring, or a sequence of rings
+    :return: a Python list of float64 NumPy arrays of (lon, lat) vertices
+    """
+    if isinstance(geometry, dict):
+        if geometry.get('type') == 'Feature':
+            return get_rings(geometry['geometry'])
+        if geometry.get('type') == 'Polygon':
+            return [np.asarray(ring, dtype = 'float64') for ring in geometry['coordinates']]
+        if geometry.get('type') == 'MultiPolygon':
+            return [np.asarray(ring, dtype = 'float64') for polygon in geometry['coordinates'] for ring in polygon]
+        raise ValueError(f"unsupported geometry type '{geometry.get('type')}'")
+
+    first = np.asarray(geometry[0], dtype = 'float64')
+    if first.ndim == 1:   # A single ring of vertices
+        return [np.asarray(geometry, dtype = 'float64')]
+    return [np.asarray(ring, dtype = 'float64') for ring in geometry]
+
+
+def digest(*arrays):
+    """
+    Returns a digest of arrays (cache keys of grids and polygons)
+    :return: a hexadecimal String
+    """
+    sha = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        sha.update(str((array.dtype, array.shape)).encode())
+        sha.update(array.tobytes())
+    return sha.hexdigest()
+
+
+def rasterize(polygons, lats, lons):
+    """
+    Rasterizes polygons onto a grid: a cell is in a zone if its center is inside the zone's rings (even-odd
+    rule, so inner rings are holes); where polygons overlap, the first one wins
+    :param polygons: a Python dictionary of label keys and geometries (see get_rings)
+    :param lats: a NumPy array of cell-center latitudes
+    :param lons: a NumPy array of cell-center longitudes
+    :return: an int32 NumPy array (lat, lon) of zone indices (position in polygons; -1 outside every zone)
+    """
+    order = np.argsort(lons, kind = 'stable')
+    sorted_lons = lons[order]
+    index = np.full((lats.size, lons.size), -1, dtype = 'int32')
+
+    for i, geometry in enumerate(polygons.values()):
+        toggles = np.zeros((lats.size, lons.size + 1), dtype = 'int32')
+
+        for ring in get_rings(geometry):
+            x0, y0 = ring[:, 0], ring[:, 1]
+            x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+
+            # Edges crossing each row's center line, and where they cross it
+            rows, edges = np.nonzero((y0 <= lats[:, None]) != (y1 <= lats[:, None]))
+            x = x0[edges] + (lats[rows] - y0[edges]) * (x1[edges] - x0[edges]) / (y1[edges] - y0[edges])
+
+            # Each crossing toggles the cells east of it
+            np.add.at(toggles, (rows, np.searchsorted(sorted_lons, x, side = 'right')), 1)
+
+        inside = np.empty(index.shape, dtype = bool)
+        inside[:, order] = np.cumsum(toggles[:, :-1], axis = 1) % 2 == 1
+        index[inside & (index < 0)] = i
+
+    return index
+
+
+def get_labels(zones):
+    """
+    Returns the zone labels
+    :param zones: an integer label raster (NumPy array or XArray DataArray) or a Python dictionary of polygons
+    :return: a NumPy array of labels in zone index order
+    """
+    if isinstance(zones, dict):
+        return np.array(list(zones))
+
+    raster = np.asarray(zones)
+    return np.unique(raster[raster >= 0])
+
+
+def get_zone_index(zones, labels, grid):
+    """
+    Returns the zone index raster of a grid
+    :param zones: an integer label raster or a Python dictionary of polygons
+    :param labels: a NumPy array of labels (see get_labels)
+    :param grid: a Python dictionary of the variable dims and coords (see Datasource.get_grid)
+    :return: an int32 NumPy array (lat, lon) of zone indices (-1 outside every zone)
+    """
+    lats, lons = (grid['coords'][dim] for dim in grid['dims'][1:])
+
+    if isinstance(zones, dict):
+        key = (digest(lats, lons), digest(labels, *[ring for geometry in zones.values()
+                                                     for ring in get_rings(geometry)]))
+        if key not in ZONE_CACHE:
+            if len(ZONE_CACHE) >= ZONE_CACHE_SIZE:
+                ZONE_CACHE.pop(next(iter(ZONE_CACHE)))
+            ZONE_CACHE[key] = rasterize(zones, lats, lons)
+        return ZONE_CACHE[key]
+
+    raster = np.asarray(zones)
+    if raster.shape != (lats.size, lons.size):
+        raise ValueError(f'zone raster shape {raster.shape} does not match the data grid {(lats.size, lons.size)}')
+
+    index = np.searchsorted(labels, raster).astype('int32')
+    index[raster < 0] = -1
+    return index
+
+
+def get_pct_range(attrs):
+    """
+    Returns the valid range of a variable from its attributes (in restored units)
+    :param attrs: a Python dictionary of variable attributes
+    :return: a tuple of (low, high) or 'None'
+    """
+    if 'ValidRange' in attrs:   # OMI: restored units
+        low, high = attrs['ValidRange']
+        return float(low), float(high)
+
+    if 'valid_range' in attrs:   # Landsat: raw units
+        scale, offset = attrs.get('scale_factor', 1), attrs.get('add_offset', 0)
+        low, high = (float(value) * scale + offset for value in attrs['valid_range'])
+        return low, high
+
+    return None
+
+
+def new_accumulator(nzones, pct_bins = None):
+    """
+    Returns empty per-zone reductions
+    :param nzones: the number of zones
+    :param pct_bins: the number of histogram bins, or 'None' for no histogram
+    :return: a Python dictionary of NumPy arrays
+    """
+    acc = {'count': np.zeros(nzones, dtype = 'int64'), 'sum': np.zeros(nzones), 'sumsq': np.zeros(nzones),
+           'min': np.full(nzones, np.inf), 'max': np.full(nzones, -np.inf)}
+    if pct_bins:
+        acc['hist'] = np.zeros((nzones, pct_bins), dtype = 'int64')
+    return acc
+
+
+def merge(acc, other):
+    """
+    Adds one accumulation to another
+    :param acc: a Python dictionary of NumPy arrays (see new_accumulator), updated in place
+    :param other: a Python dictionary of NumPy arrays
+    :return: acc
+    """
+    for key in acc:
+        if key == 'min':
+            np.minimum(acc[key], other[key], out = acc[key])
+        elif key == 'max':
+            np.maximum(acc[key], other[key], out = acc[key])
+        else:
+            acc[key] += other[key]
+    return acc
+
+
+def accumulate(acc, values, zone_index, pct_range = None):
+    """
+    Adds one block of values to the per-zone reductions
+    :param acc: a Python dictionary of NumPy arrays (see new_accumulator), updated in place
+    :param values: a NumPy array of restored values (NaN for missing)
+    :param zone_index: an integer NumPy array of the same shape of zone indices (-1 outside every zone)
+    :param pct_range: a tuple of the (low, high) histogram range or 'None'
+    :return: acc
+    """
+    valid = (zone_index >= 0) & ~np.isnan(values)
+    zones = zone_index[valid]
+    values = values[valid].astype('float64')
+    nzones = acc['count'].size
+
+    acc['count'] += np.bincount(zones, minlength = nzones)
+    acc['sum'] += np.bincount(zones, weights = values, minlength = nzones)
+    acc['sumsq'] += np.bincount(zones, weights = values * values, minlength = nzones)
+    np.minimum.at(acc['min'], zones, values)
+    np.maximum.at(acc['max'], zones, values)
+
+    if 'hist' in acc:
+        low, high = pct_range
+        bins = acc['hist'].shape[1]
+        bin_index = np.clip(((values - low) * (bins / (high - low))).astype('int64'), 0, bins - 1)
+        acc['hist'] += np.bincount(zones * bins + bin_index, minlength = nzones * bins).reshape(nzones, bins)
+
+    return acc
+
+
+def get_percentiles(hist, pct_range, percentiles):
+    """
+    Returns percentiles from per-zone histograms (linear within a bin)
+    :param hist: an integer NumPy array (zone, bin)
+    :param pct_range: a tuple of the (low, high) histogram range
+    :param percentiles: a sequence of percentiles (0 - 100)
+    :return: a float64 NumPy array (zone, percentile); NaN for empty zones
+    """
+    low, high = pct_range
+    width = (high - low) / hist.shape[1]
+    cum = np.cumsum(hist, axis = 1)
+    count = cum[:, -1]
+    zones = np.arange(hist.shape[0])
+
+    result = np.full((hist.shape[0], len(percentiles)), np.nan)
+    for j, pct in enumerate(percentiles):
+        target = count * pct / 100.0
+        bin_index = np.minimum((cum < target[:, None]).sum(axis = 1), hist.shape[1] - 1)
+        before = cum[zones, bin_index] - hist[zones, bin_index]
+        fraction = (target - before) / np.maximum(hist[zones, bin_index], 1)
+        result[:, j] = np.where(count > 0, low + (bin_index + fraction) * width, np.nan)
+
+    return result
+
+
+# III. TOP-LEVEL FUNCTIONS - - - - - - -
+def zone_file(path, var, zones, labels, pct_range = None, pct_bins = None, block_rows = BLOCK_ROWS, **options):
+    """
+    Reduces one file per zone, streaming the rows the zones cover in blocks
+    :param path: a full path String
+    :param var: a data variable String
+    :param zones: an integer label raster or a Python dictionary of polygons
+    :param labels: a NumPy array of labels (see get_labels)
+    :param pct_range: a tuple of the (low, high) histogram range or 'None'
+    :param pct_bins: the number of histogram bins, or 'None' for no histogram
+    :param block_rows: the number of rows read at once
+    :param options: Datasource keyword arguments (e.g. mask)
+    :return: a Python dictionary of NumPy arrays (see new_accumulator)
+    """
+    acc = new_accumulator(labels.size, pct_bins)
+
+    source = Datasource(path, load = False, **options)
+    grid = source.get_grid(var)
+    if grid is None:
+        log.warning(f"SKIPPING {path}: NO VARIABLE '{var}'")
+        return acc
+
+    try:
+        zone_index = get_zone_index(zones, labels, grid)
+    except ValueError as e:
+        log.warning(f'SKIPPING {path}: {e}')
+        return acc
+
+    # Reads only the rows and columns that hold zones
+    rows = np.flatnonzero((zone_index >= 0).any(axis = 1))
+    cols = np.flatnonzero((zone_index >= 0).any(axis = 0))
+    if rows.size == 0:
+        return acc
+    cols = slice(int(cols[0]), int(cols[-1]) + 1)
+
+    buffer = np.empty((min(block_rows, rows[-1] + 1 - rows[0]), cols.stop - cols.start))
+    for start in range(int(rows[0]), int(rows[-1]) + 1, block_rows):
+        block = slice(start, min(start + block_rows, int(rows[-1]) + 1))
+        out = buffer[:block.stop - block.start]
+        if source.read_into(var, out, (block, cols)) is None:
+            return acc
+        accumulate(acc, out, zone_index[block, cols], pct_range)
+
+    return acc
+
+
+def zone_files(paths, var, zones, labels, per_file = False, **options):
+    """
+    Reduces many files per zone (the work of one process)
+    :param paths: a Python list of full path Strings
+    :param var: a data variable String
+    :param zones: an integer label raster or a Python dictionary of polygons
+    :param labels: a NumPy array of labels (see get_labels)
+    :param per_file: whether to return one accumulation per file
+    :return: a Python dictionary of NumPy arrays, or a Python list of them (per_file)
+    """
+    results = [zone_file(path, var, zones, labels, **options) for path in paths]
+    if per_file:
+        return results
+
+    acc = new_accumulator(labels.size, options.get('pct_bins'))
+    for result in results:
+        merge(acc, result)
+    return acc
+
+
+def zonal_stats(paths, var, zones, stats = ('mean', 'count', 'min', 'max', 'pct'), percentiles = (5, 50, 95),
+                pct_range = None, pct_bins = PCT_BINS, per_file = False, block_rows = BLOCK_ROWS, workers = None,
+                **options):
+    """
+    Computes statistics of a variable per zone over many files
+    (usage: zonal_stats(glob.glob('OMI/*.he5'), 'ColumnAmountO3', countries, per_file = True))
+    :param paths: a Python list of full path Strings
+    :param var: a data variable String
+    :param zones: an integer label raster on the data grid (NumPy array or XArray DataArray; negative labels are
+                  outside every zone) or a Python dictionary of label keys and polygon geometries
+    :param stats: a sequence of statistic names (see STATS)
+    :param percentiles: a sequence of percentiles (0 - 100) for 'pct'
+    :param pct_range: a tuple of the (low, high) histogram range for 'pct' or 'None' for the valid range attribute
+                      ('pct' is skipped if there is neither)
+    :param pct_bins: the number of histogram bins for 'pct'
+    :param per_file: whether to compute statistics per file (with a file/time dimension) instead of over all files
+    :param block_rows: the number of rows read at once
+    :param workers: the number of worker processes, 'None' for one per CPU, or 1 to run in this process
+    :param options: Datasource keyword arguments (e.g. mask = ('cloud', 'shadow') for Landsat)
+    :return: an XArray Dataset of the statistics per zone (and file)
+    """
+    unknown = set(stats) - set(STATS)
+    if unknown:
+        raise ValueError(f'unknown statistics {sorted(unknown)} (any of {STATS})')
+
+    paths = list(paths)
+    labels = get_labels(zones)
+    if labels.size == 0:
+        raise ValueError('no zones')
+
+    attrs = {}
+    for path in paths:   # The attributes of the first file holding the variable
+        grid = Datasource(path, load = False, **options).get_grid(var)
+        if grid is not None:
+            attrs = dict(grid['attrs'])
+            break
+
+    if 'pct' in stats:
+        pct_range = pct_range if pct_range is not None else get_pct_range(attrs)
+        if pct_range is None:
+            log.warning(f"SKIPPING PERCENTILES: '{var}' HAS NO VALID RANGE ATTRIBUTE (GIVE pct_range)")
+            stats = [stat for stat in stats if stat != 'pct']
+    if 'pct' not in stats:
+        pct_bins = None
+
+    reducer = functools.partial(zone_files, var = var, zones = zones, labels = labels, per_file = per_file,
+                                pct_range = pct_range, pct_bins = pct_bins, block_rows = block_rows, **options)
+
+    if workers == 1 or len(paths) <= 1:
+        results = [reducer(paths)]
+        order = paths
+    else:
+        workers = min(workers or os.cpu_count(), len(paths))
+        groups = [paths[i::workers] for i in range(workers)]   # One result is sent back per worker
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            results = list(pool.map(reducer, groups))
+        order = [path for group in groups for path in group]
+
+    if per_file:
+        accs = dict(zip(order, [acc for result in results for acc in result]))
+        accs = [accs[path] for path in paths]
+    else:
+        accs = [new_accumulator(labels.size, pct_bins)]
+        for result in results:
+            merge(accs[0], result)
+
+    acc = {key: np.stack([a[key] for a in accs]) for key in accs[0]}
+    count = acc['count']
+    empty = count == 0
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = np.where(empty, np.nan, acc['sum'] / count)
+        variance = np.maximum(acc['sumsq'] / count - mean * mean, 0)
+
+    values = {'count': count, 'sum': acc['sum'], 'mean': mean, 'std': np.where(empty, np.nan, np.sqrt(variance)),
+              'min': np.where(empty, np.nan, acc['min']), 'max': np.where(empty, np.nan, acc['max'])}
+
+    dims = ['file', 'zone']
+    data_vars = {stat: (dims, values[stat]) for stat in stats if stat != 'pct'}
+    if 'pct' in stats:
+        pct = np.stack([get_percentiles(hist, pct_range, percentiles) for hist in acc['hist']])
+        data_vars['pct'] = (dims + ['percentile'], pct)
+
+    result = xr.Dataset(data_vars, coords = {'zone': labels, 'percentile': list(percentiles)},
+                        attrs = {'variable': var, 'units': str(attrs.get('Units', attrs.get('units', ''))),
+                                 'files': len(paths)})
+    if 'pct' not in stats:
+        result = result.drop_vars('percentile')
+    else:
+        result.attrs.update(pct_range = list(pct_range), pct_bins = pct_bins)
+
+    if per_file:
+        return result.assign_coords(file = paths, time = ('file', [file_stack.file_time(path) for path in paths]))
+    return result.isel(file = 0)
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+    from eviz_convert import find_inputs
+
+    parser = argparse.ArgumentParser(description = 'Compute zonal statistics over OMI/Landsat files')
+    parser.add_argument('inputs', nargs = '+', help = 'directories, glob patterns, or catalog files')
+    parser.add_argument('--var', required = True)
+    parser.add_argument('--zones', required = True,
+                        help = 'an integer label raster (.npy) or a GeoJSON FeatureCollection of polygons')
+    parser.add_argument('--label-property', default = None,
+                        help = 'the integer GeoJSON feature property used as label (default: feature order)')
+    parser.add_argument('--output', required = True, help = 'NetCDF output path')
+    parser.add_argument('--stats', nargs = '+', default = ['mean', 'count', 'min', 'max', 'pct'], choices = STATS)
+    parser.add_argument('--percentiles', type = float, nargs = '+', default = [5, 50, 95])
+    parser.add_argument('--pct-range', type = float, nargs = 2, default = None, metavar = ('LOW', 'HIGH'))
+    parser.add_argument('--per-file', action = 'store_true')
+    parser.add_argument('--workers', type = int, default = None)
+    args = parser.parse_args()
+
+    if args.zones.endswith('.npy'):
+        zones = np.load(args.zones)
+    else:
+        with open(args.zones) as f:
+            features = json.load(f)['features']
+        zones = {(int(feature['properties'][args.label_property]) if args.label_property else i): feature
+                 for i, feature in enumerate(features)}
+
+    result = zonal_stats(find_inputs(args.inputs), args.var, zones, args.stats, args.percentiles, args.pct_range,
+                         per_file = args.per_file, workers = args.workers)
+    result.to_netcdf(args.output)
+    print(result)